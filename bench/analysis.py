@@ -2,30 +2,51 @@ import logging
 import os
 import concurrent.futures
 from concurrent.futures import ALL_COMPLETED
-from typing import List, Dict
+from typing import List, Dict, Optional, Any, Tuple
+import numpy as np
 import pandas as pd
-from matplotlib import pyplot as plt
-from pynotstdlib.collection import avg
 
+from bench.stats import load_stats, STATS_COLUMN_NAMES
 from bench.types import TestResult
 
+# Reported by the timing wrapper inside the container, in seconds, kilobytes and counts.
+TIMING_COLUMNS = ["user_time", "sys_time", "max_rss_kb", "voluntary_switches", "involuntary_switches"]
+# Written into each stats file's header by the cgroup sampler.
+SAMPLER_COLUMNS = ["achieved_rate", "sampler_cpu_time", "sampler_load"]
+# Per second rates of the cumulative counters: (metric, counter, scale), e.g. bytes/s and IOPS.
+# Pressure stall totals are in microseconds, so their rate is the fraction of the time something waited.
+RATE_METRICS = [
+    ("io_read_rate",     "io_read_bytes",    1.0),
+    ("io_write_rate",    "io_write_bytes",   1.0),
+    ("io_read_iops",     "io_read_ops",      1.0),
+    ("io_write_iops",    "io_write_ops",     1.0),
+    ("net_rx_rate",      "net_rx_bytes",     1.0),
+    ("net_tx_rate",      "net_tx_bytes",     1.0),
+    ("net_rx_pps",       "net_rx_packets",   1.0),
+    ("net_tx_pps",       "net_tx_packets",   1.0),
+    ("page_fault_rate",  "memory_faults",    1.0),
+    ("major_fault_rate", "memory_majfaults", 1.0),
+    ("cpu_stall",        "cpu_pressure",     1e-6),
+    ("memory_stall",     "memory_pressure",  1e-6),
+    ("io_stall",         "io_pressure",      1e-6),
+]
+RATE_COLUMNS = [metric for metric, _, _ in RATE_METRICS]
+# Levels rather than counters, only their peak is summarised.
+GAUGE_COLUMNS = ["pids", "memory_rss", "memory_swap"]
+
 
 def analyze_data(test_results: List[TestResult],
                  result_dir: str,
                  first_run_csv: str,
                  overall_run_csv: str,
-                 first_run_title: str,
-                 overall_run_title: str,
-                 should_plot: bool = False) -> None:
+                 test_summary: Optional[Dict[str, Optional[float]]] = None,
+                 export_csv: bool = True) -> Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame]]:
 
     logging.debug("Making results directories")
 
     dirs_to_make = [
         result_dir,
         "{0}/tables".format(result_dir),
-        "{0}/figures".format(result_dir),
-        "{0}/figures/first".format(result_dir),
-        "{0}/figures/overall".format(result_dir),
     ]
 
     for d in dirs_to_make:
@@ -33,68 +54,125 @@ def analyze_data(test_results: List[TestResult],
         if not os.path.exists(d):
             os.makedirs(d, exist_ok = True)
 
+    # Every sample is read once, both tables are computed from the same columns.
+    samples = compute_metrics(load_samples(test_results))
+
     with concurrent.futures.ThreadPoolExecutor(max_workers = os.cpu_count()) as executors:
-        f1 = executors.submit(analyze_first_run, *(test_results, first_run_csv))
-        f2 = executors.submit(analyze_overall, *(test_results, overall_run_csv))
+        f1 = executors.submit(analyze_first_run, *(test_results, first_run_csv if export_csv else None, samples))
+        f2 = executors.submit(analyze_overall, *(test_results, overall_run_csv if export_csv else None,
+                                                 samples, test_summary))
 
         concurrent.futures.wait([f1, f2], timeout = None, return_when = ALL_COMPLETED)
 
-        if should_plot:
-            f3 = executors.submit(plot_data, **{
-                "plot_title" : first_run_title,
-                "csv_to_read": first_run_csv,
-                "plot_type"  : "first_run",
-                "plot_dir"   : dirs_to_make[3] # {0}/figures/first
-            })
-
-            f4 = executors.submit(plot_data, **{
-                "plot_title" : overall_run_title,
-                "csv_to_read": overall_run_csv,
-                "plot_type"  : "overall_run",
-                "plot_dir"   : dirs_to_make[4] # {0}/figures/overall
-            })
+    return f1.result(), f2.result()
 
-            concurrent.futures.wait([f3, f4], timeout = None, return_when = ALL_COMPLETED)
 
+def load_samples(test_results: List[TestResult]) -> pd.DataFrame:
+    # All the stats rows of a test in one frame, tagged with the iteration they came from.
+    columns: Dict[str, List[np.ndarray]] = {column: [] for column in STATS_COLUMN_NAMES}
+    iterations: List[np.ndarray] = []
 
-def analyze_first_run(test_results: List[TestResult], first_run_csv: str) -> None:
+    for result in test_results:
+        if result.stats_file is None or not os.path.exists(result.stats_file):
+            logging.warning("No stats found for iteration {0}".format(result.iteration))
+            continue
+        stats = load_stats(result.stats_file)
+        for column in STATS_COLUMN_NAMES:
+            columns[column].append(stats[column])
+        iterations.append(np.full(len(stats), result.iteration, dtype = np.int64))
+
+    if len(iterations) == 0:
+        return pd.DataFrame({column: np.empty(0) for column in ["iteration"] + STATS_COLUMN_NAMES})
+
+    frame = {"iteration": np.concatenate(iterations)}
+    frame.update({column: np.concatenate(parts) for column, parts in columns.items()})
+    return pd.DataFrame(frame)
+
+
+def sampler_metadata(result: TestResult) -> Dict[str, Any]:
+    if result.stats_file is None or not os.path.exists(result.stats_file):
+        return {}
+    return load_stats(result.stats_file).metadata
+
+
+def compute_metrics(samples: pd.DataFrame) -> pd.DataFrame:
+    # Per interval metrics, Docker reports the previous reading next to the current one,
+    # so CPU percent is cpu delta / system delta * online CPUs, like `docker stats`.
+    metrics = samples.copy()
+
+    cpu_delta = (metrics["cpu_total"] - metrics["precpu_total"]).to_numpy()
+    system_delta = (metrics["cpu_system"] - metrics["precpu_system"]).to_numpy()
+    online_cpus = metrics["cpu_online"].fillna(1).to_numpy()
+    valid = (system_delta > 0) & (cpu_delta >= 0) & (metrics["precpu_system"].to_numpy() > 0)
+    metrics["cpu_percent"] = np.where(valid, cpu_delta / np.where(valid, system_delta, 1) * online_cpus * 100, np.nan)
+
+    limit = metrics["memory_limit"].to_numpy()
+    metrics["memory_working_set"] = metrics["memory_usage"] - metrics["memory_cache"].fillna(0)
+    metrics["memory_percent"] = np.where(limit > 0, metrics["memory_usage"].to_numpy() / np.where(limit > 0, limit, 1) * 100, np.nan)
+
+    # Throttling counters are cumulative, so only the difference between readings means anything.
+    by_iteration = metrics.groupby("iteration", sort = False)
+    periods = by_iteration["cpu_periods"].diff().to_numpy()
+    throttled = by_iteration["cpu_throttled"].diff().to_numpy()
+    metrics["throttled_ratio"] = np.where(periods > 0, throttled / np.where(periods > 0, periods, 1), np.nan)
+    metrics["throttled_time"] = by_iteration["cpu_throttled_ns"].diff() / 1e9
+    metrics["throttled_periods"] = by_iteration["cpu_throttled"].diff()
+
+    # A counter that went backwards was reset (or is missing), the interval has no rate.
+    elapsed = by_iteration["read"].diff().to_numpy()
+    for metric, counter, scale in RATE_METRICS:
+        delta = by_iteration[counter].diff().to_numpy()
+        valid = (elapsed > 0) & (delta >= 0)
+        metrics[metric] = np.where(valid, delta / np.where(valid, elapsed, 1) * scale, np.nan)
+
+    return metrics
+
+
+def analyze_first_run(test_results: List[TestResult], first_run_csv: Optional[str],
+                      samples: Optional[pd.DataFrame] = None) -> Optional[pd.DataFrame]:
     logging.info("Processing {0} results".format(len(test_results)))
 
     if len(test_results) == 0:
         logging.warning("No test data collected.")
-        return
+        return None
 
-    usage_df = []
     logging.info("Processing first run info")
-    first_run = test_results[0]
-    for stats in first_run.system_info:
-        date_recorded = stats["read"]
-
-        total_cpu_usage: int = stats["cpu_stats"]["cpu_usage"]["total_usage"]
-        user_cpu_usage: int = stats["cpu_stats"]["cpu_usage"]["usage_in_kernelmode"]
-        kernel_cpu_usage: int = stats["cpu_stats"]["cpu_usage"]["usage_in_usermode"]
-        per_cpu_usage: List[int] = stats["cpu_stats"]["cpu_usage"]["percpu_usage"]
-
-        avg_memory_usage = stats["memory_stats"]["usage"]
-        max_memory_usage = stats["memory_stats"]["max_usage"]
-        memory_cache = stats["memory_stats"]["stats"]["cache"]
-
-        stat_data = {"time_recorded"   : date_recorded,
-                     "total_cpu_usage" : total_cpu_usage,
-                     "user_cpu_usage"  : user_cpu_usage,
-                     "kernel_cpu_usage": kernel_cpu_usage,
-                     "avg_per_usage"   : avg(per_cpu_usage),
-                     "avg_memory_usage": avg_memory_usage,
-                     "max_memory_usage": max_memory_usage,
-                     "memory_cache"    : memory_cache
-                     }
-        usage_df.append(stat_data)
-
-    logging.info("Writing first run info")
-    pd.DataFrame(usage_df).to_csv(first_run_csv)
-
-
-def analyze_overall(test_results: List[TestResult], overall_run_csv: str) -> None:
+    if samples is None:
+        samples = compute_metrics(load_samples(test_results[:1]))
+    first_run = samples[samples["iteration"] == test_results[0].iteration]
+
+    usage_df = pd.DataFrame({
+        "time_recorded"     : pd.to_datetime(first_run["read"], unit = "s"),
+        "total_cpu_usage"   : first_run["cpu_total"],
+        "user_cpu_usage"    : first_run["cpu_user"],
+        "kernel_cpu_usage"  : first_run["cpu_kernel"],
+        "avg_per_usage"     : first_run["cpu_percpu_avg"],
+        "cpu_percent"       : first_run["cpu_percent"],
+        "avg_memory_usage"  : first_run["memory_usage"],
+        "max_memory_usage"  : first_run["memory_max_usage"],
+        "memory_cache"      : first_run["memory_cache"],
+        "memory_working_set": first_run["memory_working_set"],
+        "memory_percent"    : first_run["memory_percent"],
+        "throttled_ratio"   : first_run["throttled_ratio"],
+        "throttled_time"    : first_run["throttled_time"],
+        "throttled_periods" : first_run["throttled_periods"],
+        "memory_rss"        : first_run["memory_rss"],
+        "memory_swap"       : first_run["memory_swap"],
+        "pids"              : first_run["pids"],
+    })
+    for column in RATE_COLUMNS:
+        usage_df[column] = first_run[column]
+    usage_df = usage_df.reset_index(drop = True)
+
+    if first_run_csv is not None:
+        logging.info("Writing first run info")
+        usage_df.to_csv(first_run_csv)
+    return usage_df
+
+
+def analyze_overall(test_results: List[TestResult], overall_run_csv: Optional[str],
+                    samples: Optional[pd.DataFrame] = None,
+                    test_summary: Optional[Dict[str, Optional[float]]] = None) -> Optional[pd.DataFrame]:
 
     # For the table
     # Test Name and executor run
@@ -103,129 +181,69 @@ def analyze_overall(test_results: List[TestResult], overall_run_csv: str) -> Non
     # Get max memory usage
 
     logging.info("Processing overall run data")
-    general_df = []
 
     if len(test_results) == 0:
         logging.warning("No test results collected.")
-        return
+        return None
+
+    if samples is None:
+        samples = compute_metrics(load_samples(test_results))
+
+    # One row of aggregates per iteration, computed column-wise.
+    by_iteration = samples.groupby("iteration")
+    aggregates = pd.DataFrame({
+        "max_cpu_usage"   : by_iteration["cpu_total"].max(),
+        "avg_cpu_percent" : by_iteration["cpu_percent"].mean(),
+        "max_cpu_percent" : by_iteration["cpu_percent"].max(),
+        "avg_memory_usage": by_iteration["memory_usage"].mean(),
+        "max_memory_usage": by_iteration["memory_max_usage"].max(),
+        "throttled_time"  : by_iteration["throttled_time"].sum(min_count = 1),
+        "throttled_ratio" : (by_iteration["cpu_throttled"].max() - by_iteration["cpu_throttled"].min()) /
+                            (by_iteration["cpu_periods"].max() - by_iteration["cpu_periods"].min()).replace(0, np.nan),
+        "throttled_periods": by_iteration["throttled_periods"].sum(min_count = 1),
+    })
+    for column in GAUGE_COLUMNS:
+        aggregates["max_" + column] = by_iteration[column].max()
+    for column in RATE_COLUMNS:
+        aggregates["avg_" + column] = by_iteration[column].mean()
+        aggregates["max_" + column] = by_iteration[column].max()
+
+    results = pd.DataFrame({
+        "iteration" : [result.iteration for result in test_results],
+        "time_taken": [result.time_taken for result in test_results],
+        "test_time" : [result.test_time for result in test_results],
+        # Which docker host each sample ran on.
+        "host"      : [result.host for result in test_results],
+    })
+    # Test_time is the reference time, so this is the test time in units of the reference benchmark.
+    results["normalized_test"] = results["time_taken"] / results["test_time"]
+    # What the container reported about itself, missing when the test was timed from the host.
+    results["orchestration_overhead"] = [result.orchestration_time if result.orchestration_time is not None
+                                         else np.nan for result in test_results]
+    for column in TIMING_COLUMNS:
+        results[column] = [getattr(result.timing, column) if result.timing is not None else np.nan
+                           for result in test_results]
+    # What the stats sampler cost, so a high polling rate can be checked against the test itself.
+    for column in SAMPLER_COLUMNS:
+        results[column] = [sampler_metadata(result).get(column, np.nan) for result in test_results]
+    # Per test values, like how many samples it needed and how precise their mean got.
+    summary = test_summary if test_summary is not None else {"samples_used": len(test_results)}
+    for column, value in summary.items():
+        results[column] = value if value is not None else np.nan
+
+    general_df = results.join(aggregates, on = "iteration")
+    # Iterations without any stats keep the historical zeros.
+    general_df[["max_cpu_usage", "avg_memory_usage", "max_memory_usage"]] = \
+        general_df[["max_cpu_usage", "avg_memory_usage", "max_memory_usage"]].fillna(0)
+
+    overall_df = general_df[["iteration", "max_cpu_usage", "avg_cpu_percent", "max_cpu_percent", "avg_memory_usage",
+                             "max_memory_usage", "throttled_ratio", "throttled_time", "throttled_periods",
+                             "time_taken", "test_time", "normalized_test", "orchestration_overhead", "host"] +
+                            ["max_" + column for column in GAUGE_COLUMNS] +
+                            [prefix + column for column in RATE_COLUMNS for prefix in ["avg_", "max_"]] +
+                            TIMING_COLUMNS + SAMPLER_COLUMNS + list(summary.keys())]
+    if overall_run_csv is not None:
+        logging.info("Writing overall run data")
+        overall_df.to_csv(overall_run_csv)
+    return overall_df
 
-    for result in test_results:
-        iteration = result.iteration
-        time_taken = result.time_taken
-        test_time = result.test_time
-        stats: List[Dict[str, Dict[str, Dict[str, int]]]] = result.system_info
-
-        # Test_time is the average test time
-        normalized_test_time = (1 / test_time) * time_taken
-
-        cpu_usage_list = list(map(lambda stat: stat["cpu_stats"]["cpu_usage"]["total_usage"], stats))
-        max_cpu_usage = max(cpu_usage_list) if len(cpu_usage_list) > 0 else 0.0
-
-        avg_memory_usage_list = list(map(lambda stat: stat["memory_stats"]["usage"], stats))
-        avg_memory_usage = avg(avg_memory_usage_list) if len(avg_memory_usage_list) > 0 else 0
-
-        max_memory_usage_list = list(map(lambda stat: stat["memory_stats"]["max_usage"], stats))
-        max_memory_usage = max(max_memory_usage_list) if len(max_memory_usage_list) > 0 else 0
-
-        stat_data = {
-            "iteration"       : iteration,
-            "max_cpu_usage"   : max_cpu_usage,
-            "avg_memory_usage": avg_memory_usage,
-            "max_memory_usage": max_memory_usage,
-            "time_taken"      : time_taken,
-            "test_time"       : test_time,
-            "normalized_test" : normalized_test_time
-        }
-
-        general_df.append(stat_data)
-
-    logging.info("Writing overall run data")
-    pd.DataFrame(general_df).to_csv(overall_run_csv)
-
-
-def plot_data(plot_title: str, csv_to_read: str, plot_type: str, plot_dir: str) -> None:
-    logging.info("Plotting test results.")
-
-    assert plot_type in ["first_run", "overall_run"], "Invalid plot type."
-
-    if plot_type == "first_run":
-        plot_first_run(first_run_csv = csv_to_read,
-                       plot_dir = plot_dir,
-                       plot_name = plot_title)
-
-    elif plot_title == "overall_run":
-        plot_overall_run(overall_run_csv = csv_to_read,
-                         plot_dir = plot_dir,
-                         plot_name = plot_title)
-    else:
-        logging.warning("Invalid plot type.")
-
-
-def plot_first_run(first_run_csv: str, plot_dir: str, plot_name: str) -> None:
-    if not os.path.exists(first_run_csv):
-        logging.warning("First run CSV not found.")
-    else:
-        df = pd.read_csv(first_run_csv, index_col = 0)
-
-        if len(df) == 0:
-            logging.warning("Found empty dataframe")
-            return
-
-        # TODO:// Calculate CPU usage percentage.
-        # cpuDelta = res.cpu_stats.cpu_usage.total_usage - res.precpu_stats.cpu_usage.total_usage
-        # systemDelta = res.cpu_stats.system_cpu_usage - res.precpu_stats.system_cpu_usage
-        # RESULT_CPU_USAGE = cpuDelta / systemDelta * 100
-
-        time_recorded = df["time_recorded"]
-        for column in df.columns:
-            if column == "time_recorded":
-                continue
-
-            plot_output = "{0}/{1}_{2}.png".format(plot_dir,
-                                                   plot_name,
-                                                   column)
-            logging.info("Writing plot: " + plot_output)
-
-            if os.path.exists(plot_output):
-                os.remove(plot_output)
-
-            plt.plot(df.index, df[column])
-            plt.xlabel('sample')
-            plt.ylabel(column)
-            plt.title("{0}_{1}".format(plot_name, column))
-            plt.grid(True)
-            plt.savefig(plot_output)
-            # plt.show()
-            plt.close()
-
-
-def plot_overall_run(overall_run_csv: str, plot_dir: str, plot_name: str) -> None:
-    if not os.path.exists(overall_run_csv):
-        logging.warning("Overall run CSV not found.")
-    else:
-        df = pd.read_csv(overall_run_csv, index_col = 0)
-        if len(df) == 0:
-            logging.warning("Found empty dataframe")
-            return
-
-        time_recorded = df["iteration"]
-        for column in df.columns:
-            if column == "iteration":
-                continue
-
-            plot_output = "{0}/{1}_{2}.png".format(plot_dir,
-                                                   plot_name,
-                                                   column)
-            logging.info("Writing plot: " + plot_output)
-
-            if os.path.exists(plot_output):
-                os.remove(plot_output)
-
-            plt.plot(df.index, df[column])
-            plt.xlabel('iteration')
-            plt.ylabel(column)
-            plt.title("{0}_{1}".format(plot_name, column))
-            plt.grid(True)
-            plt.savefig(plot_output)
-            # plt.show()
-            plt.close()
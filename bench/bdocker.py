@@ -1,7 +1,10 @@
+import concurrent.futures
+import io
 import logging
 import os
-import pickle
+import shlex
 import shutil
+import time
 from typing import Dict, Union, Tuple, Optional, Iterator, List
 
 import docker
@@ -12,18 +15,18 @@ from docker.models.containers import Container
 from pkg_resources import resource_filename
 
 from bench import langs
+from bench.context import CONTEXTS, CONTEXT_LABEL, format_size
+from bench.timing import TIMER_COMMAND
 
-def determine_auto_skip(configs: Dict[str, Union[str, int]]) -> bool:
-    # We have a cache.
-    should_cache = False
-    if os.path.exists("cache.pkl"):
-        with open("cache.pkl", "rb") as f:
-            cache = pickle.load(f)
-        should_cache = cache == configs
+# Bump the tag whenever resources/benchmark.cpp or resources/timer.cpp change, so old images get rebuilt.
+BENCHMARK_IMAGE_NAME = "benchmark"
+BENCHMARK_IMAGE_TAG = "3"
 
-    with open("cache.pkl", "wb") as f:
-        pickle.dump(configs, f)
-    return should_cache
+def __built_from(client: DockerClient, docker_image_name: str, digest: str) -> bool:
+    try:
+        return bool(client.images.get(docker_image_name).labels.get(CONTEXT_LABEL) == digest)
+    except docker.errors.ImageNotFound:
+        return False
 
 
 def build_docker_image(docker_image_name: str,
@@ -31,12 +34,33 @@ def build_docker_image(docker_image_name: str,
                        dockerfile: str,
                        root_dir: str) -> Tuple[Optional[str], bool]:
     try:
-        logging.info("Building test image: {0}".format(docker_image_name))
+        # Only what the Dockerfile copies in is sent, not the whole of `root_dir`.
+        context = CONTEXTS.get(root_dir, dockerfile)
+        if __built_from(client, docker_image_name, context.digest):
+            logging.info("Image is up to date: {0}".format(docker_image_name))
+            return docker_image_name, True
+
+        logging.info("Building test image: {0} (context: {1} files, {2})".format(docker_image_name,
+                                                                                context.files,
+                                                                                format_size(context.size)))
         logging.debug("path: " + root_dir + " dockerfile: " + os.path.join(root_dir, dockerfile))
-        docker_image, build_logs = client.images.build(path = root_dir,
-                                                       dockerfile = dockerfile,
-                                                       tag = docker_image_name)
-        logging.info("Built image: {0}".format(docker_image_name))
+        start = time.perf_counter()
+        # The daemon answers once it has the whole context, so the time until then is the upload.
+        build_logs = client.api.build(fileobj = io.BytesIO(context.data),
+                                      custom_context = True,
+                                      dockerfile = "Dockerfile",
+                                      tag = docker_image_name,
+                                      rm = True,
+                                      decode = True,
+                                      labels = {CONTEXT_LABEL: context.digest})
+        uploaded = time.perf_counter() - start
+        for chunk in build_logs:
+            if "error" in chunk:
+                raise BuildError(chunk["error"], [chunk])
+            if "stream" in chunk:
+                logging.debug(str(chunk["stream"]).rstrip())
+        logging.info("Built image: {0} (context uploaded in {1:.3f}s, built in {2:.1f}s)".format(
+                docker_image_name, uploaded, time.perf_counter() - start))
     except BuildError as e:
         print(e)
         return None, False
@@ -44,11 +68,75 @@ def build_docker_image(docker_image_name: str,
         print(e)
         return None, False
     except requests.exceptions.ConnectionError:
+        # With several hosts the others can carry on, the image is just missing on this one.
         logging.error("Could not connect to docker daemon.")
-        exit(0)
+        return None, False
     return docker_image_name, True
 
 
+def build_docker_images(images: List[Tuple[str, str]],
+                        client: DockerClient,
+                        root_dir: str,
+                        max_workers: int = 4) -> Tuple[List[str], List[str]]:
+    # Builds every (image name, dockerfile) pair with a bounded pool, a failed build doesn't stop the others.
+    built: List[str] = []
+    failed: List[str] = []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, max_workers)) as builders:
+        future_to_image = {builders.submit(build_docker_image,
+                                           docker_image_name = docker_image_name,
+                                           client = client,
+                                           dockerfile = dockerfile,
+                                           root_dir = root_dir): docker_image_name
+                           for docker_image_name, dockerfile in images}
+
+        for future in concurrent.futures.as_completed(future_to_image):
+            docker_image_name = future_to_image[future]
+            try:
+                built_image_name, success = future.result()
+            except Exception as e:
+                logging.error("Building {0} raised: {1}".format(docker_image_name, e))
+                built_image_name, success = None, False
+
+            if success and built_image_name is not None:
+                built.append(built_image_name)
+            else:
+                failed.append(docker_image_name)
+
+    dockerfiles = dict(images)
+    context_size = sum(CONTEXTS.get(root_dir, dockerfiles[image]).size for image in built)
+    logging.info("Built {0}/{1} images, {2} of build context".format(len(built), len(built) + len(failed),
+                                                                      format_size(context_size)))
+    return built, failed
+
+
+def get_exec_command(client: DockerClient, image: str, command: str) -> List[str]:
+    # The full command line the image runs, its entrypoint followed by the test command.
+    entrypoint = client.images.get(image).attrs.get("Config", {}).get("Entrypoint") or []
+    if isinstance(entrypoint, str):
+        entrypoint = shlex.split(entrypoint)
+    return list(entrypoint) + shlex.split(command)
+
+
+def get_image_digest(client: DockerClient, image: str) -> Optional[str]:
+    # The image id changes with any change to the image, unlike its tag.
+    try:
+        return str(client.images.get(image).id)
+    except docker.errors.ImageNotFound:
+        return None
+
+
+def pull_missing_image(client: DockerClient, image: str) -> None:
+    # Prebuilt images are pulled up front, their id says whether earlier results still hold.
+    if get_image_digest(client, image) is not None:
+        return
+    logging.info("Pulling {0}".format(image))
+    try:
+        client.images.pull(image)
+    except APIError as e:
+        logging.warning("Pulling {0} failed: {1}".format(image, e))
+
+
 def get_test_command() -> str:
     return "/benchmark"
 
@@ -72,36 +160,39 @@ def __image_exists(client: DockerClient, name: str, tag: str):
 def get_default_bench_image(root_dir: str, client: DockerClient) -> str:
     test_base_image = "scratch:latest"
 
-    # find benchmark_source file
-    if os.path.exists("resources/benchmark.cpp"):
-        benchmark_file = os.path.join("resources", "benchmark.cpp")
-    else:
-        benchmark_file = resource_filename("bench", "resources/benchmark.cpp")
+    if not os.path.exists(root_dir + "/images"):
+        os.makedirs(root_dir + "/images")
 
-    shutil.copy(src = benchmark_file, dst = os.path.join(root_dir, "images", "benchmark.cpp"))
+    # find benchmark_source file (and the timing wrapper that ships next to it)
+    for source in ["benchmark.cpp", "timer.cpp"]:
+        if os.path.exists("resources/" + source):
+            source_file = os.path.join("resources", source)
+        else:
+            source_file = resource_filename("bench", "resources/" + source)
 
-    benchmark_dir = os.path.abspath(os.path.dirname(benchmark_file))
+        shutil.copy(src = source_file, dst = os.path.join(root_dir, "images", source))
 
     cpp = langs.CPP()
 
     dockerfile_contents = cpp.get_build_image(tag = "clang")
     dockerfile_contents.append("FROM clang as builder")
     dockerfile_contents.append("ADD {0} /benchmark.cpp".format("benchmark.cpp"))
+    dockerfile_contents.append("ADD {0} /timer.cpp".format("timer.cpp"))
     dockerfile_contents.append("RUN clang++-7 -x c++ /benchmark.cpp -o benchmark -static")
+    dockerfile_contents.append("RUN clang++-7 -x c++ /timer.cpp -o bench_timer -static")
     dockerfile_contents.extend(cpp.get_run_image())
     dockerfile_contents.append("COPY --from=builder /benchmark /benchmark")
-
-    if not os.path.exists(root_dir + "/images"):
-        os.makedirs(root_dir + "/images")
+    dockerfile_contents.append("COPY --from=builder /bench_timer {0}".format(TIMER_COMMAND))
 
     with open(root_dir + "/images/benchmark_Dockerfile", "w+") as output_dockerfile:
         output_dockerfile.write("\n".join(dockerfile_contents))
 
     assert os.path.exists(root_dir + "/images/benchmark_Dockerfile"), "benchmark dockerfile not found."
 
-    if not __image_exists(client, "benchmark", "latest"):
+    benchmark_image = "{0}:{1}".format(BENCHMARK_IMAGE_NAME, BENCHMARK_IMAGE_TAG)
+    if not __image_exists(client, BENCHMARK_IMAGE_NAME, BENCHMARK_IMAGE_TAG):
         logging.debug("Creating benchmark image with steps: {0}".format(len(dockerfile_contents)))
-        name, success = build_docker_image(docker_image_name = "benchmark:latest",
+        name, success = build_docker_image(docker_image_name = benchmark_image,
                                            client = client,
                                            dockerfile = "benchmark_Dockerfile",
                                            root_dir = root_dir + "/images/")
@@ -125,82 +216,41 @@ def get_default_bench_image(root_dir: str, client: DockerClient) -> str:
         assert bench_code == 0, "Benchmark image failed while running."
         return name
     else:
-        return "benchmark:latest"
+        return benchmark_image
 
 
-def generate_docker_file(root: str, files: List[str], root_dir: str) -> Iterator[Tuple[str, str, str]]:
-    for file in files:
-        # Could build with multiple executables. (like pypy and python)
-        for lang in get_lang(file):
-            if lang == "go":
-                root_container = "golang:1.11.1-alpine"
-                entry_command = "go run {0}".format(file)
+def get_timed_image(client: DockerClient, image: str, bench_image: str) -> str:
+    # Prebuilt images don't have the timing wrapper, so it's layered on top of them.
+    repository, _, tag = image.rpartition(":") if ":" in image.split("/")[-1] else (image, "", "latest")
+    timed_image = "{0}:{1}-timed".format(repository, tag)
 
-            elif lang == "pypy":
-                root_container = "pypy:3-6.0.0-slim-jessie"
-                entry_command = "pypy3 {0}".format(file)
+    dockerfile = "FROM {0}\nCOPY --from={1} {2} {2}\n".format(image, bench_image, TIMER_COMMAND)
+    try:
+        client.images.build(fileobj = io.BytesIO(dockerfile.encode("utf-8")), tag = timed_image, rm = True)
+    except (BuildError, APIError) as e:
+        logging.warning("Could not add the timing wrapper to {0}: {1}".format(image, e))
+        return image
+    return timed_image
 
-            elif lang == "python":
-                root_container = "python:3.6.6-slim-jessie"
-                entry_command = "python3 {0}".format(file)
 
-            else:
-                logging.warning("Unknown language: " + lang)
-                continue
-
-            test_container = "golang:1.11.1-alpine"
-            test_file = "baseline.go"
-
-            # These all have to be relative to the root_dir.
-            requirements = ""
-            if files.__contains__("requirements.txt"):
-                requirements = os.path.join(root.replace(root_dir, ""), "requirements.txt")
-
-            if not os.path.exists(root_dir + "/images"):
-                os.mkdir(root_dir + "/images")
-
-            dockerfile_contents = [
-                "FROM {0} as test_builder".format(test_container),
-                "ADD ./{0} /go/src/github.com/mattpaletta/Little-Book-Of-Semaphores/{0}".format(test_file),
-                "WORKDIR /go/src/github.com/mattpaletta/Little-Book-Of-Semaphores",
-                "RUN go install /go/src/github.com/mattpaletta/Little-Book-Of-Semaphores",
-                "RUN CGO_ENABLED=0 GOOS=linux go build -a -installsuffix cgo -tags netgo -installsuffix netgo -o app .",
-                "",
-                "FROM {0}".format(root_container),
-                # "ENTRYPOINT ['/bin/bash']"
-            ]
-
-            if lang == "go":
-                dockerfile_contents.append("WORKDIR /go/src/github.com/mattpaletta/Little-Book-Of-Semaphores")
-                dockerfile_contents.append("COPY --from=test_builder /go/src/github.com/mattpaletta/Little-Book-Of-Semaphores/app ./app")
-                dockerfile_contents.append("ADD {0} ./{1}".format(os.path.join(root.replace(root_dir, ""), file), file))
-
-                dockerfile_contents.append("RUN apk add git")
-                dockerfile_contents.append("RUN go get .")
-                dockerfile_contents.append("RUN go build -i {0}".format(file))
-                # entry_command = "./{0}".format(file.split(".")[0])
-            else:
-                # Most of them can just write to /app, except golang.
-                dockerfile_contents.append("WORKDIR /app")
-                dockerfile_contents.append(
-                    "COPY --from=test_builder /go/src/github.com/mattpaletta/Little-Book-Of-Semaphores/app ./app")
-                dockerfile_contents.append("ADD {0} /app/{1}".format(os.path.join(root.replace(root_dir, ""), file), file))
+def generate_docker_file(root: str, files: List[str], root_dir: str,
+                         timer_image: Optional[str] = None) -> Iterator[Tuple[str, str, str, str]]:
+    # (dockerfile, entry command, file, runtime) for each language each file can run with, e.g. python and pypy.
+    source_dir = os.path.relpath(root, root_dir)
+    if not os.path.exists(root_dir + "/images"):
+        os.mkdir(root_dir + "/images")
 
-            if requirements != "" and lang in ["pypy", "python"]:
-                dockerfile_contents.append("ADD {0} /app/requirements.txt".format(requirements))
-                dockerfile_contents.append("RUN pip3 install -r requirements.txt")
+    for file in files:
+        for lang in langs.get_languages(file):
+            # Only the manifests this test has, they're copied (and installed) before its source.
+            manifests = [manifest for manifest in lang.manifests if manifest in files]
+            dockerfile_contents = lang.dockerfile(source_dir, file, manifests)
+
+            if timer_image is not None:
+                dockerfile_contents.append("COPY --from={0} {1} {1}".format(timer_image, TIMER_COMMAND))
 
-            output_dockerfile_name = "Dockerfile_{0}_{1}".format(root.replace(root_dir, "").strip("./"), lang)
+            output_dockerfile_name = "Dockerfile_{0}_{1}".format(root.replace(root_dir, "").strip("./"), lang.name)
 
             with open(root_dir + "/images/" + output_dockerfile_name, "w+") as output_dockerfile:
                 output_dockerfile.write("\n".join(dockerfile_contents))
-            yield "images/" + output_dockerfile_name, entry_command, file
-
-
-def get_lang(file: str) -> Iterator[str]:
-    ending = file.split(".")[-1]
-    if ending == "py":
-        yield "python"
-        yield "pypy"
-    elif ending == "go":
-        yield "go"
+            yield "images/" + output_dockerfile_name, lang.entry_command(file), file, lang.runtime(file)
@@ -1,41 +1,301 @@
 import logging
 import os
-import shutil
-import tempfile
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from configs import Parser
-from git import Repo
-from pkg_resources import resource_filename
-
-from bench.tests import run_tests
 from pynotstdlib.logging import default_logging
 
+from bench.types import BaselineSettings, AdaptiveSettings, ExecutionSettings, RetrySettings, SamplerSettings
 
-def main() -> None:
-    default_logging(logging.INFO)
+# Each command imports what it uses when it runs, docker, pandas and matplotlib alone take about
+# a second to import, which every `bench status` in CI would otherwise pay for. bench.types is only namedtuples.
 
-    if os.path.exists("resources/argparse.yml"):
-        p = Parser(os.path.join("resources", "argparse.yml")).get()
-    else:
-        p = Parser(resource_filename("bench", "resources/argparse.yml")).get()
-
-    if p["git"] is not None and p["git"] != "":
-        cloned_dir = os.path.join(tempfile.gettempdir(), "bench")
-        if os.path.exists(cloned_dir):
-            shutil.rmtree(cloned_dir, ignore_errors = True)
-            os.mkdir(cloned_dir)
-
-        Repo.clone_from(p["git"], cloned_dir)
-        if p["testing_dir"] != "./":
-            root_dir = os.path.join(cloned_dir, p["testing_dir"])
-        else:
-            root_dir = cloned_dir
+
+def _as_bool(value: object) -> bool:
+    # Values from the command line arrive as strings.
+    if isinstance(value, str):
+        return value.lower() in ["true", "1", "yes", "y"]
+    return bool(value)
+
+
+def __load_config() -> Dict[str, Any]:
+    # Next to the package rather than through pkg_resources, which is slow to import.
+    local_config = os.path.join("resources", "argparse.yml")
+    if not os.path.exists(local_config):
+        local_config = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "argparse.yml")
+    config: Dict[str, Any] = Parser(local_config).get()
+    return config
+
+
+def __results_db(p: Dict[str, Any]) -> str:
+    from bench.store import get_results_db
+    return str(p["results_db"]) if p["results_db"] != "" else get_results_db(p["results_dir"])
+
+
+def __checkout(p: Dict[str, Any]) -> Tuple[str, Optional[str], Optional[str], Optional[List[str]]]:
+    # The directory with the tests, and with --git the mirror's url, commit and the tests that changed.
+    if p["git"] is None or p["git"] == "":
+        return p["testing_dir"], None, None, None
+
+    from bench.gitmirror import DEFAULT_GIT_CACHE, parse_git_source, update_mirror, get_changed_tests, \
+        get_last_commit
+
+    only_tests: Optional[List[str]] = None
+    git_url, base, head = parse_git_source(p["git"])
+    repo = update_mirror(git_url, cache_dir = p["git_cache"] if p["git_cache"] != "" else DEFAULT_GIT_CACHE,
+                         revision = head)
+    git_commit = repo.head.commit.hexsha
+
+    # Only the tests that changed since the last benchmarked commit (or the start of the range) are run.
+    base = base if base is not None else get_last_commit(p["results_dir"], git_url)
+    if base is not None and not _as_bool(p["all_tests"]):
+        only_tests = get_changed_tests(repo, base, git_commit, p["testing_dir"])
+        if only_tests is not None:
+            logging.info("Changed since {0}: {1}".format(base[:10], ", ".join(only_tests) or "nothing"))
+
+    if p["testing_dir"] != "./":
+        root_dir = os.path.join(str(repo.working_tree_dir), p["testing_dir"])
     else:
-        root_dir = p["testing_dir"]
+        root_dir = str(repo.working_tree_dir)
+    return root_dir, git_url, git_commit, only_tests
+
+
+def __execution(p: Dict[str, Any]) -> ExecutionSettings:
+    return ExecutionSettings(mode = p["execution_mode"],
+                             warmup_iterations = int(p["warmup_iterations"]),
+                             timing = p["timing"],
+                             host_affinity = _as_bool(p["host_affinity"]),
+                             backend = p["backend"])
+
+
+def __timeout(value: Any) -> Optional[float]:
+    return float(value) if float(value) > 0 else None
+
+
+def run(p: Dict[str, Any]) -> int:
+    from bench.gitmirror import set_last_commit
+    from bench.hosts import HostPool, get_host_slots, parse_docker_hosts
+    from bench.limits import all_measured, has_failures
+    from bench.profiles import get_profile, load_profiles, parse_core_counts, required_cores
+    from bench.scheduler import get_cpu_slots, get_online_cpus
+    from bench.tests import run_tests
+
+    root_dir, git_url, git_commit, only_tests = __checkout(p)
+    if only_tests is not None and len(only_tests) == 0:
+        logging.info("No tests changed, nothing to run.")
+        if git_url is not None and git_commit is not None:
+            set_last_commit(p["results_dir"], git_url, git_commit)
+        return 0
+
+    profiles, test_profiles = load_profiles(p["profiles_file"])
+    profile = get_profile(profiles, p["profile"])
+    # "auto" scales up to the slot size, or to every CPU bench doesn't keep for itself.
+    core_counts = parse_core_counts(str(p["scaling"]),
+                                    available = int(p["slot_size"]) if int(p["slot_size"]) > 1
+                                    else max(1, len(get_online_cpus()) - int(p["reserved_cpus"])))
+    slot_settings: Dict[str, Any] = {
+        # Every slot is big enough for the most cores a test asks for.
+        "slot_size"       : max(int(p["slot_size"]),
+                                required_cores([profile] + list(test_profiles.values()), core_counts)),
+        "max_slots"       : int(p["concurrency"]),
+        "guard_cpus"      : int(p["guard_cpus"]),
+        "reserved_cpus"   : int(p["reserved_cpus"]),
+        "numa_aware"      : _as_bool(p["numa_aware"]),
+        "use_smt_siblings": _as_bool(p["smt_siblings"]),
+    }
+    # The native backend never talks to docker, its slots are this machine's.
+    hosts = HostPool(parse_docker_hosts(p["docker_hosts"])) if p["backend"] != "native" else None
+    cpu_slots = get_host_slots(hosts, **slot_settings) if hosts is not None else get_cpu_slots(**slot_settings)
+    logging.info("Measuring on {0} CPU slot(s): {1}".format(len(cpu_slots),
+                                                          " | ".join("{0} ({1})".format(slot.cpus, slot.host)
+                                                                     for slot in cpu_slots)))
+
+    outcomes = run_tests(root_dir = root_dir, auto_skip = _as_bool(p["auto_skip"]),
+                         docker_image_prefix = p["docker_image_prefix"],
+                         size_of_sample = int(p["sample_size"]), change_threshold = p["change_threshold"],
+                         results_dir = p["results_dir"], should_plot = _as_bool(p["plot"]), cpu_slots = cpu_slots,
+                         build_workers = int(p["build_workers"]),
+                         baseline = BaselineSettings(mode = p["baseline_mode"],
+                                                     target_duration = float(p["baseline_duration"]),
+                                                     window_size = int(p["baseline_window"]),
+                                                     refresh_every = int(p["baseline_refresh"]),
+                                                     max_age = float(p["baseline_max_age"])),
+                         adaptive = AdaptiveSettings(min_samples = max(3, int(p["min_samples"])),
+                                                     max_samples = max(3, int(p["min_samples"]),
+                                                                       int(p["max_samples"])),
+                                                     target_ci_width = float(p["target_ci_width"]),
+                                                     confidence = float(p["confidence"]))
+                         if _as_bool(p["adaptive"]) else None,
+                         execution = __execution(p),
+                         sampler = SamplerSettings(source = p["stats_source"],
+                                                   rate = max(1, int(p["sample_rate"])),
+                                                   cgroup_root = p["cgroup_root"]),
+                         results_db = p["results_db"] if p["results_db"] != "" else None,
+                         export_csv = _as_bool(p["export_csv"]),
+                         only_tests = only_tests,
+                         hosts = hosts,
+                         profile = profile,
+                         test_profiles = test_profiles,
+                         core_counts = core_counts,
+                         retry = RetrySettings(max_attempts = max(1, int(p["max_retries"])),
+                                               base_delay = float(p["retry_delay"]),
+                                               max_delay = float(p["retry_max_delay"]),
+                                               test_timeout = __timeout(p["test_timeout"]),
+                                               benchmark_timeout = __timeout(p["benchmark_timeout"])),
+                         resume = _as_bool(p["resume"]))
+
+    # Tests that weren't measured are picked up by the next run's diff, as long as the commit stays where it was.
+    if git_url is not None and git_commit is not None and all_measured(outcomes):
+        set_last_commit(p["results_dir"], git_url, git_commit)
+    # Every test got its turn, but the ones that timed out or were given up on still fail the run.
+    return 1 if has_failures(outcomes) else 0
+
+
+def build(p: Dict[str, Any]) -> int:
+    from bench.hosts import HostPool, parse_docker_hosts
+    from bench.tests import build_tests
+
+    if p["backend"] == "native":
+        # Native runs use the tests as they are checked out, without images or a docker daemon.
+        logging.info("Nothing to build for the native backend.")
+        return 0
 
-    run_tests(root_dir = root_dir, auto_skip = p["auto_skip"], docker_image_prefix = p["docker_image_prefix"],
-              size_of_sample = int(p["sample_size"]), change_threshold = p["change_threshold"],
-              results_dir = p["results_dir"], should_plot = p["plot"])
+    root_dir, _, _, only_tests = __checkout(p)
+    _, failed = build_tests(root_dir = root_dir,
+                            docker_image_prefix = p["docker_image_prefix"],
+                            build_workers = int(p["build_workers"]),
+                            execution = __execution(p),
+                            only_tests = only_tests,
+                            hosts = HostPool(parse_docker_hosts(p["docker_hosts"])))
+    return 1 if len(failed) > 0 else 0
+
+
+def analyze(p: Dict[str, Any]) -> int:
+    # Writes the tables of the newest stored run of each test, without measuring anything.
+    from bench.analysis import analyze_data
+    from bench.checkpoint import find_checkpoints
+    from bench.store import ResultsStore, first_run_label
+
+    store = ResultsStore(__results_db(p))
+    tables_dir = os.path.join(p["results_dir"], "tables")
+    os.makedirs(tables_dir, exist_ok = True)
+
+    runs = store.latest_runs()
+    for latest in runs.to_dict("records"):
+        for label, kind in [(latest["label"], "overall"), (first_run_label(latest["label"]), "first_run")]:
+            store.export_csv(int(latest["run_id"]), os.path.join(tables_dir, "{0}.csv".format(label)), kind)
+    runs.drop(columns = ["parameters", "summary"]).to_csv(os.path.join(tables_dir, "summary.csv"))
+    logging.info("Wrote the tables of {0} runs to {1}".format(len(runs), tables_dir))
+
+    # Tests an interrupted run didn't finish, from the samples they checkpointed.
+    partial_dir = os.path.join(tables_dir, "partial")
+    for header, results in find_checkpoints(p["results_dir"]):
+        if len(results) == 0:
+            continue
+        os.makedirs(partial_dir, exist_ok = True)
+        analyze_data(sorted(results, key = lambda result: result.iteration), p["results_dir"],
+                     os.path.join(partial_dir, "{0}.csv".format(header["first_run"])),
+                     os.path.join(partial_dir, "{0}.csv".format(header["label"])),
+                     test_summary = {"samples_used": len(results)})
+        logging.info("Wrote the partial tables of {0} ({1} samples)".format(header["label"], len(results)))
+    return 0
+
+
+def plot(p: Dict[str, Any]) -> int:
+    from bench.plotting import render_report
+    from bench.store import ResultsStore
+
+    render_report(p["results_dir"], ResultsStore(__results_db(p)))
+    return 0
+
+
+def compare(p: Dict[str, Any]) -> int:
+    from bench.compare import compare_runs, report
+    from bench.store import ResultsStore
+
+    store = ResultsStore(__results_db(p))
+    comparisons = compare_runs(store,
+                               metric = p["compare_metric"],
+                               candidate_commit = p["candidate"] if p["candidate"] != "" else None,
+                               reference_commit = p["reference"] if p["reference"] != "" else None,
+                               baseline_runs = int(p["baseline_runs"]),
+                               test_name = p["compare_test"] if p["compare_test"] != "" else None,
+                               same_host = not _as_bool(p["any_host"]),
+                               effect_size = float(p["effect_size"]),
+                               alpha = float(p["alpha"]),
+                               confidence = float(p["confidence"]),
+                               resamples = int(p["bootstrap_resamples"]))
+    return report(comparisons, output_csv = os.path.join(p["results_dir"], "comparison.csv"))
+
+
+def status(p: Dict[str, Any]) -> int:
+    # What's been measured so far, read straight from the results directory.
+    import json
+
+    from bench.checkpoint import find_checkpoints
+
+    for header, results in find_checkpoints(p["results_dir"]):
+        print("Unfinished: {0:<40} {1:>4} samples checkpointed, `bench run --resume` carries on".format(
+                header["label"], len(results)))
+
+    results_db = __results_db(p)
+    if not os.path.exists(results_db):
+        print("No results in {0}".format(results_db))
+        return 0
+
+    from bench.store import ResultsStore
+    runs = ResultsStore(results_db).latest_runs()
+    print("{0} tests in {1}".format(len(runs), results_db))
+    for latest in runs.to_dict("records"):
+        print("  {0:<40} {1:<12} {2}  {3:<10} {4:>4} samples, median {5:.4f}s".format(
+                latest["label"], latest["runtime"],
+                time.strftime("%Y-%m-%d %H:%M", time.localtime(latest["started_at"])),
+                str(latest["git_commit"])[:10] if latest["git_commit"] is not None else "-",
+                latest["samples"], latest["median_time"] if latest["median_time"] is not None else float("nan")))
+
+    git_state = os.path.join(p["results_dir"], "git_state.json")
+    if os.path.exists(git_state):
+        with open(git_state, "r") as f:
+            for url, commit in sorted(json.load(f).items()):
+                print("Last benchmarked {0}: {1}".format(url, commit))
+    return 0
+
+
+COMMANDS: Dict[str, Tuple[Callable[[Dict[str, Any]], int], str]] = {
+    "run"    : (run, "Build and measure the tests (the default)"),
+    "build"  : (build, "Only build the test images"),
+    "analyze": (analyze, "Write the tables of the latest stored runs"),
+    "plot"   : (plot, "Plot the latest stored runs into an HTML report"),
+    "compare": (compare, "Check the latest runs against the stored history, non-zero on a regression"),
+    "status" : (status, "Show what's been measured"),
+}
+
+
+def __usage() -> str:
+    lines = ["usage: bench <command> [options]", "", "commands:"]
+    lines.extend("  {0:<8} {1}".format(name, description) for name, (_, description) in COMMANDS.items())
+    lines.extend(["", "`bench <command> --help` lists the options."])
+    return "\n".join(lines)
+
+
+def main() -> None:
+    # `bench [run] --option ...` keeps working, the command is only looked for in the first argument.
+    command = "run"
+    if len(sys.argv) > 1:
+        if sys.argv[1] in COMMANDS:
+            command = sys.argv.pop(1)
+        elif sys.argv[1] in ["-h", "--help", "help"]:
+            print(__usage())
+            return
+        elif not sys.argv[1].startswith("-"):
+            print("Unknown command: {0}\n\n{1}".format(sys.argv[1], __usage()), file = sys.stderr)
+            sys.exit(2)
+
+    default_logging(logging.INFO)
+    fn, _ = COMMANDS[command]
+    sys.exit(fn(__load_config()))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import logging
+import os
+import shlex
+import threading
+from typing import Dict, List, Optional, Any
+
+import docker
+from docker import DockerClient
+
+# Bump this when a change to bench should invalidate every previous result.
+CACHE_VERSION = 1
+
+
+def __hash_path(digest: "hashlib._Hash", root_dir: str, path: str) -> None:
+    full_path = os.path.normpath(os.path.join(root_dir, path))
+    if os.path.isdir(full_path):
+        for root, dirs, files in os.walk(full_path):
+            dirs.sort()
+            for file in sorted(files):
+                __hash_path(digest, root_dir, os.path.relpath(os.path.join(root, file), root_dir))
+    elif os.path.isfile(full_path):
+        digest.update(path.encode("utf-8"))
+        with open(full_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                digest.update(chunk)
+    else:
+        digest.update("missing:{0}".format(path).encode("utf-8"))
+
+
+def get_dockerfile_sources(dockerfile_contents: str) -> List[str]:
+    # Files the Dockerfile pulls from the build context, i.e. ADD/COPY without --from.
+    sources: List[str] = []
+    for line in dockerfile_contents.splitlines():
+        parts = shlex.split(line.strip()) if line.strip() != "" else []
+        if len(parts) < 3 or parts[0].upper() not in ["ADD", "COPY"]:
+            continue
+        if any(part.startswith("--from") for part in parts[1:-1]):
+            continue
+        sources.extend(part for part in parts[1:-1] if not part.startswith("--"))
+    return sources
+
+
+def get_dockerfile_base_images(dockerfile_contents: str) -> List[str]:
+    # Images the stages start from, an earlier stage of the same Dockerfile isn't one.
+    images: List[str] = []
+    stages: List[str] = []
+    for line in dockerfile_contents.splitlines():
+        parts = line.strip().split()
+        if len(parts) < 2 or parts[0].upper() != "FROM":
+            continue
+        if parts[1] not in stages:
+            images.append(parts[1])
+        if len(parts) >= 4 and parts[2].upper() == "AS":
+            stages.append(parts[3])
+    return images
+
+
+def __image_id(client: Optional[DockerClient], image: str) -> Optional[str]:
+    # The local image id, so a rebuilt or re-pulled tag counts as a change. None until the image
+    # is on the host, natively there's no image to look at and the reference is all there is.
+    if client is None or image == "scratch":
+        return image
+    try:
+        return str(client.images.get(image).id)
+    except docker.errors.ImageNotFound:
+        return None
+
+
+def compute_cache_key(root_dir: str,
+                      dockerfile: Optional[str],
+                      image: str,
+                      run_params: Dict[str, Any],
+                      client: Optional[DockerClient] = None) -> Optional[str]:
+    # None while an image it depends on hasn't been pulled (or built) yet, such a test can't be
+    # fresh, and is keyed again once its image is there. A digest pin (image@sha256:...) in the
+    # Dockerfile also changes the key when the pin does.
+    digest = hashlib.sha256()
+    digest.update("version:{0}".format(CACHE_VERSION).encode("utf-8"))
+    digest.update(json.dumps(run_params, sort_keys = True, default = str).encode("utf-8"))
+
+    if dockerfile is None:
+        # Prebuilt image, it's only as fresh as its id.
+        image_id = __image_id(client, image)
+        if image_id is None:
+            return None
+        digest.update(image_id.encode("utf-8"))
+        return digest.hexdigest()
+
+    with open(os.path.join(root_dir, dockerfile), "r") as f:
+        dockerfile_contents = f.read()
+    digest.update(dockerfile_contents.encode("utf-8"))
+
+    for base_image in get_dockerfile_base_images(dockerfile_contents):
+        base_id = __image_id(client, base_image)
+        if base_id is None:
+            return None
+        digest.update(base_id.encode("utf-8"))
+
+    for source in get_dockerfile_sources(dockerfile_contents):
+        __hash_path(digest, root_dir, source)
+
+    return digest.hexdigest()
+
+
+class BuildCache(object):
+    # Maps an image name to the key of its last successfully measured build.
+    def __init__(self, cache_file: str) -> None:
+        self.cache_file = cache_file
+        self._lock = threading.Lock()
+        self._entries: Dict[str, str] = {}
+
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, "r") as f:
+                    self._entries = json.load(f)
+            except (ValueError, OSError):
+                logging.warning("Ignoring unreadable cache: {0}".format(cache_file))
+
+    def is_fresh(self, image: str, key: str) -> bool:
+        with self._lock:
+            return self._entries.get(image) == key
+
+    def update(self, image: str, key: str) -> None:
+        with self._lock:
+            self._entries[image] = key
+            directory = os.path.dirname(self.cache_file)
+            if directory != "" and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok = True)
+
+            tmp_file = self.cache_file + ".tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(self._entries, f, indent = 2, sort_keys = True)
+            os.replace(tmp_file, self.cache_file)
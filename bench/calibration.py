@@ -0,0 +1,161 @@
+import collections
+import logging
+import math
+import os
+import threading
+import time
+from typing import Callable, Deque, Dict, Optional, Union
+
+from bench.types import BaselineSettings
+
+# Number of primes checked by the reference benchmark before it could be calibrated.
+DEFAULT_BENCHMARK_ITERATIONS = 100
+
+DEFAULT_BASELINE = BaselineSettings(mode = "paired",
+                                    target_duration = 0.0,
+                                    window_size = 5,
+                                    refresh_every = 10,
+                                    max_age = 300.0)
+
+# (container settings, iterations) -> seconds the reference benchmark took.
+ReferenceRunner = Callable[[Dict[str, Union[str, int, bool]], int], float]
+
+
+def _median(values: Deque[float]) -> float:
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2 == 1:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def _load_average() -> float:
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return 0.0
+
+
+class BaselineCalibrator(object):
+    # "paired" runs the reference before and after every sample, like bench always has.
+    # "rolling" keeps a window of reference runs per CPU slot, and only refreshes it every
+    # `refresh_every` samples, once it's older than `max_age` seconds, or when the host load
+    # moved by more than `load_tolerance`; a refresh that disagrees with the window retries the sample.
+    def __init__(self,
+                 run_reference: ReferenceRunner,
+                 mode: str = "paired",
+                 change_threshold: float = 5.0,
+                 target_duration: float = 0.0,
+                 window_size: int = 5,
+                 refresh_every: int = 10,
+                 max_age: float = 300.0,
+                 load_tolerance: float = 1.0) -> None:
+        assert mode in ["paired", "rolling"], "Invalid baseline mode."
+        assert window_size > 0, "Window must hold at least one measurement."
+        self.mode = mode
+        self.change_threshold = change_threshold
+        self.target_duration = target_duration
+        self.refresh_every = max(1, refresh_every)
+        self.max_age = max_age
+        self.load_tolerance = load_tolerance
+        self._run_reference = run_reference
+        self._window_size = window_size
+
+        self._lock = threading.Lock()
+        self._iterations: Optional[int] = None
+        self._windows: Dict[str, Deque[float]] = {}
+        self._samples_since_refresh: Dict[str, int] = {}
+        self._last_refresh: Dict[str, float] = {}
+        self._load_at_refresh: Dict[str, float] = {}
+
+    def iterations(self, container_settings: Dict[str, Union[str, int, bool]]) -> int:
+        # Every slot shares the same reference workload, so their normalized times stay comparable.
+        with self._lock:
+            if self._iterations is None:
+                self._iterations = self.__calibrate(container_settings)
+            return self._iterations
+
+    def __calibrate(self, container_settings: Dict[str, Union[str, int, bool]]) -> int:
+        if self.target_duration <= 0:
+            return DEFAULT_BENCHMARK_ITERATIONS
+
+        logging.info("Calibrating reference benchmark to {0}s".format(self.target_duration))
+        # Starting and stopping the container is part of every reference run, only the rest is scaled.
+        overhead = self._run_reference(container_settings, 0)
+        work_target = max(self.target_duration - overhead, 0.1 * self.target_duration)
+
+        iterations = 10
+        for _ in range(4):
+            elapsed = max(self._run_reference(container_settings, iterations) - overhead, 1e-3)
+            scaled = max(1, int(math.ceil(iterations * work_target / elapsed)))
+            # Stop once the estimate settled.
+            if abs(scaled - iterations) <= 0.05 * iterations:
+                iterations = scaled
+                break
+            iterations = scaled
+
+        logging.info("Reference benchmark calibrated to {0} iterations".format(iterations))
+        return iterations
+
+    def __measure(self, container_settings: Dict[str, Union[str, int, bool]]) -> float:
+        return self._run_reference(container_settings, self.iterations(container_settings))
+
+    def __refresh_due(self, slot: str) -> bool:
+        if len(self._windows.get(slot, [])) == 0:
+            return True
+        if self._samples_since_refresh.get(slot, 0) >= self.refresh_every:
+            return True
+        if time.time() - self._last_refresh.get(slot, 0.0) >= self.max_age:
+            return True
+        return abs(_load_average() - self._load_at_refresh.get(slot, 0.0)) > self.load_tolerance
+
+    def __record(self, slot: str, reference_time: float, reset: bool = False) -> None:
+        with self._lock:
+            if reset or slot not in self._windows:
+                self._windows[slot] = collections.deque(maxlen = self._window_size)
+            self._windows[slot].append(reference_time)
+            self._samples_since_refresh[slot] = 0
+            self._last_refresh[slot] = time.time()
+            self._load_at_refresh[slot] = _load_average()
+
+    def before_sample(self, container_settings: Dict[str, Union[str, int, bool]]) -> float:
+        slot = str(container_settings.get("cpuset_cpus", ""))
+        if self.mode == "paired" or len(self._windows.get(slot, [])) == 0:
+            before = self.__measure(container_settings)
+            if self.mode == "rolling":
+                self.__record(slot, before)
+            return before
+        return _median(self._windows[slot])
+
+    def after_sample(self, container_settings: Dict[str, Union[str, int, bool]], before: float) -> Optional[float]:
+        # Returns the reference time for the sample, or None when the host drifted and it should be retried.
+        slot = str(container_settings.get("cpuset_cpus", ""))
+
+        if self.mode == "paired":
+            after = self.__measure(container_settings)
+            if self.__changed(before, after):
+                return None
+            return (before + after) / 2
+
+        with self._lock:
+            self._samples_since_refresh[slot] = self._samples_since_refresh.get(slot, 0) + 1
+
+        if not self.__refresh_due(slot):
+            return _median(self._windows[slot])
+
+        after = self.__measure(container_settings)
+        reference = _median(self._windows[slot])
+        if self.__changed(reference, after):
+            # Start a new window, the old one describes a host that no longer exists.
+            self.__record(slot, after, reset = True)
+            return None
+
+        self.__record(slot, after)
+        return _median(self._windows[slot])
+
+    def __changed(self, before: float, after: float) -> bool:
+        change_percent = ((float(after) - before) / before) * 100
+        if change_percent >= self.change_threshold:
+            logging.info("System seems to have changed by: {0}%.".format(round(change_percent, 4)))
+            return True
+        return False
@@ -0,0 +1,344 @@
+import logging
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Any
+
+from bench.stats import StatsWriter, STATS_COLUMN_NAMES
+from bench.types import SamplerSettings
+
+DEFAULT_CGROUP_ROOT = "/sys/fs/cgroup"
+DEFAULT_SAMPLE_RATE = 50
+DEFAULT_SAMPLER = SamplerSettings(source = "cgroup", rate = DEFAULT_SAMPLE_RATE, cgroup_root = DEFAULT_CGROUP_ROOT)
+
+# Where docker puts a container's cgroup, for the cgroupfs and systemd drivers.
+CGROUP_TEMPLATES = ["docker/{0}", "system.slice/docker-{0}.scope", "docker.slice/docker-{0}.scope"]
+
+# Thread CPU time is only in python 3.7+, process time still bounds it from above.
+_cpu_time = getattr(time, "thread_time", time.process_time)
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def read_lines(path: str) -> List[str]:
+    with open(path, "r") as f:
+        return f.read().splitlines()
+
+
+def _read_value(path: str) -> float:
+    try:
+        value = read_lines(path)[0].strip()
+    except (OSError, IndexError):
+        return math.nan
+    if value == "max":
+        return math.nan
+    try:
+        return float(value)
+    except ValueError:
+        return math.nan
+
+
+def read_keyed(path: str) -> Dict[str, float]:
+    # Files like cpu.stat and memory.stat, one "key value" pair per line.
+    values: Dict[str, float] = {}
+    try:
+        lines = read_lines(path)
+    except OSError:
+        return values
+    for line in lines:
+        parts = line.split()
+        if len(parts) == 2:
+            try:
+                values[parts[0]] = float(parts[1])
+            except ValueError:
+                continue
+    return values
+
+
+def _read_pressure(path: str) -> float:
+    # Total microseconds some task was stalled, from "some avg10=0.00 avg60=0.00 avg300=0.00 total=123".
+    try:
+        lines = read_lines(path)
+    except OSError:
+        return math.nan
+    for line in lines:
+        if line.startswith("some"):
+            for field in line.split()[1:]:
+                key, _, value = field.partition("=")
+                if key == "total":
+                    return float(value)
+    return math.nan
+
+
+def _host_cpu_ns() -> float:
+    # Same as docker's system_cpu_usage, the first seven fields of the cpu line in /proc/stat.
+    try:
+        fields = read_lines("/proc/stat")[0].split()
+    except (OSError, IndexError):
+        return math.nan
+    return sum(float(field) for field in fields[1:8]) * 1e9 / CLOCK_TICKS
+
+
+def _host_memory() -> float:
+    try:
+        for line in read_lines("/proc/meminfo"):
+            if line.startswith("MemTotal:"):
+                return float(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return math.nan
+
+
+class CgroupPaths(object):
+    # The directories a container's counters live in, all the same one on cgroup v2.
+    def __init__(self, version: int, cpu: str, cpuacct: str, memory: str, io: str,
+                 pids: Optional[str] = None) -> None:
+        self.version = version
+        self.cpu = cpu
+        self.cpuacct = cpuacct
+        self.memory = memory
+        self.io = io
+        self.pids = pids if pids is not None else cpu
+
+
+def _find_in(base: str, container_id: str) -> Optional[str]:
+    for template in CGROUP_TEMPLATES:
+        path = os.path.join(base, template.format(container_id))
+        if os.path.isdir(path):
+            return path
+    return None
+
+
+def find_cgroup(container_id: str, cgroup_root: str = DEFAULT_CGROUP_ROOT) -> Optional[CgroupPaths]:
+    if os.path.exists(os.path.join(cgroup_root, "cgroup.controllers")):
+        path = _find_in(cgroup_root, container_id)
+        return CgroupPaths(2, path, path, path, path) if path is not None else None
+
+    # cgroup v1 keeps each controller in its own hierarchy.
+    cpuacct = _find_in(os.path.join(cgroup_root, "cpuacct"), container_id) or \
+        _find_in(os.path.join(cgroup_root, "cpu,cpuacct"), container_id)
+    if cpuacct is None:
+        return None
+    cpu = _find_in(os.path.join(cgroup_root, "cpu"), container_id) or cpuacct
+    memory = _find_in(os.path.join(cgroup_root, "memory"), container_id) or ""
+    io = _find_in(os.path.join(cgroup_root, "blkio"), container_id) or ""
+    pids = _find_in(os.path.join(cgroup_root, "pids"), container_id) or ""
+    return CgroupPaths(1, cpu, cpuacct, memory, io, pids)
+
+
+def _read_net_dev(pid: int) -> Dict[str, float]:
+    # The counters of every interface but loopback in the network namespace of `pid`.
+    totals = {"net_rx_bytes": 0.0, "net_rx_packets": 0.0, "net_tx_bytes": 0.0, "net_tx_packets": 0.0}
+    # "  eth0: rx_bytes rx_packets errs drop fifo frame compressed multicast tx_bytes tx_packets ..."
+    for line in read_lines("/proc/{0}/net/dev".format(pid))[2:]:
+        interface, _, counters = line.partition(":")
+        fields = counters.split()
+        if interface.strip() == "lo" or len(fields) < 10:
+            continue
+        totals["net_rx_bytes"] += float(fields[0])
+        totals["net_rx_packets"] += float(fields[1])
+        totals["net_tx_bytes"] += float(fields[8])
+        totals["net_tx_packets"] += float(fields[9])
+    return totals
+
+
+def _read_v2(paths: CgroupPaths, host_memory: float) -> Dict[str, float]:
+    cpu = read_keyed(os.path.join(paths.cpu, "cpu.stat"))
+    if "usage_usec" not in cpu:
+        raise FileNotFoundError(paths.cpu)
+    memory = read_keyed(os.path.join(paths.memory, "memory.stat"))
+    limit = _read_value(os.path.join(paths.memory, "memory.max"))
+
+    io = {"rbytes": 0.0, "wbytes": 0.0, "rios": 0.0, "wios": 0.0}
+    try:
+        for line in read_lines(os.path.join(paths.io, "io.stat")):
+            for field in line.split()[1:]:
+                key, _, value = field.partition("=")
+                if key in io:
+                    io[key] += float(value)
+    except OSError:
+        io = {key: math.nan for key in io}
+
+    return {
+        "cpu_total"       : cpu["usage_usec"] * 1000,
+        "cpu_kernel"      : cpu.get("system_usec", math.nan) * 1000,
+        "cpu_user"        : cpu.get("user_usec", math.nan) * 1000,
+        "cpu_periods"     : cpu.get("nr_periods", math.nan),
+        "cpu_throttled"   : cpu.get("nr_throttled", math.nan),
+        "cpu_throttled_ns": cpu.get("throttled_usec", math.nan) * 1000,
+        "memory_usage"    : _read_value(os.path.join(paths.memory, "memory.current")),
+        "memory_max_usage": _read_value(os.path.join(paths.memory, "memory.peak")),
+        "memory_cache"    : memory.get("file", math.nan),
+        "memory_limit"    : limit if not math.isnan(limit) else host_memory,
+        "memory_rss"      : memory.get("anon", math.nan),
+        "memory_swap"     : _read_value(os.path.join(paths.memory, "memory.swap.current")),
+        "memory_faults"   : memory.get("pgfault", math.nan),
+        "memory_majfaults": memory.get("pgmajfault", math.nan),
+        "pids"            : _read_value(os.path.join(paths.pids, "pids.current")),
+        "io_read_bytes"   : io["rbytes"],
+        "io_write_bytes"  : io["wbytes"],
+        "io_read_ops"     : io["rios"],
+        "io_write_ops"    : io["wios"],
+        "cpu_pressure"    : _read_pressure(os.path.join(paths.cpu, "cpu.pressure")),
+        "memory_pressure" : _read_pressure(os.path.join(paths.memory, "memory.pressure")),
+        "io_pressure"     : _read_pressure(os.path.join(paths.io, "io.pressure")),
+    }
+
+
+def _read_v1(paths: CgroupPaths, host_memory: float) -> Dict[str, float]:
+    usage = _read_value(os.path.join(paths.cpuacct, "cpuacct.usage"))
+    if math.isnan(usage):
+        raise FileNotFoundError(paths.cpuacct)
+    ticks = read_keyed(os.path.join(paths.cpuacct, "cpuacct.stat"))
+    throttling = read_keyed(os.path.join(paths.cpu, "cpu.stat"))
+    memory = read_keyed(os.path.join(paths.memory, "memory.stat"))
+    limit = _read_value(os.path.join(paths.memory, "memory.limit_in_bytes"))
+
+    try:
+        percpu = [float(value) for value in read_lines(os.path.join(paths.cpuacct, "cpuacct.usage_percpu"))[0].split()]
+    except (OSError, IndexError, ValueError):
+        percpu = []
+
+    io: Dict[str, float] = {}
+    for name, file in [("bytes", "blkio.throttle.io_service_bytes_recursive"),
+                       ("ops", "blkio.throttle.io_serviced_recursive")]:
+        read, write = 0.0, 0.0
+        try:
+            # "8:0 Read 1234", with a "Total" line per device and one for all of them.
+            for line in read_lines(os.path.join(paths.io, file)):
+                parts = line.split()
+                if len(parts) == 3 and parts[1] == "Read":
+                    read += float(parts[2])
+                elif len(parts) == 3 and parts[1] == "Write":
+                    write += float(parts[2])
+        except OSError:
+            read, write = math.nan, math.nan
+        io["io_read_" + name], io["io_write_" + name] = read, write
+
+    return {
+        "cpu_total"       : usage,
+        "cpu_kernel"      : ticks.get("system", math.nan) * 1e9 / CLOCK_TICKS,
+        "cpu_user"        : ticks.get("user", math.nan) * 1e9 / CLOCK_TICKS,
+        "cpu_percpu_avg"  : sum(percpu) / len(percpu) if len(percpu) > 0 else math.nan,
+        "cpu_periods"     : throttling.get("nr_periods", math.nan),
+        "cpu_throttled"   : throttling.get("nr_throttled", math.nan),
+        "cpu_throttled_ns": throttling.get("throttled_time", math.nan),
+        "memory_usage"    : _read_value(os.path.join(paths.memory, "memory.usage_in_bytes")),
+        "memory_max_usage": _read_value(os.path.join(paths.memory, "memory.max_usage_in_bytes")),
+        "memory_cache"    : memory.get("cache", math.nan),
+        # Unlimited containers report a huge number here, docker shows the host's memory instead.
+        "memory_limit"    : min(limit, host_memory) if not math.isnan(host_memory) else limit,
+        "memory_rss"      : memory.get("rss", math.nan),
+        "memory_swap"     : memory.get("swap", math.nan),
+        "memory_faults"   : memory.get("pgfault", math.nan),
+        "memory_majfaults": memory.get("pgmajfault", math.nan),
+        "pids"            : _read_value(os.path.join(paths.pids, "pids.current")),
+        "io_read_bytes"   : io["io_read_bytes"],
+        "io_write_bytes"  : io["io_write_bytes"],
+        "io_read_ops"     : io["io_read_ops"],
+        "io_write_ops"    : io["io_write_ops"],
+    }
+
+
+class CgroupSampler(object):
+    # Polls a container's cgroup files on a background thread, into the same rows `docker stats` produces.
+    # Other sources only have to override `_read`. Network counters aren't in the cgroup, they're read from
+    # the namespace of a process in it, which is only the container's own when it has one (`network`).
+    def __init__(self, paths: Optional[CgroupPaths], stats_writer: StatsWriter,
+                 rate: int = DEFAULT_SAMPLE_RATE, network: bool = True) -> None:
+        assert rate > 0, "Sample rate must be positive."
+        self.paths = paths
+        self.network = network
+        self._net_pid: Optional[int] = None
+        self.stats_writer = stats_writer
+        self.rate = rate
+        self.samples = 0
+        self.cpu_time = 0.0
+        self.wall_time = 0.0
+        self._host_memory = _host_memory()
+        self._online_cpus = float(os.cpu_count() or 1)
+        self._previous: Optional[Dict[str, float]] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target = self.__run, daemon = True)
+        self._started = 0.0
+
+    def __enter__(self) -> "CgroupSampler":
+        self.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
+
+    def _read(self) -> Dict[str, float]:
+        assert self.paths is not None, "No cgroup to read."
+        reading = _read_v2(self.paths, self._host_memory) if self.paths.version == 2 \
+            else _read_v1(self.paths, self._host_memory)
+        if self.network:
+            reading.update(self.__read_network())
+        return reading
+
+    def __read_network(self) -> Dict[str, float]:
+        assert self.paths is not None, "No cgroup to read."
+        try:
+            if self._net_pid is None:
+                self._net_pid = int(read_lines(os.path.join(self.paths.cpu, "cgroup.procs"))[0])
+            return _read_net_dev(self._net_pid)
+        except (OSError, IndexError, ValueError):
+            # Looked up again next time, the process might have exited.
+            self._net_pid = None
+            return {}
+
+    def sample(self) -> Optional[Dict[str, float]]:
+        try:
+            reading = self._read()
+        except FileNotFoundError:
+            # The cgroup is removed as soon as the container exits.
+            return None
+        reading["read"] = time.time()
+        reading["cpu_system"] = _host_cpu_ns()
+        reading["cpu_online"] = self._online_cpus
+        return reading
+
+    def __record(self) -> bool:
+        wall, cpu = time.perf_counter(), _cpu_time()
+        reading = self.sample()
+        if reading is not None:
+            previous = self._previous if self._previous is not None else {}
+            reading["preread"] = previous.get("read", math.nan)
+            reading["precpu_total"] = previous.get("cpu_total", math.nan)
+            reading["precpu_system"] = previous.get("cpu_system", math.nan)
+            self.stats_writer.append([reading.get(column, math.nan) for column in STATS_COLUMN_NAMES])
+            self._previous = reading
+            self.samples += 1
+        self.cpu_time += _cpu_time() - cpu
+        self.wall_time += time.perf_counter() - wall
+        return reading is not None
+
+    def __run(self) -> None:
+        interval = 1.0 / self.rate
+        next_sample = time.perf_counter()
+        while self.__record():
+            next_sample += interval
+            if self._stop.wait(max(0.0, next_sample - time.perf_counter())):
+                break
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        duration = time.perf_counter() - self._started
+        # How much the sampler itself cost, so it can be checked against the test's own usage.
+        self.stats_writer.metadata.update({
+            "sample_rate"      : self.rate,
+            "achieved_rate"    : self.samples / duration if duration > 0 else 0.0,
+            "sampler_cpu_time" : self.cpu_time,
+            "sampler_wall_time": self.wall_time,
+            "sampler_load"     : self.cpu_time / duration if duration > 0 else 0.0,
+        })
+        logging.debug("Sampled {0} rows at {1:.1f} Hz, {2:.4f}s of CPU".format(
+                self.samples, self.samples / duration if duration > 0 else 0.0, self.cpu_time))
@@ -0,0 +1,106 @@
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, IO, Iterator, List, Optional, Tuple
+
+from bench.types import TestResult, TimingInfo
+
+# Next to the test's stats files, the first line says which test and parameters the samples belong to.
+CHECKPOINT_FILE = "checkpoint.jsonl"
+
+
+def _to_json(result: TestResult) -> Dict[str, Any]:
+    record: Dict[str, Any] = result._asdict()
+    record["timing"] = result.timing._asdict() if result.timing is not None else None
+    return record
+
+
+def _from_json(record: Dict[str, Any]) -> TestResult:
+    timing = record.get("timing")
+    return TestResult(time_taken = record["time_taken"],
+                      status = record["status"],
+                      iteration = record["iteration"],
+                      test_time = record["test_time"],
+                      stats_file = record["stats_file"],
+                      orchestration_time = record["orchestration_time"],
+                      timing = TimingInfo(**timing) if timing is not None else None,
+                      host = record.get("host"))
+
+
+def read_checkpoint(path: str) -> Tuple[Dict[str, Any], List[TestResult]]:
+    # The header and every sample that made it to disk, a line cut off by a crash is left out.
+    header: Dict[str, Any] = {}
+    results: List[TestResult] = []
+    if not os.path.exists(path):
+        return header, results
+    with open(path, "r") as f:
+        for number, line in enumerate(f):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logging.warning("Ignoring a partly written sample in {0}".format(path))
+                continue
+            if number == 0:
+                header = record
+            else:
+                results.append(_from_json(record))
+    return header, results
+
+
+def find_checkpoints(results_dir: str) -> Iterator[Tuple[Dict[str, Any], List[TestResult]]]:
+    # Tests that were interrupted (or gave up) before they were stored, with the samples they got.
+    samples_dir = os.path.join(results_dir, "samples")
+    if not os.path.isdir(samples_dir):
+        return
+    for name in sorted(os.listdir(samples_dir)):
+        path = os.path.join(samples_dir, name, CHECKPOINT_FILE)
+        if os.path.exists(path):
+            header, results = read_checkpoint(path)
+            if "label" in header:
+                yield header, results
+
+
+class SampleCheckpoint(object):
+    # Every finished sample of a test is appended (and synced) the moment it's done, so an interrupted run
+    # only loses the samples that were still running. The file is removed once the test is stored.
+    def __init__(self, samples_dir: str, header: Dict[str, Any]) -> None:
+        self.path = os.path.join(samples_dir, CHECKPOINT_FILE)
+        self.header = header
+        self._file: Optional[IO[str]] = None
+        self._lock = threading.Lock()
+
+    def start(self, resume: bool) -> List[TestResult]:
+        # With `resume`, the samples of an earlier attempt at the same test and parameters are kept.
+        header, results = read_checkpoint(self.path) if resume else ({}, [])
+        if header.get("cache_key") != self.header.get("cache_key") or header.get("label") != self.header.get("label"):
+            if len(results) > 0:
+                logging.info("Checkpoint of {0} is for other parameters, starting over".format(self.header["label"]))
+            results = []
+
+        os.makedirs(os.path.dirname(self.path), exist_ok = True)
+        with open(self.path + ".tmp", "w") as f:
+            f.write(json.dumps(self.header, sort_keys = True) + "\n")
+            for result in results:
+                f.write(json.dumps(_to_json(result), sort_keys = True) + "\n")
+        os.replace(self.path + ".tmp", self.path)
+        self._file = open(self.path, "a")
+        return results
+
+    def append(self, result: TestResult) -> None:
+        with self._lock:
+            assert self._file is not None, "Checkpoint wasn't started."
+            self._file.write(json.dumps(_to_json(result), sort_keys = True) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def complete(self) -> None:
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
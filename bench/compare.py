@@ -0,0 +1,148 @@
+import logging
+import math
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from bench.sampling import DEFAULT_CONFIDENCE
+from bench.store import ResultsStore
+from bench.types import Comparison
+
+DEFAULT_EFFECT_SIZE = 0.05
+DEFAULT_ALPHA = 0.05
+DEFAULT_RESAMPLES = 2000
+DEFAULT_BASELINE_RUNS = 5
+
+
+def mann_whitney_u(reference: np.ndarray, candidate: np.ndarray) -> Tuple[float, float]:
+    # U of the candidate and its two-sided p-value, from the normal approximation with a tie
+    # correction. Samples here are a handful to a few hundred values, where that's accurate enough.
+    n1, n2 = len(reference), len(candidate)
+    if n1 == 0 or n2 == 0:
+        return math.nan, 1.0
+
+    values = np.concatenate([reference, candidate])
+    ranks = pd.Series(values).rank(method = "average").to_numpy()
+    u = float(ranks[n1:].sum()) - n2 * (n2 + 1) / 2.0
+
+    n = n1 + n2
+    _, tie_counts = np.unique(values, return_counts = True)
+    tie_term = float(((tie_counts ** 3) - tie_counts).sum()) / (n * (n - 1)) if n > 1 else 0.0
+    sigma = math.sqrt(n1 * n2 / 12.0 * ((n + 1) - tie_term))
+    if sigma == 0:
+        return u, 1.0
+
+    # Continuity corrected.
+    z = (abs(u - n1 * n2 / 2.0) - 0.5) / sigma
+    return u, min(1.0, math.erfc(max(z, 0.0) / math.sqrt(2)))
+
+
+def bootstrap_median_ratio(reference: np.ndarray, candidate: np.ndarray,
+                           confidence: float = DEFAULT_CONFIDENCE,
+                           resamples: int = DEFAULT_RESAMPLES,
+                           seed: int = 0) -> Tuple[float, float, float]:
+    # Candidate median over reference median, with a percentile bootstrap interval.
+    ratio = float(np.median(candidate) / np.median(reference))
+    rng = np.random.RandomState(seed)
+    reference_medians = np.median(rng.choice(reference, size = (resamples, len(reference))), axis = 1)
+    candidate_medians = np.median(rng.choice(candidate, size = (resamples, len(candidate))), axis = 1)
+    ratios = candidate_medians / reference_medians
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(ratios, [tail, 100 - tail])
+    return ratio, float(low), float(high)
+
+
+def compare_samples(reference: np.ndarray, candidate: np.ndarray,
+                    effect_size: float = DEFAULT_EFFECT_SIZE,
+                    alpha: float = DEFAULT_ALPHA,
+                    confidence: float = DEFAULT_CONFIDENCE,
+                    resamples: int = DEFAULT_RESAMPLES) -> Tuple[str, float, float, float, float]:
+    reference = reference[np.isfinite(reference)]
+    candidate = candidate[np.isfinite(candidate)]
+    if len(reference) < 2 or len(candidate) < 2:
+        return "insufficient", math.nan, math.nan, math.nan, math.nan
+
+    _, p_value = mann_whitney_u(reference, candidate)
+    ratio, low, high = bootstrap_median_ratio(reference, candidate, confidence, resamples)
+
+    # Has to be significant, and the whole interval past 1, and big enough to care about.
+    if p_value < alpha and low > 1 and ratio >= 1 + effect_size:
+        verdict = "regression"
+    elif p_value < alpha and high < 1 and ratio <= 1 / (1 + effect_size):
+        verdict = "improvement"
+    else:
+        verdict = "unchanged"
+    return verdict, ratio, low, high, p_value
+
+
+def compare_runs(store: ResultsStore,
+                 metric: str = "normalized_test",
+                 candidate_commit: Optional[str] = None,
+                 reference_commit: Optional[str] = None,
+                 baseline_runs: int = DEFAULT_BASELINE_RUNS,
+                 test_name: Optional[str] = None,
+                 same_host: bool = True,
+                 effect_size: float = DEFAULT_EFFECT_SIZE,
+                 alpha: float = DEFAULT_ALPHA,
+                 confidence: float = DEFAULT_CONFIDENCE,
+                 resamples: int = DEFAULT_RESAMPLES) -> List[Comparison]:
+    # The newest run of every test (at the candidate commit, if given) against the runs before it.
+    candidates = store.find_runs(test_name = test_name, git_commit = candidate_commit)
+    candidates = candidates.drop_duplicates(subset = ["test_name", "runtime", "label"], keep = "first")
+
+    comparisons: List[Comparison] = []
+    for candidate in candidates.to_dict("records"):
+        history = store.find_runs(test_name = candidate["test_name"],
+                                  runtime = candidate["runtime"],
+                                  host = candidate["host"] if same_host else None,
+                                  git_commit = reference_commit)
+        history = history[(history["label"] == candidate["label"]) &
+                          (history["run_id"] != candidate["run_id"]) &
+                          (history["started_at"] < candidate["started_at"])]
+        if reference_commit is None and candidate["git_commit"] is not None:
+            # Re-runs of the same commit aren't a baseline for it.
+            history = history[history["git_commit"] != candidate["git_commit"]]
+        history = history.head(baseline_runs)
+
+        candidate_values = np.concatenate([values for _, values in store.iter_samples(pd.DataFrame([candidate]), metric)])
+        reference_values = np.concatenate([values for _, values in store.iter_samples(history, metric)] + [np.empty(0)])
+
+        verdict, ratio, low, high, p_value = compare_samples(reference_values, candidate_values,
+                                                             effect_size, alpha, confidence, resamples)
+        comparisons.append(Comparison(test_name = candidate["test_name"],
+                                      runtime = candidate["runtime"],
+                                      label = candidate["label"],
+                                      reference_runs = len(history),
+                                      reference_samples = len(reference_values),
+                                      candidate_samples = len(candidate_values),
+                                      median_ratio = ratio,
+                                      ci_low = low,
+                                      ci_high = high,
+                                      p_value = p_value,
+                                      verdict = verdict))
+    return comparisons
+
+
+def report(comparisons: List[Comparison], output_csv: Optional[str] = None) -> int:
+    # The exit code for CI, non-zero when anything regressed.
+    table = pd.DataFrame(comparisons, columns = Comparison._fields)
+    if output_csv is not None:
+        table.to_csv(output_csv)
+
+    for comparison in comparisons:
+        message = "{0:<12} {1} ({2}): {3:.3f}x [{4:.3f}, {5:.3f}] p={6:.4f}, {7} vs {8} samples".format(
+                comparison.verdict.upper(), comparison.label, comparison.runtime, comparison.median_ratio,
+                comparison.ci_low, comparison.ci_high, comparison.p_value,
+                comparison.candidate_samples, comparison.reference_samples)
+        if comparison.verdict == "regression":
+            logging.error(message)
+        else:
+            logging.info(message)
+
+    regressions = sum(1 for comparison in comparisons if comparison.verdict == "regression")
+    improvements = sum(1 for comparison in comparisons if comparison.verdict == "improvement")
+    logging.info("Compared {0} tests: {1} regressions, {2} improvements".format(len(comparisons),
+                                                                             regressions,
+                                                                             improvements))
+    return 1 if regressions > 0 else 0
@@ -0,0 +1,138 @@
+import logging
+import math
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from bench.store import ResultsStore
+from bench.types import ComplexityFit, Sweep, TestContainer
+
+# Candidate growth rates, in order, so a fit "worse" than expected is one further down the list.
+COMPLEXITY_CLASSES: List[Tuple[str, Callable[[np.ndarray], np.ndarray]]] = [
+    ("1",         lambda n: np.ones_like(n)),
+    ("log n",     lambda n: np.log(n)),
+    ("n",         lambda n: n),
+    ("n log n",   lambda n: n * np.log(n)),
+    ("n^2",       lambda n: n ** 2),
+    ("n^2 log n", lambda n: n ** 2 * np.log(n)),
+    ("n^3",       lambda n: n ** 3),
+]
+COMPLEXITY_NAMES = [name for name, _ in COMPLEXITY_CLASSES]
+
+
+def log_sweep(start: float, stop: float, points: int) -> List[int]:
+    # e.g. log_sweep(1e3, 1e7, 5) == [1000, 10000, 100000, 1000000, 10000000]
+    assert start > 0 and stop > start and points >= 2, "Need a positive, increasing range of at least 2 points."
+    return sorted(set(int(round(value)) for value in np.logspace(math.log10(start), math.log10(stop), points)))
+
+
+def sweep_name(test_name: str, sweep: Sweep, value: int) -> str:
+    return "{0}_{1}{2}".format(test_name, sweep.parameter, value)
+
+
+def expand_sweep(test: TestContainer) -> List[Tuple[TestContainer, Optional[int]]]:
+    # One container per swept value, the value is filled into `{parameter}` in the run command.
+    if test.sweep is None:
+        return [(test, None)]
+    return [(test._replace(run_command = test.run_command.format(**{test.sweep.parameter: value}),
+                           test_name = sweep_name(test.test_name, test.sweep, value),
+                           sweep = None), value)
+            for value in test.sweep.values]
+
+
+def fit_power_law(n: np.ndarray, y: np.ndarray) -> Tuple[float, float, float]:
+    # y = constant * n ^ exponent, fitted on a log-log scale, with the R² of that fit.
+    log_n, log_y = np.log(n), np.log(y)
+    exponent, intercept = np.polyfit(log_n, log_y, 1)
+    predicted = intercept + exponent * log_n
+    total = float(((log_y - log_y.mean()) ** 2).sum())
+    r_squared = 1 - float(((log_y - predicted) ** 2).sum()) / total if total > 0 else 1.0
+    return float(exponent), float(math.exp(intercept)), r_squared
+
+
+def best_complexity(n: np.ndarray, y: np.ndarray) -> Tuple[str, float]:
+    # y = c * f(n) for each class, weighted by 1/y so small and large n count the same.
+    best_name, best_error = COMPLEXITY_NAMES[0], math.inf
+    for name, growth in COMPLEXITY_CLASSES:
+        f = growth(n) / y
+        c = float(f.sum() / (f ** 2).sum())
+        error = float(((1 - c * f) ** 2).sum())
+        if error < best_error - 1e-12:
+            best_name, best_error = name, error
+    return best_name, best_error
+
+
+def fit_complexity(test_name: str, runtime: str, metric: str, n: np.ndarray, y: np.ndarray,
+                   expected: Optional[str]) -> Optional[ComplexityFit]:
+    valid = np.isfinite(y) & (y > 0) & (n > 1)
+    n, y = n[valid].astype(float), y[valid].astype(float)
+    if len(np.unique(n)) < 3:
+        logging.warning("Not enough sweep points to fit {0} of {1}".format(metric, test_name))
+        return None
+
+    exponent, constant, r_squared = fit_power_law(n, y)
+    best_fit, _ = best_complexity(n, y)
+    exceeds = expected is not None and expected in COMPLEXITY_NAMES and \
+        COMPLEXITY_NAMES.index(best_fit) > COMPLEXITY_NAMES.index(expected)
+    return ComplexityFit(test_name = test_name,
+                         runtime = runtime,
+                         metric = metric,
+                         points = len(n),
+                         exponent = exponent,
+                         constant = constant,
+                         r_squared = r_squared,
+                         best_fit = best_fit,
+                         expected = expected,
+                         exceeds_expected = exceeds)
+
+
+def __median_per_run(store: ResultsStore, run_ids: List[int], column: str) -> List[float]:
+    frames = store.load_columns(run_ids, "overall", [column])
+    return [float(np.nanmedian(frames[run_id][column])) if run_id in frames and column in frames[run_id]
+            and np.isfinite(frames[run_id][column]).any() else math.nan for run_id in run_ids]
+
+
+def fit_sweeps(store: ResultsStore, tests: List[TestContainer]) -> List[ComplexityFit]:
+    # Fits from the newest stored run of each point, so points skipped as unchanged still count.
+    fits: List[ComplexityFit] = []
+    for test in tests:
+        if test.sweep is None:
+            continue
+
+        points: List[Tuple[int, int]] = []
+        runtime = ""
+        for container, value in expand_sweep(test):
+            runs = store.find_runs(test_name = container.test_name, label = "overall_" + container.test_name,
+                                   limit = 1)
+            if len(runs) > 0 and value is not None:
+                points.append((value, int(runs["run_id"].iloc[0])))
+                runtime = str(runs["runtime"].iloc[0])
+
+        if len(points) == 0:
+            continue
+        n = np.array([value for value, _ in points], dtype = float)
+        run_ids = [run_id for _, run_id in points]
+
+        time_taken = np.array(__median_per_run(store, run_ids, "time_taken"))
+        # Peak RSS from inside the container when there is one, otherwise the cgroup's peak.
+        memory = np.array(__median_per_run(store, run_ids, "max_rss_kb")) * 1024
+        memory = np.where(np.isfinite(memory), memory, np.array(__median_per_run(store, run_ids, "max_memory_usage")))
+
+        for metric, values in [("time", time_taken), ("memory", memory)]:
+            # The expectation is about time, memory usually grows differently.
+            fit = fit_complexity(test.test_name, runtime, metric, n, values,
+                                 test.sweep.expected if metric == "time" else None)
+            if fit is None:
+                continue
+            logging.info("{0} {1}: ~ {2:.3g} * n^{3:.2f} (R² {4:.3f}), best fit O({5})".format(
+                    fit.test_name, metric, fit.constant, fit.exponent, fit.r_squared, fit.best_fit))
+            if fit.exceeds_expected:
+                logging.warning("{0} {1} grows like O({2}), expected O({3})".format(fit.test_name, metric,
+                                                                                 fit.best_fit, fit.expected))
+            fits.append(fit)
+    return fits
+
+
+def write_fits(fits: List[ComplexityFit], csv: str) -> None:
+    pd.DataFrame(fits, columns = ComplexityFit._fields).to_csv(csv)
@@ -0,0 +1,105 @@
+import glob
+import hashlib
+import io
+import logging
+import os
+import tarfile
+import threading
+from typing import Dict, List, Tuple
+
+from bench.cache import get_dockerfile_sources
+from bench.types import BuildContext
+
+# Images are labelled with the digest of the context they were built from, so an unchanged one isn't sent again.
+CONTEXT_LABEL = "bench.context"
+
+
+def _context_files(root_dir: str, dockerfile_contents: str) -> List[Tuple[str, str]]:
+    # (path on disk, path in the context) of every file the Dockerfile copies in, in a stable order.
+    files: Dict[str, str] = {}
+    for source in get_dockerfile_sources(dockerfile_contents):
+        relative = os.path.normpath(source.lstrip("/"))
+        if relative.startswith(".."):
+            logging.warning("{0} is outside of the build context, not sending it".format(source))
+            continue
+        matches = sorted(glob.glob(os.path.join(root_dir, relative))) if relative != "." else [root_dir]
+        for match in matches:
+            if os.path.isdir(match):
+                for root, dirs, names in os.walk(match):
+                    dirs.sort()
+                    for name in names:
+                        path = os.path.join(root, name)
+                        files[os.path.relpath(path, root_dir)] = path
+            elif os.path.isfile(match):
+                files[os.path.relpath(match, root_dir)] = match
+    return sorted((path, name) for name, path in files.items())
+
+
+def _add_file(tar: tarfile.TarFile, name: str, data: bytes, mode: int = 0o644) -> None:
+    # No timestamps or owners, the same files always make the same tar.
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = mode
+    tar.addfile(info, io.BytesIO(data))
+
+
+def create_build_context(root_dir: str, dockerfile: str) -> BuildContext:
+    # A tar of the Dockerfile (as "Dockerfile") and exactly what it copies in, instead of all of `root_dir`.
+    with open(os.path.join(root_dir, dockerfile), "rb") as f:
+        dockerfile_contents = f.read()
+
+    buffer = io.BytesIO()
+    files = 1
+    with tarfile.open(fileobj = buffer, mode = "w") as tar:
+        _add_file(tar, "Dockerfile", dockerfile_contents)
+        for path, name in _context_files(root_dir, dockerfile_contents.decode("utf-8")):
+            with open(path, "rb") as f:
+                _add_file(tar, name, f.read(), os.stat(path).st_mode & 0o777)
+            files += 1
+
+    data = buffer.getvalue()
+    return BuildContext(digest = hashlib.sha256(data).hexdigest(),
+                        data = data,
+                        files = files,
+                        size = len(data))
+
+
+class ContextCache(object):
+    # Contexts are made once and reused (e.g. for every docker host) until a file in them changes.
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._contexts: Dict[Tuple[str, str], Tuple[Tuple[Tuple[str, int, int], ...], BuildContext]] = {}
+
+    @staticmethod
+    def __signature(root_dir: str, dockerfile: str) -> Tuple[Tuple[str, int, int], ...]:
+        dockerfile_path = os.path.join(root_dir, dockerfile)
+        with open(dockerfile_path, "r") as f:
+            paths = [dockerfile_path] + [path for path, _ in _context_files(root_dir, f.read())]
+        signature = []
+        for path in paths:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def get(self, root_dir: str, dockerfile: str) -> BuildContext:
+        key = (os.path.abspath(root_dir), dockerfile)
+        signature = self.__signature(root_dir, dockerfile)
+        with self._lock:
+            cached = self._contexts.get(key)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+        context = create_build_context(root_dir, dockerfile)
+        with self._lock:
+            self._contexts[key] = (signature, context)
+        return context
+
+
+CONTEXTS = ContextCache()
+
+
+def format_size(size: float) -> str:
+    for unit in ["B", "KiB", "MiB"]:
+        if size < 1024:
+            return "{0:.1f} {1}".format(size, unit)
+        size /= 1024
+    return "{0:.1f} GiB".format(size)
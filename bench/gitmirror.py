@@ -0,0 +1,104 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from git import Repo, GitCommandError
+
+DEFAULT_GIT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "bench", "mirrors")
+
+_state_lock = threading.Lock()
+
+
+def parse_git_source(source: str) -> Tuple[str, Optional[str], Optional[str]]:
+    # "url", "url#rev" or "url#base..rev", the url itself may contain '@' and ':' so '#' separates.
+    url, _, revisions = source.partition("#")
+    if revisions == "":
+        return url, None, None
+    if ".." in revisions:
+        base, _, head = revisions.partition("..")
+        return url, base if base != "" else None, head if head != "" else None
+    return url, None, revisions
+
+
+def get_mirror_dir(url: str, cache_dir: str = DEFAULT_GIT_CACHE) -> str:
+    return os.path.join(cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest()[:16])
+
+
+def update_mirror(url: str, cache_dir: str = DEFAULT_GIT_CACHE, revision: Optional[str] = None) -> Repo:
+    # Clones once, after that only new objects are fetched, and the work tree is moved to `revision`.
+    path = get_mirror_dir(url, cache_dir)
+    if os.path.exists(os.path.join(path, ".git")):
+        repo = Repo(path)
+        logging.info("Fetching {0} into {1}".format(url, path))
+        repo.remotes.origin.fetch(prune = True, tags = True)
+    else:
+        logging.info("Cloning {0} into {1}".format(url, path))
+        os.makedirs(cache_dir, exist_ok = True)
+        repo = Repo.clone_from(url, path)
+
+    target = revision if revision is not None else "HEAD"
+    # Branches are taken from what was just fetched, local ones in the mirror are never updated.
+    remote_refs = [ref.remote_head for ref in repo.remotes.origin.refs]
+    if target in remote_refs:
+        target = "origin/{0}".format(target)
+    repo.git.checkout("--force", "--detach", target)
+    # Anything left from the last run (like generated Dockerfiles) would otherwise show up as a change.
+    repo.git.clean("-fdx")
+    logging.info("Checked out {0}".format(repo.head.commit.hexsha))
+    return repo
+
+
+def get_changed_tests(repo: Repo, base: str, head: str, testing_dir: str) -> Optional[List[str]]:
+    # Top-level test directories with changes between the commits, None means everything has to run.
+    try:
+        diff = repo.commit(base).diff(repo.commit(head))
+    except (GitCommandError, ValueError) as e:
+        logging.warning("Can't diff {0}..{1}, running every test: {2}".format(base, head, e))
+        return None
+
+    prefix = os.path.normpath(testing_dir)
+    changed = set()
+    for change in diff:
+        for path in [change.a_path, change.b_path]:
+            if path is None:
+                continue
+            relative = os.path.relpath(path, prefix) if prefix != "." else path
+            if relative.startswith(".."):
+                continue
+            parts = relative.split("/")
+            if len(parts) == 1:
+                # Shared files next to the tests could affect any of them.
+                logging.info("{0} changed, running every test".format(path))
+                return None
+            changed.add(parts[0])
+    return sorted(changed)
+
+
+def __state_file(results_dir: str) -> str:
+    return os.path.join(results_dir, "git_state.json")
+
+
+def get_last_commit(results_dir: str, url: str) -> Optional[str]:
+    path = __state_file(results_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        commit: Optional[str] = json.load(f).get(url)
+        return commit
+
+
+def set_last_commit(results_dir: str, url: str, commit: str) -> None:
+    path = __state_file(results_dir)
+    with _state_lock:
+        state: Dict[str, str] = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                state = json.load(f)
+        state[url] = commit
+        os.makedirs(results_dir, exist_ok = True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f, indent = 2, sort_keys = True)
+        os.replace(path + ".tmp", path)
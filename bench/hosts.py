@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+import docker
+from docker import DockerClient
+
+from bench.scheduler import get_cpu_slots, get_remote_cpu_slots
+from bench.store import get_host_description, get_host_fingerprint
+from bench.types import CpuSlot
+
+# The docker daemon from the environment, i.e. DOCKER_HOST or the default socket.
+LOCAL_HOST = "local"
+
+
+class HostUnavailable(Exception):
+    # A job couldn't run because its host (or every host that could run it) is gone.
+    pass
+
+
+def parse_docker_hosts(hosts: str) -> List[str]:
+    # e.g. "unix:///var/run/docker.sock,tcp://10.0.0.2:2375"
+    return [host.strip() for host in hosts.split(",") if host.strip() != ""]
+
+
+def is_local_url(url: str) -> bool:
+    if url == LOCAL_HOST or url.startswith("unix://"):
+        return True
+    return urlparse(url).hostname in ["localhost", "127.0.0.1", "::1"]
+
+
+class HostPool(object):
+    # Every docker host a run can use, with what's known about them: which are still alive,
+    # and which images failed to build where, so no sample is sent somewhere it can't run.
+    def __init__(self, urls: Optional[List[str]] = None, timeout: int = 120) -> None:
+        self.clients: Dict[str, DockerClient] = {}
+        self._lock = threading.Lock()
+        self._failed: Set[str] = set()
+        self._missing_images: Dict[str, Set[str]] = {}
+        self._descriptions: Dict[str, Dict[str, Any]] = {}
+
+        if urls is None or len(urls) == 0:
+            self.clients[LOCAL_HOST] = docker.client.from_env()
+            return
+
+        for url in urls:
+            client = docker.DockerClient(base_url = url, timeout = timeout)
+            try:
+                client.ping()
+            except Exception as e:
+                logging.error("Docker host {0} is unreachable, not using it: {1}".format(url, e))
+                continue
+            self.clients[url] = client
+        assert len(self.clients) > 0, "None of the docker hosts are reachable."
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return [name for name in self.clients.keys() if name not in self._failed]
+
+    def client(self, name: Optional[str] = None) -> DockerClient:
+        # The first host that's still alive stands in for "any host", e.g. to inspect an image.
+        return self.clients[name if name is not None else self.names()[0]]
+
+    def is_alive(self, name: str) -> bool:
+        try:
+            return bool(self.clients[name].ping())
+        except Exception:
+            return False
+
+    def mark_failed(self, name: str) -> None:
+        with self._lock:
+            self._failed.add(name)
+        logging.error("Docker host {0} failed, no more jobs are sent to it".format(name))
+
+    def mark_missing(self, name: str, image: str) -> None:
+        with self._lock:
+            self._missing_images.setdefault(name, set()).add(image)
+
+    def can_run(self, name: str, image: Optional[str] = None) -> bool:
+        with self._lock:
+            return name not in self._failed and (image is None or image not in self._missing_images.get(name, set()))
+
+    def describe(self, name: str) -> Dict[str, Any]:
+        # Like the local host's description, so results from different machines aren't mixed up.
+        with self._lock:
+            if name in self._descriptions:
+                return self._descriptions[name]
+        if name == LOCAL_HOST or is_local_url(name):
+            description = get_host_description()
+        else:
+            info = self.clients[name].info()
+            description = {
+                "hostname" : info.get("Name"),
+                "system"   : info.get("OSType"),
+                "kernel"   : info.get("KernelVersion"),
+                "machine"  : info.get("Architecture"),
+                "os"       : info.get("OperatingSystem"),
+                "cpu_count": info.get("NCPU"),
+                "memory"   : info.get("MemTotal"),
+            }
+        with self._lock:
+            self._descriptions[name] = description
+        return description
+
+    def fingerprint(self, names: List[str]) -> Tuple[str, Dict[str, Any]]:
+        # What a run is stored under, a run that used several hosts gets a fingerprint of its own.
+        unique = sorted(set(names))
+        if len(unique) == 1:
+            description = self.describe(unique[0])
+            return get_host_fingerprint(description), description
+        description = {"hosts": [self.describe(name) for name in unique]}
+        return hashlib.sha256(json.dumps(description, sort_keys = True).encode("utf-8")).hexdigest()[:16], \
+            description
+
+
+def get_host_slots(hosts: HostPool,
+                   slot_size: int = 1,
+                   max_slots: Optional[int] = None,
+                   guard_cpus: int = 0,
+                   reserved_cpus: int = 0,
+                   numa_aware: bool = False,
+                   use_smt_siblings: bool = False) -> List[CpuSlot]:
+    # `max_slots` applies to each host, a machine's topology is only known when it's this one.
+    slots: List[CpuSlot] = []
+    for name in hosts.names():
+        if name == LOCAL_HOST or is_local_url(name):
+            host_slots = get_cpu_slots(slot_size = slot_size,
+                                       max_slots = max_slots,
+                                       guard_cpus = guard_cpus,
+                                       reserved_cpus = reserved_cpus,
+                                       numa_aware = numa_aware,
+                                       use_smt_siblings = use_smt_siblings)
+        else:
+            host_slots = get_remote_cpu_slots(cpu_count = int(hosts.client(name).info().get("NCPU", 1)),
+                                              slot_size = slot_size,
+                                              max_slots = max_slots,
+                                              guard_cpus = guard_cpus,
+                                              reserved_cpus = reserved_cpus)
+        slots.extend(slot._replace(index = len(slots) + i, host = name) for i, slot in enumerate(host_slots))
+    return slots
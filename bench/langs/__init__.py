@@ -1 +1,28 @@
-from bench.langs.cpp import *
\ No newline at end of file
+from typing import Dict, List
+
+from bench.langs.cpp import CPP
+from bench.langs.go import Go
+from bench.langs.java import Java
+from bench.langs.language import Language
+from bench.langs.python import PyPy, Python
+from bench.langs.rust import Rust
+from bench.langs.swift import Swift
+
+__all__ = ["CPP", "Go", "Java", "Language", "PyPy", "Python", "Rust", "Swift", "LANGUAGES", "register", "get_languages"]
+
+# Every language tests can be written in, by name. A file runs with each one that claims its extension.
+LANGUAGES: Dict[str, Language] = {}
+
+
+def register(language: Language) -> None:
+    assert language.name not in LANGUAGES, "Language already registered: {0}".format(language.name)
+    LANGUAGES[language.name] = language
+
+
+def get_languages(file: str) -> List[Language]:
+    extension = file.split(".")[-1] if "." in file else ""
+    return [language for language in LANGUAGES.values() if extension in language.extensions]
+
+
+for _language in [Python(), PyPy(), Go(), CPP(), Rust(), Swift(), Java()]:
+    register(_language)
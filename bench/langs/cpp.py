@@ -1,8 +1,15 @@
 from typing import List, Optional
 
+from bench.langs.language import Language, copy, stem
+
+
+class CPP(Language):
+    name = "cpp"
+    extensions = ["cpp", "cc", "cxx"]
+    image = "gcc:13"
 
-class CPP(object):
     def get_build_image(self, tag: Optional[str] = None) -> List[str]:
+        # The reference benchmark's toolchain, kept as it is so references stay comparable.
         return [
             "FROM ubuntu:18.04" if tag is None else "FROM ubuntu:18.04 AS {0}".format(tag),
             # "RUN apt-get update -y && apt-get install -y wget && " +
@@ -12,3 +19,21 @@ class CPP(object):
 
     def get_run_image(self) -> List[str]:
         return ["FROM scratch"]
+
+    def entry_command(self, file: str) -> str:
+        return "./{0}".format(stem(file))
+
+    def runtime(self, file: str) -> str:
+        return self.name
+
+    def dockerfile(self, source_dir: str, file: str, manifests: List[str]) -> List[str]:
+        return [
+            "FROM {0} AS builder".format(self.image),
+            "WORKDIR /src",
+            copy(source_dir, file, "./{0}".format(file)),
+            "RUN mkdir -p /out && g++ -O2 -std=c++17 -static {0} -o /out/{1}".format(file, stem(file)),
+            "",
+            "FROM debian:bookworm-slim",
+            "WORKDIR /app",
+            "COPY --from=builder /out/{0} ./{0}".format(stem(file)),
+        ]
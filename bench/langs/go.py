@@ -0,0 +1,39 @@
+from typing import List
+
+from bench.langs.language import Language, copy, stem
+
+
+class Go(Language):
+    name = "go"
+    extensions = ["go"]
+    manifests = ["go.mod", "go.sum"]
+    image = "golang:1.22-alpine"
+
+    def entry_command(self, file: str) -> str:
+        return "./{0}".format(stem(file))
+
+    def runtime(self, file: str) -> str:
+        return self.name
+
+    def dockerfile(self, source_dir: str, file: str, manifests: List[str]) -> List[str]:
+        lines = [
+            "FROM {0} AS builder".format(self.image),
+            "RUN apk add --no-cache git",
+            "WORKDIR /src",
+        ]
+        if "go.mod" in manifests:
+            lines.extend(copy(source_dir, manifest, "./{0}".format(manifest)) for manifest in manifests)
+            lines.append("RUN go mod download")
+        else:
+            # Without a module the imports are only known from the source, the build resolves them.
+            lines.append("RUN go mod init bench/test")
+        lines.extend([
+            copy(source_dir, file, "./{0}".format(file)),
+            # Static, so the binary runs on its own and neither compiling nor linking is measured.
+            "RUN mkdir -p /out && CGO_ENABLED=0 go build -mod=mod -o /out/{0} {1}".format(stem(file), file),
+            "",
+            "FROM debian:bookworm-slim",
+            "WORKDIR /app",
+            "COPY --from=builder /out/{0} ./{0}".format(stem(file)),
+        ])
+        return lines
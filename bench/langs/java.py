@@ -0,0 +1,38 @@
+from typing import List
+
+from bench.langs.language import Language, copy, stem
+
+
+class Java(Language):
+    name = "java"
+    extensions = ["java"]
+    manifests = ["pom.xml"]
+    image = "eclipse-temurin:21-jdk"
+
+    def entry_command(self, file: str) -> str:
+        # The class is named after the file, its dependencies are the jars next to it.
+        return "java -cp .:lib/* {0}".format(stem(file))
+
+    def dockerfile(self, source_dir: str, file: str, manifests: List[str]) -> List[str]:
+        lines: List[str] = []
+        if "pom.xml" in manifests:
+            lines.extend([
+                "FROM maven:3.9-eclipse-temurin-21 AS builder",
+                "WORKDIR /src",
+                copy(source_dir, "pom.xml", "./pom.xml"),
+                "RUN mvn -q dependency:copy-dependencies -DoutputDirectory=/out/lib",
+            ])
+        else:
+            lines.extend([
+                "FROM {0} AS builder".format(self.image),
+                "WORKDIR /src",
+            ])
+        lines.extend([
+            copy(source_dir, file, "./{0}".format(file)),
+            "RUN mkdir -p /out/lib && javac -d /out -cp '/out/lib/*' {0}".format(file),
+            "",
+            "FROM eclipse-temurin:21-jre",
+            "WORKDIR /app",
+            "COPY --from=builder /out /app",
+        ])
+        return lines
@@ -0,0 +1,34 @@
+import abc
+import os
+from typing import List
+
+
+class Language(abc.ABC):
+    # How a test file in one language is built into an image and run. The Dockerfile copies the
+    # dependency manifests and installs them before any source, so editing a test only rebuilds
+    # the layers after it.
+    name = ""
+    extensions: List[str] = []
+    # Looked for next to the test, in the order they're copied.
+    manifests: List[str] = []
+
+    @abc.abstractmethod
+    def entry_command(self, file: str) -> str:
+        raise NotImplementedError()
+
+    def runtime(self, file: str) -> str:
+        # What runs are grouped by, the interpreter for interpreted languages.
+        return self.entry_command(file).split(" ")[0]
+
+    @abc.abstractmethod
+    def dockerfile(self, source_dir: str, file: str, manifests: List[str]) -> List[str]:
+        # `source_dir` is the test's directory relative to the build context, `manifests` the ones it has.
+        raise NotImplementedError()
+
+
+def stem(file: str) -> str:
+    return os.path.splitext(os.path.basename(file))[0]
+
+
+def copy(source_dir: str, file: str, destination: str) -> str:
+    return "COPY {0} {1}".format(os.path.normpath(os.path.join(source_dir, file)), destination)
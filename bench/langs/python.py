@@ -0,0 +1,42 @@
+from typing import List
+
+from bench.langs.language import Language, copy
+
+
+class Python(Language):
+    name = "python"
+    extensions = ["py"]
+    manifests = ["requirements.txt"]
+    image = "python:3.12-slim"
+    interpreter = "python3"
+    # Where the image's interpreter looks for packages installed with --prefix.
+    prefix = "/usr/local"
+
+    def entry_command(self, file: str) -> str:
+        return "{0} {1}".format(self.interpreter, file)
+
+    def dockerfile(self, source_dir: str, file: str, manifests: List[str]) -> List[str]:
+        lines: List[str] = []
+        if "requirements.txt" in manifests:
+            lines.extend([
+                "FROM {0} AS dependencies".format(self.image),
+                copy(source_dir, "requirements.txt", "/requirements.txt"),
+                "RUN {0} -m pip install --no-cache-dir --prefix /install -r /requirements.txt".format(self.interpreter),
+                "",
+                "FROM {0}".format(self.image),
+                "COPY --from=dependencies /install {0}".format(self.prefix),
+            ])
+        else:
+            lines.append("FROM {0}".format(self.image))
+        lines.extend([
+            "WORKDIR /app",
+            copy(source_dir, file, "/app/{0}".format(file)),
+        ])
+        return lines
+
+
+class PyPy(Python):
+    name = "pypy"
+    image = "pypy:3.10-slim"
+    interpreter = "pypy3"
+    prefix = "/opt/pypy"
@@ -0,0 +1,43 @@
+from typing import List
+
+from bench.langs.language import Language, copy, stem
+
+
+class Rust(Language):
+    name = "rust"
+    extensions = ["rs"]
+    manifests = ["Cargo.toml", "Cargo.lock"]
+    image = "rust:1.77-slim"
+
+    def entry_command(self, file: str) -> str:
+        return "./{0}".format(stem(file))
+
+    def runtime(self, file: str) -> str:
+        return self.name
+
+    def dockerfile(self, source_dir: str, file: str, manifests: List[str]) -> List[str]:
+        lines = [
+            "FROM {0} AS builder".format(self.image),
+            "WORKDIR /src",
+        ]
+        if "Cargo.toml" in manifests:
+            lines.extend(copy(source_dir, manifest, "./{0}".format(manifest)) for manifest in manifests)
+            # The dependencies are built once against an empty main, the test is the crate's only binary.
+            lines.extend([
+                "RUN mkdir -p src && echo 'fn main() {}' > src/main.rs && cargo build --release",
+                copy(source_dir, file, "src/main.rs"),
+                "RUN touch src/main.rs && cargo build --release && mkdir -p /out && "
+                "find target/release -maxdepth 1 -type f -perm -u+x -exec cp {{}} /out/{0} \\;".format(stem(file)),
+            ])
+        else:
+            lines.extend([
+                copy(source_dir, file, "./{0}".format(file)),
+                "RUN mkdir -p /out && rustc -C opt-level=3 {0} -o /out/{1}".format(file, stem(file)),
+            ])
+        lines.extend([
+            "",
+            "FROM debian:bookworm-slim",
+            "WORKDIR /app",
+            "COPY --from=builder /out/{0} ./{0}".format(stem(file)),
+        ])
+        return lines
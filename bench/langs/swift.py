@@ -0,0 +1,28 @@
+from typing import List
+
+from bench.langs.language import Language, copy, stem
+
+
+class Swift(Language):
+    name = "swift"
+    extensions = ["swift"]
+    image = "swift:5.10"
+
+    def entry_command(self, file: str) -> str:
+        return "./{0}".format(stem(file))
+
+    def runtime(self, file: str) -> str:
+        return self.name
+
+    def dockerfile(self, source_dir: str, file: str, manifests: List[str]) -> List[str]:
+        return [
+            "FROM {0} AS builder".format(self.image),
+            "WORKDIR /src",
+            copy(source_dir, file, "./{0}".format(file)),
+            "RUN mkdir -p /out && swiftc -O {0} -o /out/{1}".format(file, stem(file)),
+            "",
+            # Only the runtime libraries, without the compiler.
+            "FROM {0}-slim".format(self.image),
+            "WORKDIR /app",
+            "COPY --from=builder /out/{0} ./{0}".format(stem(file)),
+        ]
@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, List, Optional, TypeVar
+
+from bench.types import RetrySettings, TestOutcome
+
+T = TypeVar("T")
+
+DEFAULT_RETRY = RetrySettings(max_attempts = 5, base_delay = 2.0, max_delay = 60.0, test_timeout = None,
+                              benchmark_timeout = None)
+
+# What became of each test of a run.
+MEASURED = "measured"
+SKIPPED = "skipped"
+UNAVAILABLE = "unavailable"
+TIMED_OUT = "timed_out"
+ABORTED = "aborted"
+
+
+class SampleTimeout(Exception):
+    # A test ran for longer than its timeout, and was killed.
+    pass
+
+
+class RetriesExhausted(Exception):
+    # Something bench retries, like the reference benchmark or a sample on a noisy host, kept failing.
+    pass
+
+
+def backoff_delay(attempt: int, retry: RetrySettings) -> float:
+    # Doubles with every attempt, up to max_delay. Only the first half is fixed, so the samples
+    # of different slots that failed together don't all come back at the same time.
+    delay = min(retry.max_delay, retry.base_delay * 2 ** max(0, attempt - 1))
+    return float(delay / 2 + random.uniform(0, delay / 2))
+
+
+def with_retries(fn: Callable[[], Optional[T]], retry: RetrySettings, what: str) -> T:
+    # Calls `fn` until it returns something, or raises once it failed `max_attempts` times.
+    for attempt in range(1, retry.max_attempts + 1):
+        result = fn()
+        if result is not None:
+            return result
+        if attempt < retry.max_attempts:
+            delay = backoff_delay(attempt, retry)
+            logging.warning("{0} failed ({1}/{2}), retrying in {3:.1f}s".format(what, attempt, retry.max_attempts,
+                                                                               delay))
+            time.sleep(delay)
+    raise RetriesExhausted("{0} failed {1} times".format(what, retry.max_attempts))
+
+
+class Deadline(object):
+    # Calls `kill` once `timeout` seconds passed, unless the block finished first. It runs on a timer
+    # thread, so whatever was blocked waiting (e.g. a container's wait) returns.
+    def __init__(self, timeout: Optional[float], kill: Callable[[], Any]) -> None:
+        self.timeout = timeout
+        self.expired = False
+        self._kill = kill
+        self._timer: Optional[threading.Timer] = None
+
+    def __enter__(self) -> "Deadline":
+        if self.timeout is not None:
+            self._timer = threading.Timer(self.timeout, self.__expire)
+            self._timer.daemon = True
+            self._timer.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def __expire(self) -> None:
+        self.expired = True
+        logging.warning("Timed out after {0}s, killing it".format(self.timeout))
+        try:
+            self._kill()
+        except Exception as e:
+            # e.g. it exited on its own in the meantime.
+            logging.debug("Kill after timeout failed: {0}".format(e))
+
+
+def summarize(outcomes: List[TestOutcome], results_dir: Optional[str] = None) -> None:
+    # Logs how the run went, and keeps it next to the results as run_summary.json.
+    counts = {status: len([o for o in outcomes if o.status == status])
+              for status in [MEASURED, SKIPPED, UNAVAILABLE, TIMED_OUT, ABORTED]}
+    logging.info("Run summary: {0}".format(", ".join("{0} {1}".format(count, status.replace("_", " "))
+                                                     for status, count in counts.items() if count > 0)
+                                           or "no tests"))
+    for outcome in outcomes:
+        if outcome.status in [UNAVAILABLE, TIMED_OUT, ABORTED]:
+            logging.warning("  {0:<11} {1} ({2}): {3}".format(outcome.status, outcome.test_name, outcome.runtime,
+                                                            outcome.detail))
+
+    if results_dir is not None:
+        os.makedirs(results_dir, exist_ok = True)
+        summary = os.path.join(results_dir, "run_summary.json")
+        with open(summary + ".tmp", "w") as f:
+            json.dump({"finished_at": time.time(),
+                       "counts"     : counts,
+                       "tests"      : [outcome._asdict() for outcome in outcomes]}, f, indent = 2, sort_keys = True)
+        os.replace(summary + ".tmp", summary)
+
+
+def has_failures(outcomes: List[TestOutcome]) -> bool:
+    return any(outcome.status in [TIMED_OUT, ABORTED] for outcome in outcomes)
+
+
+def all_measured(outcomes: List[TestOutcome]) -> bool:
+    # Skipped tests were measured by an earlier run, with the same sources.
+    return all(outcome.status in [MEASURED, SKIPPED] for outcome in outcomes)
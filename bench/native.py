@@ -0,0 +1,334 @@
+import hashlib
+import itertools
+import logging
+import os
+import resource
+import shlex
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+from bench.calibration import BaselineCalibrator, DEFAULT_BASELINE
+from bench.cgroup import CgroupPaths, CgroupSampler, DEFAULT_CGROUP_ROOT, DEFAULT_SAMPLE_RATE, DEFAULT_SAMPLER, \
+    CLOCK_TICKS, read_keyed, read_lines
+from bench.limits import DEFAULT_RETRY, Deadline, SampleTimeout, with_retries
+from bench.scheduler import parse_cpu_list
+from bench.stats import StatsWriter
+from bench.types import BaselineSettings, RetrySettings, SamplerSettings, TimingInfo
+
+# The backend's name, and what its reference is kept under next to the docker hosts'.
+NATIVE_BACKEND = "native"
+# Every native sample gets a transient cgroup under this one, next to the cgroup v2 root's own.
+NATIVE_CGROUP = "bench.slice"
+NATIVE_CONTROLLERS = ["cpu", "cpuset", "memory", "io"]
+DEFAULT_NATIVE_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "bench", "native")
+
+ContainerSettings = Dict[str, Union[str, int, bool]]
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _write(path: str, value: str) -> None:
+    with open(path, "w") as f:
+        f.write(value)
+
+
+def _memory_bytes(value: Optional[Union[str, int, bool]]) -> Optional[int]:
+    # Docker's notation, e.g. 512m or 2g.
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    units = {"b": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    text = value.strip().lower()
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def find_native_command(run_command: str, workdir: Optional[str]) -> Optional[List[str]]:
+    # A test runs natively when it's a source file in a directory and its interpreter is installed here.
+    if workdir is None:
+        return None
+    command = shlex.split(run_command)
+    if len(command) == 0:
+        return None
+    if "/" in command[0]:
+        # A binary next to the test, compiled languages only have one inside their image.
+        if not os.access(os.path.join(workdir, command[0]), os.X_OK):
+            return None
+    elif shutil.which(command[0]) is None:
+        return None
+    return command
+
+
+def _read_proc_stat(pid: int) -> List[str]:
+    # The fields after "pid (comm)", comm can have spaces and parentheses in it.
+    line = read_lines("/proc/{0}/stat".format(pid))[0]
+    return line[line.rfind(")") + 2:].split()
+
+
+def _process_tree(pid: int) -> List[int]:
+    # The test and everything it started, e.g. a launcher script and the interpreter it starts.
+    pids: List[int] = []
+    pending = [pid]
+    while len(pending) > 0:
+        current = pending.pop()
+        pids.append(current)
+        try:
+            for task in os.listdir("/proc/{0}/task".format(current)):
+                with open("/proc/{0}/task/{1}/children".format(current, task), "r") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+class ProcSampler(CgroupSampler):
+    # The same rows for a process tree that doesn't have a cgroup of its own, read from /proc.
+    # Children that were already reaped still count, through their parent's cutime and cstime.
+    def __init__(self, pid: int, stats_writer: StatsWriter, rate: int = DEFAULT_SAMPLE_RATE) -> None:
+        super().__init__(None, stats_writer, rate, network = False)
+        self.pid = pid
+        self._peak = 0.0
+
+    def _read(self) -> Dict[str, float]:
+        user, kernel, rss, read_bytes, write_bytes = 0.0, 0.0, 0.0, 0.0, 0.0
+        faults, majfaults = 0.0, 0.0
+        pids = _process_tree(self.pid)
+        for pid in pids:
+            try:
+                stat = _read_proc_stat(pid)
+            except (OSError, IndexError):
+                if pid == self.pid:
+                    # Reaped, the sample is over.
+                    raise FileNotFoundError("/proc/{0}".format(pid))
+                continue
+            user += float(stat[11]) + float(stat[13])
+            kernel += float(stat[12]) + float(stat[14])
+            rss += float(stat[21]) * _PAGE_SIZE
+            # minflt, cminflt, majflt, cmajflt, the cgroup's pgfault counts major faults too.
+            faults += sum(float(field) for field in stat[7:11])
+            majfaults += float(stat[9]) + float(stat[10])
+            io = read_keyed("/proc/{0}/io".format(pid))
+            read_bytes += io.get("read_bytes:", 0.0)
+            write_bytes += io.get("write_bytes:", 0.0)
+
+        self._peak = max(self._peak, rss)
+        return {
+            "cpu_total"       : (user + kernel) * 1e9 / CLOCK_TICKS,
+            "cpu_kernel"      : kernel * 1e9 / CLOCK_TICKS,
+            "cpu_user"        : user * 1e9 / CLOCK_TICKS,
+            "memory_usage"    : rss,
+            "memory_max_usage": self._peak,
+            "memory_limit"    : self._host_memory,
+            "memory_rss"      : rss,
+            "memory_faults"   : faults,
+            "memory_majfaults": majfaults,
+            "pids"            : float(len(pids)),
+            "io_read_bytes"   : read_bytes,
+            "io_write_bytes"  : write_bytes,
+        }
+
+
+class NativeRunner(object):
+    # Runs commands as local processes instead of containers. With a writable cgroup v2 hierarchy each one
+    # gets a transient cgroup with the sample's CPUs and quota, that's also what it's sampled from.
+    # Otherwise it's only pinned with sched_setaffinity, limited with rlimits and sampled from /proc.
+    def __init__(self, cgroup_root: str = DEFAULT_CGROUP_ROOT, use_cgroup: bool = True) -> None:
+        self.cgroup_parent = self.__setup_cgroup(cgroup_root) if use_cgroup else None
+        self._count = itertools.count()
+        if self.cgroup_parent is None:
+            logging.info("Running natively without a cgroup, samples are read from /proc")
+
+    @staticmethod
+    def __setup_cgroup(cgroup_root: str) -> Optional[str]:
+        if not os.path.exists(os.path.join(cgroup_root, "cgroup.controllers")):
+            return None
+        parent = os.path.join(cgroup_root, NATIVE_CGROUP)
+        try:
+            os.makedirs(parent, exist_ok = True)
+        except OSError as e:
+            logging.warning("Can't create {0}, not using cgroups: {1}".format(parent, e))
+            return None
+
+        # A cgroup only has the controllers its parent hands down. Without them it still counts CPU time.
+        for directory in [cgroup_root, parent]:
+            try:
+                available = " ".join(read_lines(os.path.join(directory, "cgroup.controllers"))).split()
+            except OSError:
+                continue
+            for controller in NATIVE_CONTROLLERS:
+                if controller not in available:
+                    continue
+                try:
+                    _write(os.path.join(directory, "cgroup.subtree_control"), "+" + controller)
+                except OSError as e:
+                    logging.debug("Can't enable {0} in {1}: {2}".format(controller, directory, e))
+        return parent
+
+    def __make_cgroup(self, container_settings: ContainerSettings) -> Optional[str]:
+        if self.cgroup_parent is None:
+            return None
+        path = os.path.join(self.cgroup_parent, "sample-{0}-{1}".format(os.getpid(), next(self._count)))
+        try:
+            os.mkdir(path)
+        except OSError as e:
+            logging.warning("Can't create {0}, the sample is read from /proc: {1}".format(path, e))
+            return None
+
+        memory = _memory_bytes(container_settings.get("mem_limit"))
+        # Docker's memswap_limit is memory and swap together, cgroup v2 only limits the swap.
+        swap = _memory_bytes(container_settings.get("memswap_limit"))
+        limits = [
+            ("cpuset.cpus", container_settings.get("cpuset_cpus")),
+            ("cpu.max", "{0} {1}".format(container_settings["cpu_quota"], container_settings["cpu_period"])
+                if "cpu_quota" in container_settings and "cpu_period" in container_settings else None),
+            ("memory.max", memory),
+            ("memory.swap.max", max(swap - memory, 0) if swap is not None and memory is not None and swap >= 0
+                else None),
+        ]
+        for name, value in limits:
+            if value is None or not os.path.exists(os.path.join(path, name)):
+                continue
+            try:
+                _write(os.path.join(path, name), str(value))
+            except OSError as e:
+                logging.warning("Can't set {0} of {1}: {2}".format(name, path, e))
+        return path
+
+    @staticmethod
+    def __remove_cgroup(path: str) -> None:
+        # The kernel takes a moment to empty it after the last process is reaped.
+        for _ in range(100):
+            try:
+                os.rmdir(path)
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                time.sleep(0.01)
+        logging.warning("Could not remove cgroup {0}".format(path))
+
+    @staticmethod
+    def __kill(process: "subprocess.Popen[bytes]", cgroup: Optional[str]) -> None:
+        # Everything the test started, in its cgroup when it has one (cgroup.kill is linux 5.14+), or its session.
+        if cgroup is not None and os.path.exists(os.path.join(cgroup, "cgroup.kill")):
+            _write(os.path.join(cgroup, "cgroup.kill"), "1")
+        os.killpg(process.pid, signal.SIGKILL)
+
+    @staticmethod
+    def __wait(process: "subprocess.Popen[bytes]") -> Tuple[int, resource.struct_rusage]:
+        _, status, usage = os.wait4(process.pid, 0)
+        # Popen doesn't know the process was reaped.
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+        return process.returncode, usage
+
+    def run(self,
+            command: List[str],
+            cwd: Optional[str],
+            container_settings: ContainerSettings,
+            stats_file: Optional[str] = None,
+            sampler: Optional[SamplerSettings] = None,
+            timeout: Optional[float] = None) -> Tuple[float, int, bytes, TimingInfo]:
+        # Takes the same settings as a container, the ones that only mean something to docker are ignored.
+        sampler = sampler if sampler is not None else DEFAULT_SAMPLER
+        cgroup = self.__make_cgroup(container_settings)
+        cpus = parse_cpu_list(str(container_settings.get("cpuset_cpus", "")))
+        memory = _memory_bytes(container_settings.get("mem_limit"))
+
+        def prepare() -> None:
+            # In the child between fork and exec, so the test never runs outside its limits.
+            if cgroup is not None:
+                _write(os.path.join(cgroup, "cgroup.procs"), "0")
+            if len(cpus) > 0:
+                os.sched_setaffinity(0, cpus)
+            resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+            if memory is not None and cgroup is None:
+                resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+        try:
+            with tempfile.TemporaryFile() as output:
+                start = time.perf_counter()
+                # A session of its own, so whatever it starts can be killed with it.
+                process = subprocess.Popen(command, cwd = cwd, stdin = subprocess.DEVNULL, stdout = output,
+                                           stderr = subprocess.STDOUT, preexec_fn = prepare, start_new_session = True)
+                with Deadline(timeout, lambda: self.__kill(process, cgroup)) as deadline:
+                    if stats_file is None:
+                        exit_code, usage = self.__wait(process)
+                    else:
+                        with StatsWriter(stats_file,
+                                         metadata = {"source": "cgroup" if cgroup is not None else "proc",
+                                                     "mode": "native"}) as stats_writer:
+                            # The process shares this machine's network namespace, its traffic can't be told apart.
+                            with CgroupSampler(CgroupPaths(2, cgroup, cgroup, cgroup, cgroup), stats_writer,
+                                               sampler.rate, network = False) if cgroup is not None \
+                                    else ProcSampler(process.pid, stats_writer, sampler.rate):
+                                exit_code, usage = self.__wait(process)
+                end = time.perf_counter()
+                output.seek(0)
+                test_output = output.read()
+        finally:
+            if cgroup is not None:
+                self.__remove_cgroup(cgroup)
+        if deadline.expired:
+            raise SampleTimeout("{0} ran for longer than {1}s".format(" ".join(command), timeout))
+
+        timing = TimingInfo(elapsed = end - start,
+                            user_time = usage.ru_utime,
+                            sys_time = usage.ru_stime,
+                            max_rss_kb = usage.ru_maxrss,
+                            voluntary_switches = usage.ru_nvcsw,
+                            involuntary_switches = usage.ru_nivcsw)
+        return end - start, exit_code, test_output, timing
+
+
+def get_native_benchmark(cache_dir: str = DEFAULT_NATIVE_CACHE) -> str:
+    # resources/benchmark.cpp compiled for this machine, once per version of the source.
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "benchmark.cpp")
+    with open(source, "rb") as f:
+        binary = os.path.join(cache_dir, "benchmark-{0}".format(hashlib.sha256(f.read()).hexdigest()[:12]))
+    if os.path.exists(binary):
+        return binary
+
+    compiler = os.environ.get("CXX") or shutil.which("c++") or shutil.which("clang++") or shutil.which("g++")
+    assert compiler is not None, "Need a C++ compiler (or $CXX) for the native reference benchmark."
+    os.makedirs(cache_dir, exist_ok = True)
+    logging.info("Compiling the reference benchmark with {0}".format(compiler))
+    # Compiled like the benchmark image, so both references do the same work, only not -static,
+    # which not every platform can link.
+    subprocess.check_call([compiler, "-x", "c++", source, "-o", "{0}.{1}".format(binary, os.getpid())])
+    os.replace("{0}.{1}".format(binary, os.getpid()), binary)
+    return binary
+
+
+def get_native_calibrator(runner: NativeRunner,
+                          change_threshold: float = 5.0,
+                          baseline: Optional[BaselineSettings] = None,
+                          cache_dir: str = DEFAULT_NATIVE_CACHE,
+                          retry: Optional[RetrySettings] = None) -> BaselineCalibrator:
+    settings = baseline if baseline is not None else DEFAULT_BASELINE
+    retry = retry if retry is not None else DEFAULT_RETRY
+    benchmark = get_native_benchmark(cache_dir)
+
+    def run_reference(container_settings: ContainerSettings, iterations: int) -> float:
+        def attempt() -> Optional[float]:
+            try:
+                _, exit_code, _, timing = runner.run([benchmark, str(iterations)], None, container_settings,
+                                                     timeout = retry.benchmark_timeout)
+            except SampleTimeout:
+                return None
+            return float(timing.elapsed) if exit_code == 0 else None
+
+        return with_retries(attempt, retry, "Benchmark")
+
+    return BaselineCalibrator(run_reference = run_reference,
+                              mode = settings.mode,
+                              change_threshold = change_threshold,
+                              target_duration = settings.target_duration,
+                              window_size = settings.window_size,
+                              refresh_every = settings.refresh_every,
+                              max_age = settings.max_age)
@@ -0,0 +1,141 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, TypeVar
+
+from bench.hosts import HostPool, HostUnavailable
+from bench.types import CpuSlot
+
+T = TypeVar("T")
+
+
+class Orchestrator(object):
+    # Drives a whole run on one event loop. docker-py only blocks, so its calls go through a
+    # thread pool and are awaited, which lets stats, logs, cleanup and the next launch overlap.
+    def __init__(self, slots: List[CpuSlot], max_workers: Optional[int] = None,
+                 hosts: Optional[HostPool] = None, host_retries: int = 2) -> None:
+        assert len(slots) > 0, "Must provide at least one CPU slot."
+        self.slots = slots
+        self.hosts = hosts
+        self.host_retries = host_retries
+        # Per slot: the container wait, its logs, its stats, a reference run and a removal in flight.
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers = max_workers if max_workers is not None else 5 * len(slots) + 2)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._free_slots: List[CpuSlot] = []
+        self._slots_changed: Optional[asyncio.Condition] = None
+        self._background: List["asyncio.Future[Any]"] = []
+
+    def run(self, coroutine: Awaitable[T]) -> T:
+        # The synchronous entry point, runs the coroutine and everything it left in the background.
+        loop = asyncio.new_event_loop()
+        self._loop = loop
+        try:
+            asyncio.set_event_loop(loop)
+            self._free_slots = list(self.slots)
+            self._slots_changed = asyncio.Condition()
+            return loop.run_until_complete(self.__run_and_drain(coroutine))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+            self._loop = None
+            self._executor.shutdown(wait = True)
+
+    async def __run_and_drain(self, coroutine: Awaitable[T]) -> T:
+        try:
+            return await coroutine
+        finally:
+            await self.drain()
+
+    async def call(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        assert self._loop is not None, "Orchestrator isn't running."
+        return await self._loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    def background(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> None:
+        # Fire and forget, e.g. removing a finished container while the next one starts.
+        task = asyncio.ensure_future(self.call(fn, *args, **kwargs))
+        task.add_done_callback(self.__log_failure)
+        self._background.append(task)
+
+    @staticmethod
+    def __log_failure(task: "asyncio.Future[Any]") -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logging.warning("Background task failed: {0}".format(task.exception()))
+
+    async def drain(self) -> None:
+        while len(self._background) > 0:
+            pending, self._background = self._background, []
+            await asyncio.gather(*pending, return_exceptions = True)
+
+    def __fits(self, slot: CpuSlot, on_host: Optional[str], needs_image: Optional[str]) -> bool:
+        if on_host is not None and slot.host != on_host:
+            return False
+        return self.hosts is None or slot.host is None or self.hosts.can_run(slot.host, needs_image)
+
+    async def __acquire(self, on_host: Optional[str], needs_image: Optional[str]) -> CpuSlot:
+        assert self._slots_changed is not None, "Orchestrator isn't running."
+        async with self._slots_changed:
+            while True:
+                if not any(self.__fits(slot, on_host, needs_image) for slot in self.slots):
+                    raise HostUnavailable("No host left that can run {0}".format(needs_image or "this job"))
+                for slot in self._free_slots:
+                    if self.__fits(slot, on_host, needs_image):
+                        self._free_slots.remove(slot)
+                        return slot
+                await self._slots_changed.wait()
+
+    async def __release(self, slot: CpuSlot) -> None:
+        assert self._slots_changed is not None, "Orchestrator isn't running."
+        async with self._slots_changed:
+            if slot in self.slots:
+                self._free_slots.append(slot)
+            self._slots_changed.notify_all()
+
+    async def drop_host(self, host: str) -> None:
+        assert self._slots_changed is not None and self.hosts is not None, "Orchestrator isn't running."
+        if host not in self.hosts.names():
+            return
+        self.hosts.mark_failed(host)
+        async with self._slots_changed:
+            self.slots = [slot for slot in self.slots if slot.host != host]
+            self._free_slots = [slot for slot in self._free_slots if slot.host != host]
+            self._slots_changed.notify_all()
+
+    def pick_host(self, needs_image: Optional[str] = None) -> str:
+        # The live host with the most slots that aren't taken by a test pinned to it yet.
+        assert self.hosts is not None, "No docker hosts to pick from."
+        candidates = [slot.host for slot in self._free_slots if self.__fits(slot, None, needs_image)] or \
+                     [slot.host for slot in self.slots if self.__fits(slot, None, needs_image)]
+        if len(candidates) == 0:
+            raise HostUnavailable("No host left that can run {0}".format(needs_image or "this job"))
+        return str(max(set(candidates), key = candidates.count))
+
+    async def in_slot(self, fn: Callable[..., Awaitable[T]], *args: Any,
+                      on_host: Optional[str] = None, needs_image: Optional[str] = None, **kwargs: Any) -> T:
+        # Runs a job once a CPU slot is free, with `cpuset_cpus` and `host` set to that slot. When the
+        # job fails because its host went away, it's run again on another one (unless it's pinned).
+        attempt = 0
+        while True:
+            slot = await self.__acquire(on_host, needs_image)
+            host_failed = False
+            try:
+                logging.debug("Running on CPU slot {0} ({1}) of {2}".format(slot.index, slot.cpus, slot.host))
+                return await fn(*args, cpuset_cpus = slot.cpus, host = slot.host, **kwargs)
+            except OSError as e:
+                # Connection errors, and the docker errors built on them.
+                if self.hosts is None or slot.host is None or await self.call(self.hosts.is_alive, slot.host):
+                    raise
+                host_failed = True
+                await self.drop_host(slot.host)
+                attempt += 1
+                if on_host is not None or attempt > self.host_retries:
+                    raise HostUnavailable("{0} failed: {1}".format(slot.host, e))
+                logging.warning("Retrying a job from {0} on another host ({1}/{2})".format(slot.host, attempt,
+                                                                                         self.host_retries))
+            finally:
+                if not host_failed:
+                    await self.__release(slot)
+
+    def submit(self, fn: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> "asyncio.Future[T]":
+        return asyncio.ensure_future(self.in_slot(fn, *args, **kwargs))
@@ -0,0 +1,247 @@
+import ast
+import base64
+import concurrent.futures
+import hashlib
+import html
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from bench.store import ResultsStore, first_run_label
+from bench.types import PlotJob
+
+PLOT_TYPES = {
+    # plot type: (column on the x axis, its label)
+    "first_run"  : ("time_recorded", "sample"),
+    "overall_run": ("iteration", "iteration"),
+}
+
+_manifest_lock = threading.Lock()
+
+
+def plot_jobs(plot_title: str, df: pd.DataFrame, plot_type: str, plot_dir: str) -> List[PlotJob]:
+    # One figure per column of a table, each tagged with a hash of exactly what it would draw.
+    assert plot_type in PLOT_TYPES, "Invalid plot type."
+    x_column, xlabel = PLOT_TYPES[plot_type]
+
+    if len(df) == 0:
+        logging.warning("Found empty dataframe")
+        return []
+
+    x = np.arange(len(df), dtype = float)
+    jobs = []
+    for column in df.columns:
+        if column == x_column or not pd.api.types.is_numeric_dtype(df[column]):
+            continue
+        jobs.append(__make_job("{0}/{1}_{2}.png".format(plot_dir, plot_title, column),
+                               "{0}_{1}".format(plot_title, column), xlabel, column,
+                               x, df[column].to_numpy(dtype = float)))
+    return jobs
+
+
+def __make_job(output: str, title: str, xlabel: str, ylabel: str, x: np.ndarray, y: np.ndarray) -> PlotJob:
+    data_hash = hashlib.sha256()
+    for part in [title, xlabel, ylabel]:
+        data_hash.update(part.encode("utf-8") + b"\0")
+    data_hash.update(x.tobytes())
+    data_hash.update(y.tobytes())
+    return PlotJob(output = output,
+                   title = title,
+                   xlabel = xlabel,
+                   ylabel = ylabel,
+                   x = x,
+                   y = y,
+                   data_hash = data_hash.hexdigest())
+
+
+def scaling_jobs(scaling: pd.DataFrame, plot_dir: str) -> List[PlotJob]:
+    # Speedup and parallel efficiency against the number of cores, per test and runtime.
+    jobs = []
+    for (test_name, runtime), points in scaling.groupby(["test_name", "runtime"], sort = True):
+        points = points.sort_values("cores")
+        x = points["cores"].to_numpy(dtype = float)
+        for column in ["speedup", "efficiency"]:
+            title = "{0}_{1}_{2}".format(test_name, runtime, column)
+            jobs.append(__make_job("{0}/{1}.png".format(plot_dir, title), title, "cores", column, x,
+                                   points[column].to_numpy(dtype = float)))
+    return jobs
+
+
+def render_figure(job: PlotJob) -> str:
+    # Runs in a worker process, a Figure of its own never touches pyplot's global state.
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot(1, 1, 1)
+    axes.plot(job.x, job.y)
+    axes.set_xlabel(job.xlabel)
+    axes.set_ylabel(job.ylabel)
+    axes.set_title(job.title)
+    axes.grid(True)
+    figure.savefig(job.output + ".tmp", format = "png")
+    os.replace(job.output + ".tmp", job.output)
+    return str(job.output)
+
+
+def __load_manifest(manifest_file: str) -> Dict[str, str]:
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file, "r") as f:
+        manifest: Dict[str, str] = json.load(f)
+        return manifest
+
+
+def __main_is_guarded() -> bool:
+    # Spawned workers import the script that started bench again, only what's under its
+    # `if __name__ == "__main__":` isn't run again. A script without one would start over in every worker.
+    path = getattr(sys.modules.get("__main__"), "__file__", None)
+    if path is None:
+        # Interactive, or `python -c`, there's nothing to import.
+        return True
+    try:
+        with open(path, "r") as f:
+            tree = ast.parse(f.read())
+    except (OSError, SyntaxError, ValueError):
+        return False
+    for node in tree.body:
+        if isinstance(node, ast.If) and isinstance(node.test, ast.Compare):
+            operands = [node.test.left] + list(node.test.comparators)
+            # A string is an ast.Str before Python 3.8 and an ast.Constant after.
+            if "__name__" in [operand.id for operand in operands if isinstance(operand, ast.Name)] and \
+                    "__main__" in [getattr(operand, "value", getattr(operand, "s", None)) for operand in operands]:
+                return True
+    return False
+
+
+def render_plots(jobs: List[PlotJob], manifest_file: str, max_workers: Optional[int] = None) -> List[str]:
+    # Only figures whose data changed since they were drawn are rendered again.
+    with _manifest_lock:
+        manifest = __load_manifest(manifest_file)
+        stale = [job for job in jobs if manifest.get(job.output) != job.data_hash or not os.path.exists(job.output)]
+        logging.info("Rendering {0} of {1} figures, the rest are unchanged".format(len(stale), len(jobs)))
+        if len(stale) == 0:
+            return []
+
+        rendered: List[str] = []
+        if __main_is_guarded():
+            workers = max_workers if max_workers is not None else os.cpu_count()
+            # Spawned, since this runs on an orchestrator thread and forking a threaded process can deadlock.
+            with concurrent.futures.ProcessPoolExecutor(max_workers = workers,
+                                                        mp_context = multiprocessing.get_context("spawn")) \
+                    as executor:
+                chunk = max(1, len(stale) // (4 * (workers if workers is not None else 1)))
+                rendered.extend(executor.map(render_figure, stale, chunksize = chunk))
+        else:
+            logging.warning("The script running bench has no `if __name__ == \"__main__\":`, "
+                            "so its figures are rendered one at a time in this process.")
+            rendered.extend(render_figure(job) for job in stale)
+
+        for job in stale:
+            manifest[job.output] = job.data_hash
+        os.makedirs(os.path.dirname(manifest_file), exist_ok = True)
+        with open(manifest_file + ".tmp", "w") as f:
+            json.dump(manifest, f, indent = 2, sort_keys = True)
+        os.replace(manifest_file + ".tmp", manifest_file)
+        return rendered
+
+
+def __embed_png(path: str) -> str:
+    with open(path, "rb") as f:
+        return '<img src="data:image/png;base64,{0}" alt="{1}">'.format(base64.b64encode(f.read()).decode("ascii"),
+                                                                        html.escape(os.path.basename(path)))
+
+
+def __table_html(df: pd.DataFrame) -> str:
+    return str(df.select_dtypes(include = [np.number]).describe().T.to_html(float_format = "{0:.4g}".format,
+                                                                          classes = "summary"))
+
+
+REPORT_STYLE = """
+body { font-family: sans-serif; margin: 2em; }
+details { margin-bottom: 1em; }
+summary { font-size: 1.2em; cursor: pointer; }
+img { width: 32%; min-width: 320px; }
+table.summary { border-collapse: collapse; font-size: 0.85em; margin: 1em 0; }
+table.summary td, table.summary th { border: 1px solid #ccc; padding: 2px 6px; text-align: right; }
+"""
+
+
+def write_report(results_dir: str, sections: List[Tuple[Dict[str, Any], pd.DataFrame, List[PlotJob]]],
+                 output: str, scaling: Optional[List[PlotJob]] = None) -> None:
+    # The whole suite in one self-contained page, every figure is inlined.
+    parts = ["<!DOCTYPE html>", "<html><head><meta charset=\"utf-8\"><title>Benchmark results</title>",
+             "<style>{0}</style></head><body>".format(REPORT_STYLE), "<h1>Benchmark results</h1>"]
+
+    complexity_csv = os.path.join(results_dir, "tables", "complexity.csv")
+    if os.path.exists(complexity_csv):
+        parts.append("<h2>Complexity</h2>")
+        parts.append(pd.read_csv(complexity_csv, index_col = 0).to_html(float_format = "{0:.4g}".format,
+                                                                         classes = "summary"))
+
+    scaling_csv = os.path.join(results_dir, "tables", "scaling.csv")
+    if os.path.exists(scaling_csv):
+        parts.append("<h2>Scaling</h2>")
+        parts.append(pd.read_csv(scaling_csv, index_col = 0).to_html(float_format = "{0:.4g}".format,
+                                                                      classes = "summary"))
+        parts.extend(__embed_png(job.output) for job in scaling or [] if os.path.exists(job.output))
+
+    for run, overall, jobs in sections:
+        parts.append("<details><summary>{0} ({1})</summary>".format(html.escape(str(run["test_name"])),
+                                                                    html.escape(str(run["runtime"]))))
+        parts.append("<p>{0}, commit {1}</p>".format(
+                html.escape(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run["started_at"]))),
+                html.escape(str(run["git_commit"])[:10] if run["git_commit"] is not None else "unknown")))
+        if len(overall) > 0:
+            parts.append(__table_html(overall))
+        parts.extend(__embed_png(job.output) for job in jobs if os.path.exists(job.output))
+        parts.append("</details>")
+
+    parts.append("</body></html>")
+    with open(output + ".tmp", "w") as f:
+        f.write("\n".join(parts))
+    os.replace(output + ".tmp", output)
+    logging.info("Wrote report: " + output)
+
+
+def render_report(results_dir: str, store: ResultsStore, labels: Optional[List[str]] = None,
+                  max_workers: Optional[int] = None) -> str:
+    # Plots the newest stored run of every test (or of `labels`), measured in this run or not,
+    # then the report with all of them. Everything comes from the store, so no CSV has to be kept.
+    first_dir = os.path.join(results_dir, "figures", "first")
+    overall_dir = os.path.join(results_dir, "figures", "overall")
+    scaling_dir = os.path.join(results_dir, "figures", "scaling")
+    for d in [first_dir, overall_dir, scaling_dir]:
+        os.makedirs(d, exist_ok = True)
+
+    runs = store.latest_runs(labels)
+    run_ids = [int(run_id) for run_id in runs["run_id"]]
+    overall_frames = store.load_columns(run_ids, "overall")
+    first_frames = store.load_columns(run_ids, "first_run")
+
+    sections: List[Tuple[Dict[str, Any], pd.DataFrame, List[PlotJob]]] = []
+    for run in runs.to_dict("records"):
+        overall = overall_frames.get(int(run["run_id"]), pd.DataFrame())
+        first = first_frames.get(int(run["run_id"]), pd.DataFrame())
+        jobs = plot_jobs(run["label"], overall, "overall_run", overall_dir) + \
+            plot_jobs(first_run_label(run["label"]), first, "first_run", first_dir)
+        sections.append((run, overall, jobs))
+
+    scaling_csv = os.path.join(results_dir, "tables", "scaling.csv")
+    scaling = scaling_jobs(pd.read_csv(scaling_csv), scaling_dir) if os.path.exists(scaling_csv) else []
+
+    render_plots([job for _, _, jobs in sections for job in jobs] + scaling,
+                 os.path.join(results_dir, "figures", "plots.json"),
+                 max_workers = max_workers)
+
+    report = os.path.join(results_dir, "report.html")
+    write_report(results_dir, sections, report, scaling)
+    return report
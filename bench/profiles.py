@@ -0,0 +1,136 @@
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import yaml
+
+from bench.scheduler import parse_cpu_list, get_online_cpus
+from bench.types import ResourceProfile, TestPlan
+
+# What every container got before profiles, one CPU's worth of quota in 1ms periods, "to collect more stats".
+LEGACY_PROFILE = ResourceProfile(name = "legacy", cores = None, cpu_quota = 1000, cpu_period = 1000,
+                                 mem_limit = None, memswap_limit = None)
+
+PROFILES: Dict[str, ResourceProfile] = {
+    "legacy"     : LEGACY_PROFILE,
+    # The whole slot, only pinned.
+    "unthrottled": ResourceProfile(name = "unthrottled", cores = None, cpu_quota = None, cpu_period = None,
+                                   mem_limit = None, memswap_limit = None),
+    "single"     : ResourceProfile(name = "single", cores = 1, cpu_quota = None, cpu_period = None,
+                                   mem_limit = None, memswap_limit = None),
+}
+
+
+def load_profiles(profiles_file: str) -> Tuple[Dict[str, ResourceProfile], Dict[str, ResourceProfile]]:
+    # The built-in profiles plus the file's, and which profile each test runs with, e.g.
+    #   profiles:
+    #     quad: {cores: 4, memory: 2g, memory_swap: 2g}
+    #   tests:
+    #     barbershop: quad
+    profiles = dict(PROFILES)
+    if profiles_file == "":
+        return profiles, {}
+    with open(profiles_file, "r") as f:
+        config: Dict[str, Any] = yaml.safe_load(f) or {}
+
+    for name, values in (config.get("profiles") or {}).items():
+        values = values or {}
+        unknown = set(values) - {"cores", "cpu_quota", "cpu_period", "memory", "memory_swap"}
+        assert len(unknown) == 0, "Unknown settings in profile {0}: {1}".format(name, ", ".join(sorted(unknown)))
+        quota = values.get("cpu_quota")
+        profiles[name] = ResourceProfile(name = name,
+                                         cores = int(values["cores"]) if values.get("cores") is not None else None,
+                                         cpu_quota = int(quota) if quota is not None else None,
+                                         cpu_period = int(values.get("cpu_period", 100000)) if quota is not None
+                                         else None,
+                                         mem_limit = values.get("memory"),
+                                         memswap_limit = values.get("memory_swap"))
+
+    tests: Dict[str, ResourceProfile] = {}
+    for test, name in (config.get("tests") or {}).items():
+        assert name in profiles, "Test {0} uses an unknown profile: {1}".format(test, name)
+        tests[str(test)] = profiles[name]
+    return profiles, tests
+
+
+def get_profile(profiles: Dict[str, ResourceProfile], name: str) -> ResourceProfile:
+    assert name in profiles, "Unknown resource profile: {0} (known: {1})".format(name, ", ".join(sorted(profiles)))
+    return profiles[name]
+
+
+def assign_profiles(plans: List[TestPlan], default: ResourceProfile,
+                    tests: Dict[str, ResourceProfile]) -> List[TestPlan]:
+    # A test is matched by its name or its directory's.
+    assigned = []
+    for plan in plans:
+        directory = os.path.basename(plan.workdir) if plan.workdir is not None else ""
+        profile = tests.get(plan.test_name, tests.get(directory, default))
+        assigned.append(plan._replace(profile = profile))
+    return assigned
+
+
+def parse_core_counts(scaling: str, available: Optional[int] = None) -> List[int]:
+    # "1,2,4" as it is, "auto" is every power of two up to the CPUs there are, and all of them.
+    if scaling.strip() == "":
+        return []
+    if scaling.strip() == "auto":
+        available = available if available is not None else len(get_online_cpus())
+        counts = [2 ** i for i in range(available.bit_length()) if 2 ** i <= available]
+        return sorted(set(counts + [available]))
+    counts = sorted(set(int(count) for count in scaling.split(",") if count.strip() != ""))
+    assert all(count > 0 for count in counts), "Core counts must be positive."
+    return counts
+
+
+def scaling_label(label: str, cores: int) -> str:
+    return "{0}_{1}cores".format(label, cores)
+
+
+def expand_scaling(plans: List[TestPlan], core_counts: List[int]) -> List[TestPlan]:
+    # One test per core count, each on that many cores of its slot and without a quota on top.
+    if len(core_counts) == 0:
+        return plans
+    expanded = []
+    for plan in plans:
+        profile = plan.profile if plan.profile is not None else LEGACY_PROFILE
+        for cores in core_counts:
+            expanded.append(plan._replace(profile = profile._replace(name = "{0}_{1}cores".format(profile.name,
+                                                                                                  cores),
+                                                                     cores = cores,
+                                                                     cpu_quota = None,
+                                                                     cpu_period = None),
+                                          first_run_name = scaling_label(plan.first_run_name, cores),
+                                          overall_run_name = scaling_label(plan.overall_run_name, cores)))
+    return expanded
+
+
+def required_cores(profiles: List[ResourceProfile], core_counts: List[int]) -> int:
+    # How big every CPU slot has to be for the largest of them.
+    return int(max([profile.cores for profile in profiles if profile.cores is not None] + core_counts + [1]))
+
+
+def container_settings(profile: Optional[ResourceProfile], slot_cpus: str) -> Dict[str, Union[str, int, bool]]:
+    profile = profile if profile is not None else LEGACY_PROFILE
+    cpus = parse_cpu_list(slot_cpus)
+    if profile.cores is not None:
+        if len(cpus) < profile.cores:
+            logging.warning("Profile {0} wants {1} cores, the slot only has {2}".format(profile.name,
+                                                                                       profile.cores,
+                                                                                       slot_cpus))
+        cpus = cpus[:profile.cores]
+
+    settings: Dict[str, Union[str, int, bool]] = {
+        "cpuset_cpus": ",".join(str(cpu) for cpu in cpus) if len(cpus) > 0 else slot_cpus,
+        "stdout": True,
+        "stderr": True,
+        "detach": True,
+        "tty"   : True
+    }
+    if profile.cpu_quota is not None and profile.cpu_period is not None:
+        settings["cpu_quota"] = int(profile.cpu_quota)
+        settings["cpu_period"] = int(profile.cpu_period)
+    if profile.mem_limit is not None:
+        settings["mem_limit"] = profile.mem_limit
+    if profile.memswap_limit is not None:
+        settings["memswap_limit"] = profile.memswap_limit
+    return settings
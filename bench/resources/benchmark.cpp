@@ -1,5 +1,6 @@
 #include <string>
 #include <iostream>
+#include <cstdlib>
 
 bool is_prime(long num) {
     int count = 0;
@@ -20,14 +21,19 @@ bool is_prime(long num) {
     return true;
 }
 
-void run_test() {
+void run_test(long iterations) {
     std::cout << "Starting test" << std::endl;
-	for (int i = 0; i < 100; i++) {
-		is_prime(179425453 + i);
+	for (long i = 0; i < iterations; i++) {
+		// Cycle through the same 100 numbers, so the cost grows with the number of iterations.
+		is_prime(179425453 + (i % 100));
 	}
 	std::cout << "Done" << std::endl;
 }
 
-int main() {
-    run_test();
+int main(int argc, char** argv) {
+    long iterations = 100;
+    if (argc > 1) {
+        iterations = std::atol(argv[1]);
+    }
+    run_test(iterations);
 }
\ No newline at end of file
@@ -0,0 +1,59 @@
+#include <cstdio>
+#include <ctime>
+#include <sys/resource.h>
+#include <sys/time.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+#include <unistd.h>
+
+// Runs a command and reports how long it took from inside the container, so none of
+// the docker API round trips end up in the measurement.
+// Usage: bench_timer <command> [args...]
+
+long long now_ns() {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (long long) ts.tv_sec * 1000000000LL + ts.tv_nsec;
+}
+
+long long to_us(struct timeval tv) {
+    return (long long) tv.tv_sec * 1000000LL + tv.tv_usec;
+}
+
+int main(int argc, char** argv) {
+    if (argc < 2) {
+        fprintf(stderr, "usage: %s <command> [args...]\n", argv[0]);
+        return 127;
+    }
+
+    long long start = now_ns();
+    pid_t pid = fork();
+    if (pid < 0) {
+        perror("fork");
+        return 127;
+    }
+    if (pid == 0) {
+        execvp(argv[1], argv + 1);
+        perror("execvp");
+        _exit(127);
+    }
+
+    int status = 0;
+    struct rusage usage;
+    if (wait4(pid, &status, 0, &usage) < 0) {
+        perror("wait4");
+        return 127;
+    }
+    long long end = now_ns();
+
+    int exit_code = WIFEXITED(status) ? WEXITSTATUS(status) : 128 + WTERMSIG(status);
+
+    fflush(stdout);
+    fprintf(stderr,
+            "\nBENCH_TIMING {\"start_ns\": %lld, \"end_ns\": %lld, \"user_us\": %lld, \"sys_us\": %lld, "
+            "\"max_rss_kb\": %ld, \"voluntary_switches\": %ld, \"involuntary_switches\": %ld, \"exit_code\": %d}\n",
+            start, end, to_us(usage.ru_utime), to_us(usage.ru_stime),
+            usage.ru_maxrss, usage.ru_nvcsw, usage.ru_nivcsw, exit_code);
+    fflush(stderr);
+    return exit_code;
+}
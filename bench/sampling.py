@@ -0,0 +1,59 @@
+import math
+from typing import List, Tuple
+
+from bench.types import TestResult
+
+DEFAULT_CONFIDENCE = 0.95
+
+
+def normal_quantile(p: float) -> float:
+    # Inverse of the standard normal CDF by bisection, plenty fast for a handful of calls.
+    assert 0 < p < 1, "Probability must be in (0, 1)."
+    low, high = -10.0, 10.0
+    for _ in range(100):
+        middle = (low + high) / 2
+        if 0.5 * (1 + math.erf(middle / math.sqrt(2))) < p:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+def t_quantile(p: float, dof: int) -> float:
+    # Student's t quantile from the normal one (Abramowitz & Stegun 26.7.5).
+    assert dof > 0, "Need at least one degree of freedom."
+    z = normal_quantile(p)
+    v = float(dof)
+    return (z
+            + (z ** 3 + z) / (4 * v)
+            + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * v ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * v ** 3)
+            + (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / (92160 * v ** 4))
+
+
+def relative_ci_width(values: List[float], confidence: float = DEFAULT_CONFIDENCE) -> float:
+    # Full width of the confidence interval of the mean, relative to the mean.
+    n = len(values)
+    if n < 2:
+        return math.inf
+    mean = sum(values) / n
+    if mean == 0:
+        return math.inf
+    variance = sum((value - mean) ** 2 for value in values) / (n - 1)
+    half_width = t_quantile(1 - (1 - confidence) / 2, n - 1) * math.sqrt(variance / n)
+    return 2 * half_width / abs(mean)
+
+
+def sample_precision(test_results: List[TestResult], confidence: float = DEFAULT_CONFIDENCE) -> float:
+    # The worst of the raw and the normalized time, both have to be precise enough.
+    time_taken = [result.time_taken for result in test_results]
+    normalized = [result.time_taken / result.test_time for result in test_results if result.test_time > 0]
+    return max(relative_ci_width(time_taken, confidence), relative_ci_width(normalized, confidence))
+
+
+def has_converged(test_results: List[TestResult],
+                  min_samples: int,
+                  target_ci_width: float,
+                  confidence: float = DEFAULT_CONFIDENCE) -> Tuple[bool, float]:
+    precision = sample_precision(test_results, confidence)
+    return len(test_results) >= min_samples and precision <= target_ci_width, precision
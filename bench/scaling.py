@@ -0,0 +1,44 @@
+import logging
+import math
+from typing import List
+
+import pandas as pd
+
+from bench.profiles import scaling_label
+from bench.store import ResultsStore
+from bench.types import ScalingPoint, TestPlan
+
+
+def scaling_curves(store: ResultsStore, plans: List[TestPlan], core_counts: List[int]) -> List[ScalingPoint]:
+    # Speedup over the fewest cores (scaled up when that isn't 1) and efficiency, from the newest stored run
+    # of each point, so points skipped as unchanged still count.
+    points: List[ScalingPoint] = []
+    for plan in plans:
+        times = []
+        for cores in core_counts:
+            label = scaling_label(plan.overall_run_name, cores)
+            runs = store.find_runs(label = label, limit = 1)
+            if len(runs) > 0 and pd.notna(runs["median_time"].iloc[0]):
+                times.append((cores, label, float(runs["median_time"].iloc[0])))
+        if len(times) == 0:
+            continue
+
+        base_cores, _, base_time = times[0]
+        for cores, label, median_time in times:
+            speedup = base_cores * base_time / median_time if median_time > 0 else math.nan
+            points.append(ScalingPoint(test_name = plan.test_name,
+                                       runtime = plan.runtime,
+                                       label = label,
+                                       cores = cores,
+                                       median_time = median_time,
+                                       speedup = speedup,
+                                       efficiency = speedup / cores))
+        last = points[-1]
+        logging.info("{0} ({1}): {2:.2f}x on {3} cores, {4:.0%} efficient".format(last.test_name, last.runtime,
+                                                                                  last.speedup, last.cores,
+                                                                                  last.efficiency))
+    return points
+
+
+def write_scaling(points: List[ScalingPoint], csv: str) -> None:
+    pd.DataFrame(points, columns = ScalingPoint._fields).to_csv(csv)
@@ -0,0 +1,133 @@
+import glob
+import logging
+import os
+from typing import List, Dict, Optional
+
+from bench.types import CpuSlot
+
+
+def parse_cpu_list(cpu_list: str) -> List[int]:
+    # Kernel format, e.g. "0-3,8,10-11"
+    cpus: List[int] = []
+    for part in cpu_list.strip().split(","):
+        if part == "":
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def _read_sys_file(path: str) -> Optional[str]:
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except (OSError, IOError):
+        return None
+
+
+def get_online_cpus() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def get_numa_nodes(cpus: List[int]) -> Dict[int, List[int]]:
+    nodes: Dict[int, List[int]] = {}
+    for node_dir in sorted(glob.glob("/sys/devices/system/node/node[0-9]*")):
+        cpu_list = _read_sys_file(os.path.join(node_dir, "cpulist"))
+        if cpu_list is None:
+            continue
+        node_cpus = [c for c in parse_cpu_list(cpu_list) if c in cpus]
+        if len(node_cpus) > 0:
+            nodes[int(os.path.basename(node_dir)[len("node"):])] = node_cpus
+
+    if len(nodes) == 0:
+        logging.debug("No NUMA topology found, treating host as a single node.")
+        nodes[0] = list(cpus)
+    return nodes
+
+
+def get_physical_cores(cpus: List[int]) -> List[List[int]]:
+    # Group hyper-threads that share a physical core, in CPU order.
+    cores: List[List[int]] = []
+    seen = set()
+    for cpu in cpus:
+        if cpu in seen:
+            continue
+        siblings = _read_sys_file("/sys/devices/system/cpu/cpu{0}/topology/thread_siblings_list".format(cpu))
+        group = [c for c in parse_cpu_list(siblings) if c in cpus] if siblings is not None else [cpu]
+        if cpu not in group:
+            group = [cpu]
+        seen.update(group)
+        cores.append(group)
+    return cores
+
+
+def get_cpu_slots(slot_size: int = 1,
+                  max_slots: Optional[int] = None,
+                  guard_cpus: int = 0,
+                  reserved_cpus: int = 0,
+                  numa_aware: bool = False,
+                  use_smt_siblings: bool = False) -> List[CpuSlot]:
+    # `reserved_cpus` keeps the first cores free for bench and the docker daemon, `guard_cpus`
+    # leaves idle cores between neighbouring slots, and unless `use_smt_siblings` is set the
+    # hyper-thread siblings of a slot are left idle too, so neighbours don't skew the measurement.
+    assert slot_size > 0, "Slot size must be positive."
+    assert max_slots is None or max_slots > 0, "Must allow at least one slot."
+
+    cpus = get_online_cpus()[reserved_cpus:]
+    nodes = get_numa_nodes(cpus) if numa_aware else {0: cpus}
+
+    slots: List[CpuSlot] = []
+    for node, node_cpus in sorted(nodes.items()):
+        current: List[int] = []
+        guard = 0
+        for core in get_physical_cores(node_cpus):
+            if guard > 0:
+                guard -= 1
+                continue
+
+            current.extend(core if use_smt_siblings else core[:1])
+            if len(current) >= slot_size:
+                slots.append(CpuSlot(index = len(slots),
+                                     cpus = ",".join(map(str, current[:slot_size])),
+                                     node = node,
+                                     host = None))
+                current = []
+                guard = guard_cpus
+
+            if max_slots is not None and len(slots) >= max_slots:
+                return slots
+
+    if len(slots) == 0:
+        logging.warning("Not enough CPUs for a slot of size {0}, using CPU 0.".format(slot_size))
+        slots.append(CpuSlot(index = 0, cpus = "0", node = 0, host = None))
+
+    return slots
+
+
+def get_remote_cpu_slots(cpu_count: int,
+                         slot_size: int = 1,
+                         max_slots: Optional[int] = None,
+                         guard_cpus: int = 0,
+                         reserved_cpus: int = 0) -> List[CpuSlot]:
+    # The topology of another machine can't be read from here, so its CPUs are taken as they're numbered.
+    assert slot_size > 0, "Slot size must be positive."
+    cpus = list(range(reserved_cpus, cpu_count))
+
+    slots: List[CpuSlot] = []
+    start = 0
+    while start + slot_size <= len(cpus) and (max_slots is None or len(slots) < max_slots):
+        slots.append(CpuSlot(index = len(slots),
+                             cpus = ",".join(map(str, cpus[start:start + slot_size])),
+                             node = 0,
+                             host = None))
+        start += slot_size + guard_cpus
+
+    if len(slots) == 0:
+        logging.warning("Not enough CPUs for a slot of size {0}, using CPU 0.".format(slot_size))
+        slots.append(CpuSlot(index = 0, cpus = "0", node = 0, host = None))
+    return slots
@@ -0,0 +1,246 @@
+import array
+import datetime
+import json
+import logging
+import math
+import os
+import sys
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Every stats file starts with a fixed size JSON header, padded with spaces, so it can be
+# rewritten in place once the sample finishes. Rows are streamed after it as little-endian
+# float64s, and transposed into contiguous columns when the writer is closed.
+STATS_MAGIC = b"BENCHSTATS1\n"
+HEADER_SIZE = 4096
+FLUSH_EVERY = 64
+
+Stats = Dict[str, Any]
+
+
+def _get(stats: Stats, *path: str) -> Any:
+    value: Any = stats
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def _number(value: Any) -> float:
+    if value is None:
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _timestamp(value: Any) -> float:
+    # Docker reports RFC 3339 with nanoseconds, e.g. 2020-05-01T12:34:56.123456789Z
+    if not isinstance(value, str) or value.startswith("0001-01-01"):
+        return math.nan
+    try:
+        seconds, _, fraction = value.rstrip("Z").partition(".")
+        base = datetime.datetime.strptime(seconds[:19], "%Y-%m-%dT%H:%M:%S")
+        digits = "".join(c for c in fraction if c.isdigit())
+        epoch = (base - datetime.datetime(1970, 1, 1)).total_seconds()
+        return epoch + (float("0." + digits) if digits != "" else 0.0)
+    except ValueError:
+        return math.nan
+
+
+def _average(values: Any) -> float:
+    if not isinstance(values, list) or len(values) == 0:
+        return math.nan
+    return sum(values) / len(values)
+
+
+def _blkio(stats: Stats, field: str, op: str) -> float:
+    # e.g. io_service_bytes_recursive or io_serviced_recursive, one entry per device and op.
+    entries = _get(stats, "blkio_stats", field)
+    if not isinstance(entries, list):
+        return math.nan
+    return sum(_number(entry.get("value")) for entry in entries
+               if isinstance(entry, dict) and str(entry.get("op", "")).lower() == op)
+
+
+def _network(stats: Stats, field: str) -> float:
+    # Summed over every interface of the container, containers with --network none have none.
+    networks = stats.get("networks")
+    if not isinstance(networks, dict):
+        return math.nan
+    return sum(_number(interface.get(field)) for interface in networks.values() if isinstance(interface, dict))
+
+
+def _memory_stat(stats: Stats, *keys: str) -> float:
+    # cgroup v1 and v2 name some of memory.stat differently, e.g. rss and anon.
+    for key in keys:
+        value = _get(stats, "memory_stats", "stats", key)
+        if value is not None:
+            return _number(value)
+    return math.nan
+
+
+# The fixed schema every stats row is reduced to, in file order.
+STATS_COLUMNS: List[Tuple[str, Callable[[Stats], float]]] = [
+    ("read",             lambda s: _timestamp(s.get("read"))),
+    ("preread",          lambda s: _timestamp(s.get("preread"))),
+    ("cpu_total",        lambda s: _number(_get(s, "cpu_stats", "cpu_usage", "total_usage"))),
+    ("cpu_kernel",       lambda s: _number(_get(s, "cpu_stats", "cpu_usage", "usage_in_kernelmode"))),
+    ("cpu_user",         lambda s: _number(_get(s, "cpu_stats", "cpu_usage", "usage_in_usermode"))),
+    ("cpu_percpu_avg",   lambda s: _average(_get(s, "cpu_stats", "cpu_usage", "percpu_usage"))),
+    ("cpu_system",       lambda s: _number(_get(s, "cpu_stats", "system_cpu_usage"))),
+    ("cpu_online",       lambda s: _number(_get(s, "cpu_stats", "online_cpus"))),
+    ("precpu_total",     lambda s: _number(_get(s, "precpu_stats", "cpu_usage", "total_usage"))),
+    ("precpu_system",    lambda s: _number(_get(s, "precpu_stats", "system_cpu_usage"))),
+    ("cpu_periods",      lambda s: _number(_get(s, "cpu_stats", "throttling_data", "periods"))),
+    ("cpu_throttled",    lambda s: _number(_get(s, "cpu_stats", "throttling_data", "throttled_periods"))),
+    ("cpu_throttled_ns", lambda s: _number(_get(s, "cpu_stats", "throttling_data", "throttled_time"))),
+    ("memory_usage",     lambda s: _number(_get(s, "memory_stats", "usage"))),
+    ("memory_max_usage", lambda s: _number(_get(s, "memory_stats", "max_usage"))),
+    ("memory_cache",     lambda s: _number(_get(s, "memory_stats", "stats", "cache"))),
+    ("memory_limit",     lambda s: _number(_get(s, "memory_stats", "limit"))),
+    ("memory_rss",       lambda s: _memory_stat(s, "rss", "anon")),
+    ("memory_swap",      lambda s: _memory_stat(s, "swap")),
+    ("memory_faults",    lambda s: _memory_stat(s, "pgfault")),
+    ("memory_majfaults", lambda s: _memory_stat(s, "pgmajfault")),
+    ("pids",             lambda s: _number(_get(s, "pids_stats", "current"))),
+    ("io_read_bytes",    lambda s: _blkio(s, "io_service_bytes_recursive", "read")),
+    ("io_write_bytes",   lambda s: _blkio(s, "io_service_bytes_recursive", "write")),
+    ("io_read_ops",      lambda s: _blkio(s, "io_serviced_recursive", "read")),
+    ("io_write_ops",     lambda s: _blkio(s, "io_serviced_recursive", "write")),
+    ("net_rx_bytes",     lambda s: _network(s, "rx_bytes")),
+    ("net_tx_bytes",     lambda s: _network(s, "tx_bytes")),
+    ("net_rx_packets",   lambda s: _network(s, "rx_packets")),
+    ("net_tx_packets",   lambda s: _network(s, "tx_packets")),
+    # Only the cgroup sampler can see stall times, in microseconds.
+    ("cpu_pressure",     lambda s: math.nan),
+    ("memory_pressure",  lambda s: math.nan),
+    ("io_pressure",      lambda s: math.nan),
+]
+
+STATS_COLUMN_NAMES: List[str] = [name for name, _ in STATS_COLUMNS]
+
+
+def flatten_stats(stats: Stats) -> List[float]:
+    return [extract(stats) for _, extract in STATS_COLUMNS]
+
+
+class StatsWriter(object):
+    # Streams fixed schema rows to disk, so only a handful of rows are ever held in memory.
+    def __init__(self, path: str, metadata: Optional[Dict[str, Any]] = None,
+                 columns: Optional[List[str]] = None) -> None:
+        self.path = path
+        self.columns = columns if columns is not None else STATS_COLUMN_NAMES
+        self.metadata: Dict[str, Any] = dict(metadata) if metadata is not None else {}
+        self.rows = 0
+        self.layout = "rows"
+        self._buffer = array.array("d")
+
+        directory = os.path.dirname(path)
+        if directory != "" and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok = True)
+
+        self._file = open(path, "w+b")
+        self.__write_header()
+
+    def __enter__(self) -> "StatsWriter":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def __write_header(self) -> None:
+        header = json.dumps({"columns" : self.columns,
+                             "rows"    : self.rows,
+                             "layout"  : self.layout,
+                             "metadata": self.metadata}).encode("utf-8")
+        assert len(STATS_MAGIC) + len(header) + 1 <= HEADER_SIZE, "Stats header too large."
+        self._file.seek(0)
+        self._file.write(STATS_MAGIC + header + b"\n" + b" " * (HEADER_SIZE - len(STATS_MAGIC) - len(header) - 1))
+
+    def append_stats(self, stats: Stats) -> None:
+        self.append(flatten_stats(stats))
+
+    def append(self, row: List[float]) -> None:
+        assert len(row) == len(self.columns), "Row doesn't match the stats schema."
+        self._buffer.extend(row)
+        self.rows += 1
+        if len(self._buffer) >= FLUSH_EVERY * len(self.columns):
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self._buffer) == 0:
+            return
+        if sys.byteorder != "little":
+            self._buffer.byteswap()
+        self._file.seek(0, os.SEEK_END)
+        self._buffer.tofile(self._file)
+        self._file.flush()
+        self._buffer = array.array("d")
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self.flush()
+
+        if self.rows > 0:
+            self._file.seek(HEADER_SIZE)
+            data = np.frombuffer(self._file.read(8 * self.rows * len(self.columns)), dtype = "<f8")
+            self._file.seek(HEADER_SIZE)
+            self._file.write(np.ascontiguousarray(data.reshape(self.rows, len(self.columns)).T).tobytes())
+        self.layout = "columns"
+
+        self.__write_header()
+        self._file.close()
+
+
+class StatsTable(object):
+    # Read only, memory mapped view of a stats file, columns are only paged in when used.
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+
+        if not header.startswith(STATS_MAGIC):
+            raise ValueError("Not a stats file: {0}".format(path))
+
+        info = json.loads(header[len(STATS_MAGIC):].split(b"\n", 1)[0].decode("utf-8"))
+        self.columns: List[str] = info["columns"]
+        self.metadata: Dict[str, Any] = info.get("metadata", {})
+
+        if info.get("layout") == "columns":
+            rows = int(info["rows"])
+            shape = (len(self.columns), rows)
+        else:
+            # Still being written (or never closed), so trust the file size over the header.
+            rows = (os.path.getsize(path) - HEADER_SIZE) // (8 * len(self.columns))
+            shape = (rows, len(self.columns))
+
+        self._rows = rows
+        self._columnar = info.get("layout") == "columns"
+        self._data: np.ndarray
+        if rows > 0:
+            self._data = np.memmap(path, dtype = "<f8", mode = "r", offset = HEADER_SIZE, shape = shape)
+        else:
+            self._data = np.empty(shape, dtype = "<f8")
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def __contains__(self, column: str) -> bool:
+        return column in self.columns
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        if column not in self.columns:
+            logging.debug("Column {0} not in {1}".format(column, self.path))
+            return np.full(len(self), np.nan)
+        index = self.columns.index(column)
+        return np.asarray(self._data[index] if self._columnar else self._data[:, index])
+
+
+def load_stats(path: Optional[str]) -> StatsTable:
+    assert path is not None and os.path.exists(path), "Stats file not found: {0}".format(path)
+    return StatsTable(path)
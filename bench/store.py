@@ -0,0 +1,267 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import platform
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from bench.types import RunContext
+
+SCHEMA_VERSION = 1
+
+# Runs are small rows with everything they're looked up by, the data of a run is kept
+# next to them as one float64 blob per column, so a run is read back in a handful of rows.
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS runs (
+        run_id       INTEGER PRIMARY KEY AUTOINCREMENT,
+        test_name    TEXT NOT NULL,
+        runtime      TEXT NOT NULL,
+        label        TEXT NOT NULL,
+        image        TEXT NOT NULL,
+        image_digest TEXT,
+        git_commit   TEXT,
+        host         TEXT NOT NULL,
+        started_at   REAL NOT NULL,
+        finished_at  REAL NOT NULL,
+        samples      INTEGER NOT NULL,
+        median_time  REAL,
+        mean_time    REAL,
+        parameters   TEXT NOT NULL,
+        summary      TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS columns (
+        run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+        kind   TEXT NOT NULL,
+        name   TEXT NOT NULL,
+        data   BLOB NOT NULL,
+        PRIMARY KEY (run_id, kind, name)
+    )""",
+    """CREATE TABLE IF NOT EXISTS hosts (
+        host        TEXT PRIMARY KEY,
+        description TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS runs_by_test ON runs (test_name, runtime, started_at)",
+    "CREATE INDEX IF NOT EXISTS runs_by_commit ON runs (git_commit, test_name)",
+    "CREATE INDEX IF NOT EXISTS runs_by_digest ON runs (image_digest)",
+    "CREATE INDEX IF NOT EXISTS runs_by_host ON runs (host, started_at)",
+]
+
+RUN_COLUMNS = ["run_id", "test_name", "runtime", "label", "image", "image_digest", "git_commit", "host",
+               "started_at", "finished_at", "samples", "median_time", "mean_time", "parameters", "summary"]
+
+
+def get_results_db(results_dir: str) -> str:
+    return os.path.join(results_dir, "results.db")
+
+
+def get_host_description() -> Dict[str, Any]:
+    # What makes timings from two machines incomparable.
+    cpu_model = platform.processor()
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    cpu_model = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") if hasattr(os, "sysconf") else 0
+    return {
+        "hostname" : platform.node(),
+        "system"   : platform.system(),
+        "kernel"   : platform.release(),
+        "machine"  : platform.machine(),
+        "cpu_model": cpu_model,
+        "cpu_count": os.cpu_count(),
+        "memory"   : memory,
+    }
+
+
+def get_host_fingerprint(description: Optional[Dict[str, Any]] = None) -> str:
+    description = description if description is not None else get_host_description()
+    return hashlib.sha256(json.dumps(description, sort_keys = True).encode("utf-8")).hexdigest()[:16]
+
+
+def get_git_commit(root_dir: str) -> Optional[str]:
+    try:
+        from git import Repo, InvalidGitRepositoryError, NoSuchPathError
+    except ImportError:
+        return None
+    try:
+        return str(Repo(root_dir, search_parent_directories = True).head.commit.hexsha)
+    except (InvalidGitRepositoryError, NoSuchPathError, ValueError):
+        logging.debug("{0} is not in a git repository".format(root_dir))
+        return None
+
+
+def get_run_context(root_dir: str) -> RunContext:
+    return RunContext(git_commit = get_git_commit(root_dir),
+                      host = get_host_fingerprint(),
+                      started_at = time.time())
+
+
+def first_run_label(label: str) -> str:
+    # Runs are stored under their overall table's name, the first run's table is named the same way.
+    if label.startswith("overall_"):
+        return "first_" + label[len("overall_"):]
+    return label.replace("_overall_", "_first_", 1)
+
+
+def _to_blob(values: pd.Series) -> Optional[bytes]:
+    if pd.api.types.is_datetime64_any_dtype(values):
+        values = (values - pd.Timestamp(0)) / pd.Timedelta(seconds = 1)
+    elif not pd.api.types.is_numeric_dtype(values):
+        return None
+    return np.ascontiguousarray(values.to_numpy(dtype = "<f8", na_value = np.nan)).tobytes()
+
+
+class ResultsStore(object):
+    # Every measured run, kept forever, indexed by what it'll be looked up by.
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory != "" and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok = True)
+
+        with self.__connect() as connection:
+            # Readers (e.g. compare) don't block a run that's writing.
+            connection.execute("PRAGMA journal_mode = WAL")
+            for statement in SCHEMA:
+                connection.execute(statement)
+            connection.execute("PRAGMA user_version = {0}".format(SCHEMA_VERSION))
+
+    @contextlib.contextmanager
+    def __connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.path, timeout = 30)
+        try:
+            connection.execute("PRAGMA foreign_keys = ON")
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def record_run(self,
+                   context: RunContext,
+                   test_name: str,
+                   runtime: str,
+                   label: str,
+                   image: str,
+                   image_digest: Optional[str],
+                   parameters: Dict[str, Any],
+                   summary: Dict[str, Any],
+                   overall: Optional[pd.DataFrame],
+                   first_run: Optional[pd.DataFrame],
+                   host_description: Optional[Dict[str, Any]] = None) -> int:
+        times = overall["time_taken"] if overall is not None else pd.Series([], dtype = float)
+        # Runs measured on another docker host describe that machine instead of this one.
+        description = host_description if host_description is not None else get_host_description()
+
+        with self._lock, self.__connect() as connection:
+            connection.execute("INSERT OR IGNORE INTO hosts (host, description) VALUES (?, ?)",
+                               (context.host, json.dumps(description, sort_keys = True)))
+            cursor = connection.execute(
+                    "INSERT INTO runs (test_name, runtime, label, image, image_digest, git_commit, host, "
+                    "started_at, finished_at, samples, median_time, mean_time, parameters, summary) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (test_name, runtime, label, image, image_digest, context.git_commit, context.host,
+                     context.started_at, time.time(), len(times),
+                     float(times.median()) if len(times) > 0 else None,
+                     float(times.mean()) if len(times) > 0 else None,
+                     json.dumps(parameters, sort_keys = True), json.dumps(summary, sort_keys = True)))
+            assert cursor.lastrowid is not None, "Run wasn't stored."
+            run_id = int(cursor.lastrowid)
+
+            for kind, frame in [("overall", overall), ("first_run", first_run)]:
+                if frame is None:
+                    continue
+                rows = []
+                for name in frame.columns:
+                    blob = _to_blob(frame[name])
+                    if blob is not None:
+                        rows.append((run_id, kind, str(name), blob))
+                connection.executemany("INSERT INTO columns (run_id, kind, name, data) VALUES (?, ?, ?, ?)", rows)
+
+        logging.info("Stored run {0} of {1} ({2})".format(run_id, test_name, runtime))
+        return run_id
+
+    def find_runs(self,
+                  test_name: Optional[str] = None,
+                  runtime: Optional[str] = None,
+                  host: Optional[str] = None,
+                  git_commit: Optional[str] = None,
+                  label: Optional[str] = None,
+                  since: Optional[float] = None,
+                  last_commits: Optional[int] = None,
+                  limit: Optional[int] = None) -> pd.DataFrame:
+        # e.g. find_runs("merge_sort", "python3", last_commits = 200), newest first.
+        clauses: List[str] = []
+        arguments: List[Any] = []
+        for column, value in [("test_name", test_name), ("runtime", runtime), ("host", host),
+                              ("git_commit", git_commit), ("label", label)]:
+            if value is not None:
+                clauses.append("{0} = ?".format(column))
+                arguments.append(value)
+        if since is not None:
+            clauses.append("started_at >= ?")
+            arguments.append(since)
+        where = " AND ".join(clauses) if len(clauses) > 0 else "1"
+
+        if last_commits is not None:
+            # The most recently measured commits, not the last ones in git's history.
+            where = "{0} AND git_commit IN (SELECT git_commit FROM runs WHERE {0} AND git_commit IS NOT NULL " \
+                    "GROUP BY git_commit ORDER BY MAX(started_at) DESC LIMIT ?)".format(where)
+            arguments = arguments + arguments + [last_commits]
+
+        query = "SELECT {0} FROM runs WHERE {1} ORDER BY started_at DESC".format(", ".join(RUN_COLUMNS), where)
+        if limit is not None:
+            query += " LIMIT ?"
+            arguments.append(limit)
+
+        with self.__connect() as connection:
+            rows = connection.execute(query, arguments).fetchall()
+        return pd.DataFrame(rows, columns = RUN_COLUMNS)
+
+    def latest_runs(self, labels: Optional[List[str]] = None) -> pd.DataFrame:
+        # The newest run of every test, or of only the given labels, in label order.
+        runs = self.find_runs().drop_duplicates(subset = ["test_name", "runtime", "label"], keep = "first")
+        if labels is not None:
+            runs = runs[runs["label"].isin(labels)]
+        return runs.sort_values("label").reset_index(drop = True)
+
+    def load_columns(self, run_ids: List[int], kind: str = "overall",
+                     names: Optional[List[str]] = None) -> Dict[int, pd.DataFrame]:
+        if len(run_ids) == 0:
+            return {}
+        query = "SELECT run_id, name, data FROM columns WHERE kind = ? AND run_id IN ({0})".format(
+                ", ".join("?" for _ in run_ids))
+        arguments: List[Any] = [kind] + list(run_ids)
+        if names is not None:
+            query += " AND name IN ({0})".format(", ".join("?" for _ in names))
+            arguments.extend(names)
+
+        columns: Dict[int, Dict[str, np.ndarray]] = {}
+        with self.__connect() as connection:
+            for run_id, name, data in connection.execute(query, arguments):
+                columns.setdefault(run_id, {})[name] = np.frombuffer(data, dtype = "<f8")
+        return {run_id: pd.DataFrame(frame) for run_id, frame in columns.items()}
+
+    def load_run(self, run_id: int, kind: str = "overall") -> pd.DataFrame:
+        return self.load_columns([run_id], kind).get(run_id, pd.DataFrame())
+
+    def iter_samples(self, runs: pd.DataFrame, column: str = "time_taken") -> Iterator[Any]:
+        # (run row, values) for each run, with one query for all of them.
+        frames = self.load_columns([int(run_id) for run_id in runs["run_id"]], "overall", [column])
+        for run in runs.to_dict("records"):
+            frame = frames.get(int(run["run_id"]))
+            yield run, frame[column].to_numpy() if frame is not None and column in frame else np.empty(0)
+
+    def export_csv(self, run_id: int, path: str, kind: str = "overall") -> None:
+        self.load_run(run_id, kind).to_csv(path)
@@ -1,24 +1,52 @@
+import asyncio
 import logging
 import os
+import threading
 import time
-from typing import List, Dict, Union, Iterator, Tuple, Optional
+from typing import List, Dict, Union, Iterator, Tuple, Optional, Callable
 
-import docker
+import pandas as pd
 from docker import DockerClient
 from docker.models.containers import Container
 
-from bench.analysis import analyze_data, avg
-from bench.bdocker import generate_docker_file, build_docker_image, get_default_bench_command, \
-    get_default_bench_image
-from bench.types import TestResult, TestContainer
+from bench.analysis import analyze_data
+from bench.bdocker import generate_docker_file, build_docker_images, get_default_bench_command, \
+    get_default_bench_image, get_exec_command, get_timed_image, get_image_digest, pull_missing_image
+from bench.cache import BuildCache, compute_cache_key
+from bench.checkpoint import SampleCheckpoint
+from bench.cgroup import CgroupPaths, CgroupSampler, find_cgroup, DEFAULT_SAMPLER
+from bench.hosts import HostPool, HostUnavailable
+from bench.limits import DEFAULT_RETRY, Deadline, RetriesExhausted, SampleTimeout, backoff_delay, summarize, \
+    with_retries, ABORTED, MEASURED, SKIPPED, TIMED_OUT, UNAVAILABLE
+from bench.native import NativeRunner, NATIVE_BACKEND, find_native_command, get_native_calibrator
+from bench.complexity import expand_sweep, fit_sweeps, write_fits
+from bench.calibration import BaselineCalibrator, DEFAULT_BASELINE
+from bench.orchestrator import Orchestrator
+from bench.profiles import LEGACY_PROFILE, assign_profiles, container_settings as container_settings_for, \
+    expand_scaling
+from bench.scaling import scaling_curves, write_scaling
+from bench.plotting import render_report
+from bench.sampling import has_converged, sample_precision, DEFAULT_CONFIDENCE
+from bench.stats import StatsWriter
+from bench.store import ResultsStore, get_run_context, get_results_db
+from bench.timing import TIMER_COMMAND, parse_timing
+from bench.types import TestResult, TestContainer, CpuSlot, TestPlan, BaselineSettings, AdaptiveSettings, \
+    ExecutionSettings, SamplerSettings, RunContext, ResourceProfile, RetrySettings, TestOutcome
+from bench.warm import WarmContainerPool, exec_in_container, stream_stats
 
+DEFAULT_EXECUTION = ExecutionSettings(mode = "cold", warmup_iterations = 1, timing = "container",
+                                      host_affinity = False, backend = "docker")
 
-def get_tests(root_dir: str) -> Iterator[Tuple[str, List[str]]]:
+
+def get_tests(root_dir: str, only_tests: Optional[List[str]] = None) -> Iterator[Tuple[str, List[str]]]:
     logging.debug("Scanning: " + root_dir)
 
     for root, dir, files in os.walk(root_dir):
         # Don't include the root directory, and only include top-level directories.
         if root != "." and len(root.replace(root_dir, "").split("/")) == 2:
+            if only_tests is not None and os.path.basename(root) not in only_tests:
+                logging.debug("Unchanged: " + root)
+                continue
             yield root, files
         else:
             logging.debug("Skipping: " + root)
@@ -28,31 +56,273 @@ def run_benchmark(client: DockerClient,
                   root_dir: str,
                   container_settings: Dict[str, Union[str, int, bool]],
                   bench_image: Optional[str] = None,
-                  bench_test_command: Optional[str] = None) -> float:
-    while True:
-        final_benchmark_image = bench_image \
-            if bench_image is not None \
-            else get_default_bench_image(root_dir = root_dir,
-                                         client = client)
-        final_benchmark_command = bench_test_command \
-            if bench_test_command is not None \
-            else get_default_bench_command()
+                  bench_test_command: Optional[str] = None,
+                  iterations: Optional[int] = None,
+                  in_container_timing: bool = False,
+                  retry: Optional[RetrySettings] = None) -> float:
+    retry = retry if retry is not None else DEFAULT_RETRY
+    final_benchmark_image = bench_image \
+        if bench_image is not None \
+        else get_default_bench_image(root_dir = root_dir,
+                                     client = client)
+    final_benchmark_command = bench_test_command \
+        if bench_test_command is not None \
+        else get_default_bench_command()
+    if iterations is not None:
+        final_benchmark_command = "{0} {1}".format(final_benchmark_command, iterations)
+    if in_container_timing:
+        final_benchmark_command = "{0} {1}".format(TIMER_COMMAND, final_benchmark_command)
 
+    def attempt() -> Optional[float]:
         # MARK:// Run the 'before benchmark'
         bench_container: Container = client.containers.run(image = final_benchmark_image,
                                                            command = final_benchmark_command,
                                                            **container_settings)
         start = time.time()
-        bench_code = bench_container.wait()["StatusCode"]
+        bench_code, timed_out = __wait_container(bench_container, retry.benchmark_timeout)
         end = time.time()
         benchmark_time = end - start
-        bench_container.remove()
-        if bench_code != 0:
-            logging.warning("Benchmark failed.  Retrying after timeout.")
-            time.sleep(10)
+        if in_container_timing:
+            timing = parse_timing(bench_container.logs())
+            if timing is not None:
+                benchmark_time = timing.elapsed
+        bench_container.remove(force = True)
+        if timed_out or bench_code != 0:
+            return None
+        return benchmark_time
+
+    return with_retries(attempt, retry, "Benchmark")
+
+
+def __wait_container(container: Container, timeout: Optional[float]) -> Tuple[int, bool]:
+    # The exit code, and whether it had to be killed for running past `timeout`.
+    with Deadline(timeout, container.kill) as deadline:
+        exit_code = int(container.wait()["StatusCode"])
+    return exit_code, deadline.expired
+
+
+def __find_cgroup(container: Container, sampler: SamplerSettings) -> Optional[CgroupPaths]:
+    if sampler.source != "cgroup":
+        return None
+    cgroup = find_cgroup(container.id, sampler.cgroup_root)
+    if cgroup is None:
+        # e.g. a remote docker host, or the container already exited.
+        logging.info("No cgroup found for {0}, falling back to docker stats".format(container.short_id))
+    return cgroup
+
+
+def __drain_logs(container: Container) -> bytes:
+    # Follows the output while the test runs, so it's ready the moment the container exits.
+    return b"".join(container.logs(stream = True, follow = True))
+
+
+def __drain_docker_stats(container: Container, stats_writer: StatsWriter) -> None:
+    for s in container.stats(decode = True):
+        cpu_usage = s["cpu_stats"]["cpu_usage"]["total_usage"]
+        if cpu_usage == 0 and len(s["memory_stats"].keys()) == 0:
+            break
+        stats_writer.append_stats(s)
+
+
+async def __run_test_container(orchestrator: Orchestrator,
+                               client: DockerClient,
+                               docker_image_name: str,
+                               test_command: str,
+                               container_settings: Dict[str, Union[str, int, bool]],
+                               stats_file: str,
+                               timed_command: Optional[List[str]] = None,
+                               sampler: Optional[SamplerSettings] = None,
+                               timeout: Optional[float] = None) -> Tuple[float, int, bytes]:
+    sampler = sampler if sampler is not None else DEFAULT_SAMPLER
+    if timed_command is not None:
+        # The timing wrapper becomes the entrypoint, and runs the image's own command line.
+        test_container: Container = await orchestrator.call(client.containers.run,
+                                                            image = docker_image_name,
+                                                            entrypoint = timed_command,
+                                                            **container_settings)
+    else:
+        test_container = await orchestrator.call(client.containers.run,
+                                                 image = docker_image_name,
+                                                 command = test_command,
+                                                 **container_settings)
+    try:
+        start = time.time()
+        output = asyncio.ensure_future(orchestrator.call(__drain_logs, test_container))
+        cgroup = __find_cgroup(test_container, sampler)
+        # Only the fixed numeric schema is kept, and it goes straight to disk.
+        with StatsWriter(stats_file, metadata = {"source": "cgroup" if cgroup is not None else "docker",
+                                                 "mode": "cold"}) as stats_writer:
+            if cgroup is not None:
+                with CgroupSampler(cgroup, stats_writer, sampler.rate):
+                    test_exit_code, timed_out = await orchestrator.call(__wait_container, test_container, timeout)
+                end = time.time()
+            else:
+                stats = asyncio.ensure_future(orchestrator.call(__drain_docker_stats, test_container, stats_writer))
+                test_exit_code, timed_out = await orchestrator.call(__wait_container, test_container, timeout)
+                end = time.time()
+                await stats
+
+        test_output = await output
+    finally:
+        # Nothing else needs the container, so the next sample doesn't wait for it to be removed.
+        # Forced, so one whose sample was cancelled doesn't keep running.
+        orchestrator.background(test_container.remove, force = True)
+    if timed_out:
+        raise SampleTimeout("{0} ran for longer than {1}s".format(docker_image_name, timeout))
+    return end - start, test_exit_code, test_output
+
+
+async def __exec_test(orchestrator: Orchestrator,
+                      client: DockerClient,
+                      warm_pool: WarmContainerPool,
+                      container_settings: Dict[str, Union[str, int, bool]],
+                      stats_file: str,
+                      sampler: Optional[SamplerSettings] = None,
+                      timeout: Optional[float] = None) -> Tuple[float, int, bytes]:
+    sampler = sampler if sampler is not None else DEFAULT_SAMPLER
+    container = await orchestrator.call(warm_pool.get, container_settings)
+    cmd = await orchestrator.call(warm_pool.cmd)
+    cgroup = __find_cgroup(container, sampler)
+
+    with StatsWriter(stats_file, metadata = {"source": "cgroup" if cgroup is not None else "docker",
+                                             "mode": "warm"}) as stats_writer:
+        if cgroup is not None:
+            with CgroupSampler(cgroup, stats_writer, sampler.rate):
+                return await orchestrator.call(__exec_until, client, warm_pool, container, container_settings, cmd,
+                                               timeout)
+
+        stop = threading.Event()
+        stats = asyncio.ensure_future(orchestrator.call(stream_stats, container, stats_writer, stop))
+        try:
+            return await orchestrator.call(__exec_until, client, warm_pool, container, container_settings, cmd,
+                                           timeout)
+        finally:
+            stop.set()
+            await stats
+
+
+def __exec_until(client: DockerClient,
+                 warm_pool: WarmContainerPool,
+                 container: Container,
+                 container_settings: Dict[str, Union[str, int, bool]],
+                 cmd: List[str],
+                 timeout: Optional[float]) -> Tuple[float, int, bytes]:
+    # An exec can't be killed on its own, its container goes instead and the next sample starts a new one.
+    with Deadline(timeout, lambda: warm_pool.discard(container_settings)) as deadline:
+        try:
+            result = exec_in_container(client, container, cmd)
+        except Exception:
+            if not deadline.expired:
+                raise
+    if deadline.expired:
+        raise SampleTimeout("{0} ran for longer than {1}s".format(warm_pool.image, timeout))
+    return result
+
+
+async def run_sample_async(orchestrator: Orchestrator,
+                           client: DockerClient,
+                           root_dir: str,
+                           current_iteration: int,
+                           docker_image_name: str,
+                           test_command: str,
+                           size_of_sample: float,
+                           change_threshold: float,
+                           cpuset_cpus: str = "0",
+                           bench_image: Optional[str] = None,
+                           calibrator: Optional[BaselineCalibrator] = None,
+                           stats_file: Optional[str] = None,
+                           warm_pool: Optional[WarmContainerPool] = None,
+                           timed_command: Optional[List[str]] = None,
+                           sampler: Optional[SamplerSettings] = None,
+                           host: Optional[str] = None,
+                           profile: Optional[ResourceProfile] = None,
+                           retry: Optional[RetrySettings] = None) -> TestResult:
+    retry = retry if retry is not None else DEFAULT_RETRY
+    if stats_file is None:
+        stats_file = os.path.join(root_dir, "samples", "{0}.stats".format(current_iteration))
+
+    if calibrator is None:
+        calibrator = get_baseline_calibrator(client = client,
+                                             root_dir = root_dir,
+                                             bench_image = bench_image,
+                                             change_threshold = change_threshold,
+                                             retry = retry)
+
+    for attempt in range(1, retry.max_attempts + 1):
+        # The test gets its profile, the reference always runs the same way so it stays comparable.
+        container_settings = container_settings_for(profile, cpuset_cpus)
+        reference_settings = container_settings_for(LEGACY_PROFILE, cpuset_cpus)
+
+        logging.info("Running standard benchmark")
+        before_benchmark = await orchestrator.call(calibrator.before_sample, reference_settings)
+
+        logging.info("Running test")
+        if warm_pool is not None:
+            host_time, test_exit_code, output = await __exec_test(orchestrator = orchestrator,
+                                                                  client = client,
+                                                                  warm_pool = warm_pool,
+                                                                  container_settings = container_settings,
+                                                                  stats_file = stats_file,
+                                                                  sampler = sampler,
+                                                                  timeout = retry.test_timeout)
+        else:
+            host_time, test_exit_code, output = await __run_test_container(orchestrator = orchestrator,
+                                                                           client = client,
+                                                                           docker_image_name = docker_image_name,
+                                                                           test_command = test_command,
+                                                                           container_settings = container_settings,
+                                                                           stats_file = stats_file,
+                                                                           timed_command = timed_command,
+                                                                           sampler = sampler,
+                                                                           timeout = retry.test_timeout)
+
+        if test_exit_code != 0:
+            logging.debug("Output of the failed sample:\n{0}".format(output.decode("utf-8", errors = "replace")))
+
+        # Prefer the wrapper's monotonic clock, whatever the host saw on top of it is orchestration.
+        timing = parse_timing(output) if timed_command is not None or (warm_pool is not None and warm_pool.timed) else None
+        if timing is not None:
+            test_time = timing.elapsed
+            orchestration_time: Optional[float] = max(host_time - timing.elapsed, 0.0)
+        else:
+            if timed_command is not None:
+                logging.warning("No timing reported from inside the container, using the host time.")
+            test_time = host_time
+            orchestration_time = None
+
+        logging.info("Test: {0}/{1} {2} (cpus: {3}{4})".format(current_iteration,
+                                                               size_of_sample,
+                                                               "passed" if test_exit_code == 0 else "FAILED",
+                                                               cpuset_cpus,
+                                                               " on " + host if host is not None else ""))
+
+        # MARK:// Run the 'after benchmark'
+        logging.info("Running standard benchmark")
+        reference_time = await orchestrator.call(calibrator.after_sample, reference_settings, before_benchmark)
+
+        if reference_time is None:
+            await __back_off(attempt, retry)
             continue
 
-        return benchmark_time
+        logging.info("Saving results")
+        return TestResult(time_taken = test_time,
+                          test_time = reference_time,
+                          iteration = current_iteration - 1,
+                          status = test_exit_code,
+                          stats_file = stats_file,
+                          orchestration_time = orchestration_time,
+                          timing = timing,
+                          host = host)
+    raise RetriesExhausted("The host kept changing around sample {0} of {1}".format(current_iteration,
+                                                                                   docker_image_name))
+
+
+async def __back_off(attempt: int, retry: RetrySettings) -> None:
+    # The reference moved too much around the sample, give the host a moment before the next attempt.
+    if attempt < retry.max_attempts:
+        delay = backoff_delay(attempt, retry)
+        logging.info("Retrying test in {0:.1f}s ({1}/{2}).".format(delay, attempt, retry.max_attempts))
+        await asyncio.sleep(delay)
 
 
 def run_sample(client: DockerClient,
@@ -61,186 +331,990 @@ def run_sample(client: DockerClient,
                docker_image_name: str,
                test_command: str,
                size_of_sample: float,
-               change_threshold: float) -> TestResult:
-    while True:
-        # Slow down the container, so we can collect more stats.
-        container_settings: Dict[str, Union[str, int, bool]] = {
-            "cpu_period": 1000,
-            "cpu_quota": 1000,
-            "cpuset_cpus": "0",
-            "stdout": True,
-            "stderr": True,
-            "detach": True,
-            "tty"   : True
-        }
+               change_threshold: float,
+               cpuset_cpus: str = "0",
+               bench_image: Optional[str] = None,
+               calibrator: Optional[BaselineCalibrator] = None,
+               stats_file: Optional[str] = None,
+               warm_pool: Optional[WarmContainerPool] = None,
+               timed_command: Optional[List[str]] = None,
+               sampler: Optional[SamplerSettings] = None,
+               retry: Optional[RetrySettings] = None) -> TestResult:
+    orchestrator = Orchestrator([CpuSlot(index = 0, cpus = cpuset_cpus, node = 0, host = None)])
+    return orchestrator.run(run_sample_async(orchestrator,
+                                             client = client,
+                                             root_dir = root_dir,
+                                             current_iteration = current_iteration,
+                                             docker_image_name = docker_image_name,
+                                             test_command = test_command,
+                                             size_of_sample = size_of_sample,
+                                             change_threshold = change_threshold,
+                                             cpuset_cpus = cpuset_cpus,
+                                             bench_image = bench_image,
+                                             calibrator = calibrator,
+                                             stats_file = stats_file,
+                                             warm_pool = warm_pool,
+                                             timed_command = timed_command,
+                                             sampler = sampler,
+                                             retry = retry))
 
-        logging.info("Running standard benchmark")
-        before_benchmark = run_benchmark(client = client,
-                                         root_dir = root_dir,
-                                         container_settings = container_settings)
 
-        logging.info("Running test")
-        test_container: Container = client.containers.run(image = docker_image_name,
-                                                          command = test_command,
-                                                          **container_settings)
-        start = time.time()
-        stats = test_container.stats(decode = True)
-        processed_stats = []
-        for s in stats:
-            cpu_usage = s["cpu_stats"]["cpu_usage"]["total_usage"]
-            if cpu_usage == 0 and len(s["memory_stats"].keys()) == 0:
-                break
-            processed_stats.append(s)
-        test_exit_code = test_container.wait()["StatusCode"]
-        end = time.time()
+async def run_native_sample_async(orchestrator: Orchestrator,
+                                  runner: NativeRunner,
+                                  command: List[str],
+                                  workdir: Optional[str],
+                                  current_iteration: int,
+                                  size_of_sample: float,
+                                  calibrator: BaselineCalibrator,
+                                  cpuset_cpus: str = "0",
+                                  stats_file: Optional[str] = None,
+                                  sampler: Optional[SamplerSettings] = None,
+                                  host: Optional[str] = None,
+                                  profile: Optional[ResourceProfile] = None,
+                                  retry: Optional[RetrySettings] = None) -> TestResult:
+    # The same sample as `run_sample_async`, as a process on this machine instead of a container.
+    retry = retry if retry is not None else DEFAULT_RETRY
+    for attempt in range(1, retry.max_attempts + 1):
+        # The test gets its profile, the reference always runs the same way so it stays comparable.
+        container_settings = container_settings_for(profile, cpuset_cpus)
+        reference_settings = container_settings_for(LEGACY_PROFILE, cpuset_cpus)
 
-        test_time = end - start
-        logging.info("Test: {0}/{1} {2}".format(current_iteration,
-                                                size_of_sample,
-                                                "passed" if test_exit_code == 0 else "FAILED"))
+        logging.info("Running standard benchmark")
+        before_benchmark = await orchestrator.call(calibrator.before_sample, reference_settings)
 
+        logging.info("Running test")
+        _, test_exit_code, output, timing = await orchestrator.call(runner.run,
+                                                                    command = command,
+                                                                    cwd = workdir,
+                                                                    container_settings = container_settings,
+                                                                    stats_file = stats_file,
+                                                                    sampler = sampler,
+                                                                    timeout = retry.test_timeout)
         if test_exit_code != 0:
-            print(test_container.logs())
-        test_container.remove()
+            logging.debug("Output of the failed sample:\n{0}".format(output.decode("utf-8", errors = "replace")))
 
-        # MARK:// Run the 'after benchmark'
-        logging.info("Running standard benchmark")
-        after_benchmark = run_benchmark(client = client,
-                                        root_dir = root_dir,
-                                        container_settings = container_settings)
+        logging.info("Test: {0}/{1} {2} (cpus: {3}, native)".format(current_iteration,
+                                                                    size_of_sample,
+                                                                    "passed" if test_exit_code == 0 else "FAILED",
+                                                                    cpuset_cpus))
 
-        change_percent = ((float(after_benchmark) - before_benchmark) / before_benchmark) * 100
+        logging.info("Running standard benchmark")
+        reference_time = await orchestrator.call(calibrator.after_sample, reference_settings, before_benchmark)
 
-        if change_percent >= change_threshold:
-            logging.info(
-                "System seems to have changed by: {0}%. Retrying test after timeout.".format(round(change_percent, 4)))
-            time.sleep(10)
+        if reference_time is None:
+            await __back_off(attempt, retry)
             continue
 
         logging.info("Saving results")
-        return TestResult(time_taken = test_time,
-                          test_time = avg([before_benchmark, after_benchmark]),
+        # Nothing stands between bench and the process, so there's no orchestration overhead to report.
+        return TestResult(time_taken = timing.elapsed,
+                          test_time = reference_time,
                           iteration = current_iteration - 1,
                           status = test_exit_code,
-                          system_info = processed_stats)
-
-def __run_test_with_name(client: DockerClient,
-                         root_dir: str,
-                         docker_image_name: str,
-                         test_command: str,
-                         auto_skip: bool,
-                         size_of_sample: int,
-                         change_threshold: float,
-                         results_dir: str,
-                         test_name: str,
-                         first_run_plot_base_name: str,
-                         overall_run_plot_base_name: str,
-                         should_plot: bool = False) -> None:
+                          stats_file = stats_file,
+                          orchestration_time = None,
+                          timing = timing,
+                          host = host)
+    raise RetriesExhausted("The host kept changing around sample {0} of {1}".format(current_iteration,
+                                                                                   " ".join(command)))
+
+
+def get_baseline_calibrator(client: DockerClient,
+                            root_dir: str,
+                            bench_image: Optional[str] = None,
+                            change_threshold: float = 5.0,
+                            baseline: Optional[BaselineSettings] = None,
+                            in_container_timing: bool = False,
+                            retry: Optional[RetrySettings] = None) -> BaselineCalibrator:
+    settings = baseline if baseline is not None else DEFAULT_BASELINE
+
+    def run_reference(container_settings: Dict[str, Union[str, int, bool]], iterations: int) -> float:
+        return run_benchmark(client = client,
+                             root_dir = root_dir,
+                             container_settings = container_settings,
+                             bench_image = bench_image,
+                             iterations = iterations,
+                             in_container_timing = in_container_timing,
+                             retry = retry)
+
+    return BaselineCalibrator(run_reference = run_reference,
+                              mode = settings.mode,
+                              change_threshold = change_threshold,
+                              target_duration = settings.target_duration,
+                              window_size = settings.window_size,
+                              refresh_every = settings.refresh_every,
+                              max_age = settings.max_age)
+
+
+async def __gather_samples(futures: List["asyncio.Future[TestResult]"]) -> List[TestResult]:
+    # Once a sample timed out or gave up the test is over, so the rest of its samples are cancelled.
+    try:
+        return list(await asyncio.gather(*futures))
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+
+def __missing_samples(done: List[TestResult], count: int) -> List[int]:
+    # The sample numbers up to `count` that haven't been measured yet, results are numbered from 0.
+    measured = set(result.iteration for result in done)
+    return [current for current in range(1, count + 1) if current - 1 not in measured]
+
+
+async def __collect_samples(queue_samples: Callable[[List[int]], List["asyncio.Future[TestResult]"]],
+                            test_name: str,
+                            size_of_sample: int,
+                            adaptive: Optional[AdaptiveSettings],
+                            batch_size: int,
+                            done: Optional[List[TestResult]] = None) -> Tuple[List[TestResult], float]:
+    # `done` are the samples a resumed test already has, only the rest are measured.
+    done = done if done is not None else []
+    if len(done) > 0:
+        logging.info("Resuming test: {0} from {1} checkpointed samples".format(test_name, len(done)))
+    if adaptive is None:
+        logging.info("Running test: {0} with samples: {1}".format(test_name, size_of_sample))
+        test_results: List[TestResult] = done + await __gather_samples(
+                queue_samples(__missing_samples(done, size_of_sample)))
+        precision = sample_precision(test_results, DEFAULT_CONFIDENCE)
+    else:
+        logging.info("Running test: {0} with {1} to {2} samples".format(test_name,
+                                                                        adaptive.min_samples,
+                                                                        adaptive.max_samples))
+        test_results = done + await __gather_samples(queue_samples(__missing_samples(done, adaptive.min_samples)))
+        converged, precision = has_converged(test_results, adaptive.min_samples,
+                                             adaptive.target_ci_width, adaptive.confidence)
+
+        # Keep every slot busy with each extra round, until the estimate is precise enough.
+        while not converged and len(test_results) < adaptive.max_samples:
+            logging.info("{0}: relative CI width {1:.4f} > {2}, sampling more".format(test_name,
+                                                                                      precision,
+                                                                                      adaptive.target_ci_width))
+            batch = min(batch_size, adaptive.max_samples - len(test_results))
+            first = max(result.iteration for result in test_results) + 2
+            test_results.extend(await __gather_samples(queue_samples(list(range(first, first + batch)))))
+            converged, precision = has_converged(test_results, adaptive.min_samples,
+                                                 adaptive.target_ci_width, adaptive.confidence)
+
+        logging.info("{0}: {1} after {2} samples (relative CI width {3:.4f})".format(
+                test_name, "converged" if converged else "stopped", len(test_results), precision))
+
+    return test_results, precision
+
+
+def __analyze(test_results: List[TestResult], results_dir: str, first_run_plot_base_name: str,
+              overall_run_plot_base_name: str,
+              test_summary: Dict[str, Optional[float]],
+              export_csv: bool) -> Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame]]:
     first_run_csv = results_dir + "/tables/{0}.csv".format(first_run_plot_base_name)
     overall_run_csv = results_dir + "/tables/{0}.csv".format(overall_run_plot_base_name)
 
-    if auto_skip and os.path.exists(first_run_csv) and os.path.exists(overall_run_csv):
-        logging.info("Test already run.  Skipping. (FROM AUTO_SKIP)")
-        return
+    return analyze_data(test_results,
+                        results_dir,
+                        first_run_csv,
+                        overall_run_csv,
+                        test_summary = test_summary,
+                        export_csv = export_csv)
 
-    logging.info("Running test: {0} with samples: {1}".format(test_name, size_of_sample))
 
-    test_results = []
-    for current_test in range(1, size_of_sample + 1):
-        logging.info("Starting Test: {0}/{1}".format(current_test, size_of_sample))
-        test_results.append(run_sample(client = client,
-                                       root_dir = root_dir,
-                                       current_iteration = current_test,
-                                       docker_image_name = docker_image_name,
-                                       test_command = test_command,
-                                       size_of_sample = size_of_sample,
-                                       change_threshold = change_threshold))
+async def __run_test_with_name(orchestrator: Orchestrator,
+                               hosts: Optional[HostPool],
+                               root_dir: str,
+                               docker_image_name: str,
+                               test_command: str,
+                               size_of_sample: int,
+                               change_threshold: float,
+                               results_dir: str,
+                               test_name: str,
+                               first_run_plot_base_name: str,
+                               overall_run_plot_base_name: str,
+                               calibrators: Dict[str, BaselineCalibrator],
+                               build_cache: Optional[BuildCache] = None,
+                               cache_key: Optional[str] = None,
+                               adaptive: Optional[AdaptiveSettings] = None,
+                               execution: Optional[ExecutionSettings] = None,
+                               sampler: Optional[SamplerSettings] = None,
+                               store: Optional[ResultsStore] = None,
+                               run_context: Optional[RunContext] = None,
+                               run_parameters: Optional[Dict[str, Union[str, int, float]]] = None,
+                               runtime: Optional[str] = None,
+                               export_csv: bool = True,
+                               on_host: Optional[str] = None,
+                               runner: Optional[NativeRunner] = None,
+                               workdir: Optional[str] = None,
+                               profile: Optional[ResourceProfile] = None,
+                               retry: Optional[RetrySettings] = None,
+                               resume: bool = False) -> None:
+    # Without docker hosts the samples run natively with `runner`.
+    execution = execution if execution is not None else DEFAULT_EXECUTION
+    samples_dir = os.path.join(results_dir, "samples", overall_run_plot_base_name)
+    max_samples = adaptive.max_samples if adaptive is not None else size_of_sample
+    checkpoint = SampleCheckpoint(samples_dir, {"label"     : overall_run_plot_base_name,
+                                                "first_run" : first_run_plot_base_name,
+                                                "test_name" : test_name,
+                                                "runtime"   : runtime,
+                                                "image"     : docker_image_name,
+                                                "cache_key" : cache_key,
+                                                "started_at": time.time()})
+    done = await orchestrator.call(checkpoint.start, resume)
 
-    analyze_data(test_results,
-                 results_dir,
-                 first_run_csv,
-                 overall_run_csv,
-                 first_run_plot_base_name,
-                 overall_run_plot_base_name,
-                 should_plot)
+    # Warm mode keeps a container per CPU slot alive for the whole test, on each host it runs on.
+    timed = execution.timing == "container"
+    warm_pools: Dict[str, WarmContainerPool] = {}
+    timed_command = [TIMER_COMMAND] + await orchestrator.call(get_exec_command, hosts.client(on_host),
+                                                              docker_image_name, test_command) \
+        if hosts is not None and timed and execution.mode != "warm" else None
 
+    def get_warm_pool(host: str) -> Optional[WarmContainerPool]:
+        if hosts is None or execution is None or execution.mode != "warm":
+            return None
+        if host not in warm_pools:
+            warm_pools[host] = WarmContainerPool(client = hosts.client(host),
+                                                 image = docker_image_name,
+                                                 command = test_command,
+                                                 warmup_iterations = execution.warmup_iterations,
+                                                 timed = timed)
+        return warm_pools[host]
 
-def run_tests_with_docker_image(root_dir: str,
-                                images: List[TestContainer],
-                                auto_skip: bool,
-                                size_of_sample: int,
-                                change_threshold: float,
-                                results_dir: str,
-                                should_plot: bool = False) -> None:
-    client = docker.client.from_env()
+    async def sample_on_host(current_iteration: int, cpuset_cpus: str, host: Optional[str]) -> TestResult:
+        result = await measure_sample(current_iteration, cpuset_cpus, host)
+        # On disk before anything else happens, a resumed run starts after it.
+        await orchestrator.call(checkpoint.append, result)
+        return result
+
+    async def measure_sample(current_iteration: int, cpuset_cpus: str, host: Optional[str]) -> TestResult:
+        stats_file = os.path.join(samples_dir, "{0}.stats".format(current_iteration))
+        if hosts is None:
+            assert runner is not None, "Need docker hosts or a native runner."
+            return await run_native_sample_async(orchestrator,
+                                                 runner = runner,
+                                                 command = find_native_command(test_command, workdir) or [],
+                                                 workdir = workdir,
+                                                 current_iteration = current_iteration,
+                                                 size_of_sample = max_samples,
+                                                 calibrator = calibrators[NATIVE_BACKEND],
+                                                 cpuset_cpus = cpuset_cpus,
+                                                 stats_file = stats_file,
+                                                 sampler = sampler,
+                                                 host = host,
+                                                 profile = profile,
+                                                 retry = retry)
+
+        # Whichever host's slot the sample got, it runs with that host's client, reference and containers.
+        host = host if host is not None else hosts.names()[0]
+        return await run_sample_async(orchestrator,
+                                      client = hosts.client(host),
+                                      root_dir = root_dir,
+                                      current_iteration = current_iteration,
+                                      docker_image_name = docker_image_name,
+                                      test_command = test_command,
+                                      size_of_sample = max_samples,
+                                      change_threshold = change_threshold,
+                                      cpuset_cpus = cpuset_cpus,
+                                      calibrator = calibrators[host],
+                                      stats_file = stats_file,
+                                      warm_pool = get_warm_pool(host),
+                                      timed_command = timed_command,
+                                      sampler = sampler,
+                                      host = host,
+                                      profile = profile,
+                                      retry = retry)
+
+    def queue_samples(iterations: List[int]) -> List["asyncio.Future[TestResult]"]:
+        # Samples are independent, so they can run side by side on separate CPU slots (and hosts).
+        futures = []
+        for current_test in iterations:
+            logging.info("Queueing Test: {0}/{1}".format(current_test, max_samples))
+            futures.append(orchestrator.submit(sample_on_host,
+                                               current_test,
+                                               on_host = on_host,
+                                               needs_image = docker_image_name if hosts is not None else None))
+        return futures
+
+    try:
+        test_results, precision = await __collect_samples(queue_samples = queue_samples,
+                                                          test_name = test_name,
+                                                          size_of_sample = size_of_sample,
+                                                          adaptive = adaptive,
+                                                          batch_size = len(orchestrator.slots),
+                                                          done = done)
+    finally:
+        checkpoint.close()
+        for warm_pool in warm_pools.values():
+            orchestrator.background(warm_pool.close)
+
+    test_results = sorted(test_results, key = lambda result: result.iteration)
+
+    test_summary: Dict[str, Optional[float]] = {
+        "samples_used"     : len(test_results),
+        "ci_relative_width": precision,
+    }
+    cold_start_times = [pool.cold_start_time() for pool in warm_pools.values()]
+    if len(warm_pools) > 0:
+        measured = [value for value in cold_start_times if value is not None]
+        test_summary["cold_start_time"] = sum(measured) / len(measured) if len(measured) > 0 else None
+
+    # Analysis runs off the loop, so the next test's samples keep going meanwhile.
+    first_run, overall = await orchestrator.call(__analyze, test_results, results_dir, first_run_plot_base_name,
+                                                 overall_run_plot_base_name, test_summary, export_csv)
+
+    if store is not None and run_context is not None:
+        # Stored under the machine the samples ran on, or a combination when they were spread out.
+        host_fingerprint, host_description = run_context.host, None
+        image_digest = None
+        if hosts is not None:
+            ran_on = [result.host if result.host is not None else hosts.names()[0] for result in test_results]
+            host_fingerprint, host_description = await orchestrator.call(hosts.fingerprint, ran_on)
+            image_digest = await orchestrator.call(get_image_digest, hosts.client(ran_on[0]), docker_image_name)
+        await orchestrator.call(store.record_run,
+                                context = run_context._replace(host = host_fingerprint),
+                                host_description = host_description,
+                                test_name = test_name,
+                                runtime = runtime if runtime is not None else test_command.split(" ")[0],
+                                label = overall_run_plot_base_name,
+                                image = docker_image_name,
+                                image_digest = image_digest,
+                                parameters = run_parameters if run_parameters is not None else {},
+                                summary = test_summary,
+                                overall = overall,
+                                first_run = first_run)
+
+    # Only remember the test once its results are on disk. Kept by label, an image can be measured several ways.
+    if build_cache is not None and cache_key is not None:
+        build_cache.update(overall_run_plot_base_name, cache_key)
+    checkpoint.complete()
+
+
+def __default_cpu_slots() -> List[CpuSlot]:
+    # Matches the historical behaviour of pinning everything to the first core.
+    return [CpuSlot(index = 0, cpus = "0", node = 0, host = None)]
+
+
+def __get_orchestrator(cpu_slots: Optional[List[CpuSlot]], hosts: Optional[HostPool]) -> Orchestrator:
+    hosts = hosts if hosts is not None else HostPool()
+    slots = cpu_slots if cpu_slots is not None else __default_cpu_slots()
+    # Slots that don't say which host they're on are on the first one.
+    return Orchestrator([slot if slot.host is not None else slot._replace(host = hosts.names()[0]) for slot in slots],
+                        hosts = hosts)
+
+
+def __get_cache_file(results_dir: str) -> str:
+    return os.path.join(results_dir, "build_cache.json")
+
+
+def __run_parameters(plan: TestPlan,
+                     size_of_sample: int,
+                     change_threshold: float,
+                     baseline: BaselineSettings,
+                     adaptive: Optional[AdaptiveSettings],
+                     execution: Optional[ExecutionSettings],
+                     sampler: Optional[SamplerSettings]) -> Dict[str, Union[str, int, float]]:
+    # Everything that changes what a measurement means, a change to any of these re-runs the test.
+    parameters: Dict[str, Union[str, int, float]] = {
+        "run_command"      : plan.run_command,
+        "size_of_sample"   : size_of_sample,
+        "change_threshold" : change_threshold,
+        "baseline_mode"    : baseline.mode,
+        "baseline_duration": baseline.target_duration,
+    }
+    if adaptive is not None:
+        parameters.update({
+            "min_samples"    : adaptive.min_samples,
+            "max_samples"    : adaptive.max_samples,
+            "target_ci_width": adaptive.target_ci_width,
+            "confidence"     : adaptive.confidence,
+        })
+    if execution is not None:
+        parameters.update({
+            "execution_mode"   : execution.mode,
+            "warmup_iterations": execution.warmup_iterations,
+            "timing"           : execution.timing,
+            "backend"          : execution.backend,
+        })
+    if sampler is not None:
+        parameters.update({
+            "stats_source": sampler.source,
+            "sample_rate" : sampler.rate,
+        })
+    if plan.profile is not None and plan.profile != LEGACY_PROFILE:
+        parameters.update({"profile_" + key: value for key, value in plan.profile._asdict().items()
+                           if value is not None})
+    return parameters
+
+
+def __key_plans(client: Optional[DockerClient],
+                 root_dir: str,
+                 plans: List[TestPlan],
+                 size_of_sample: int,
+                 change_threshold: float,
+                 baseline: BaselineSettings,
+                 adaptive: Optional[AdaptiveSettings],
+                 execution: Optional[ExecutionSettings],
+                 sampler: Optional[SamplerSettings]) -> List[TestPlan]:
+    return [plan._replace(cache_key = compute_cache_key(root_dir = root_dir,
+                                                        dockerfile = plan.dockerfile,
+                                                        image = plan.image,
+                                                        run_params = __run_parameters(plan, size_of_sample,
+                                                                                      change_threshold, baseline,
+                                                                                      adaptive, execution, sampler),
+                                                        client = client))
+            for plan in plans]
+
+
+def __skip_cached(client: Optional[DockerClient],
+                  root_dir: str,
+                  plans: List[TestPlan],
+                  build_cache: BuildCache,
+                  auto_skip: bool,
+                  size_of_sample: int,
+                  change_threshold: float,
+                  baseline: BaselineSettings,
+                  adaptive: Optional[AdaptiveSettings],
+                  execution: Optional[ExecutionSettings],
+                  sampler: Optional[SamplerSettings],
+                  resume: bool = False) -> List[TestPlan]:
+    # Resuming also skips what the interrupted run already finished. A test whose base image isn't
+    # here yet has no key, it's built and keyed again before it's measured.
+    pending: List[TestPlan] = []
+    for plan in __key_plans(client, root_dir, plans, size_of_sample, change_threshold, baseline, adaptive,
+                            execution, sampler):
+        if (auto_skip or resume) and plan.cache_key is not None and \
+                build_cache.is_fresh(plan.overall_run_name, plan.cache_key):
+            logging.info("Test unchanged since last run.  Skipping {0}. (FROM AUTO_SKIP)".format(plan.test_name))
+            continue
+        pending.append(plan)
+    return pending
+
+
+async def __get_bench_images(orchestrator: Orchestrator, hosts: HostPool, root_dir: str) -> Dict[str, str]:
+    # The reference benchmark (and timer) image on every host, one host after the other,
+    # since they're all built from the same generated Dockerfile.
+    bench_images: Dict[str, str] = {}
+    for name in hosts.names():
+        try:
+            bench_images[name] = await orchestrator.call(get_default_bench_image, root_dir = root_dir,
+                                                         client = hosts.client(name))
+        except OSError as e:
+            if await orchestrator.call(hosts.is_alive, name):
+                raise
+            logging.error("Building the benchmark image on {0} failed: {1}".format(name, e))
+            await orchestrator.drop_host(name)
+    return bench_images
+
+
+async def __build_on_hosts(orchestrator: Orchestrator, hosts: HostPool, root_dir: str,
+                           images: List[Tuple[str, str]], build_workers: int) -> Tuple[List[str], List[str]]:
+    # Every image is built on every host, a host missing one just won't be sent its samples.
+    names = hosts.names()
+    results = await asyncio.gather(*[orchestrator.call(build_docker_images,
+                                                       images = images,
+                                                       client = hosts.client(name),
+                                                       root_dir = root_dir,
+                                                       max_workers = build_workers) for name in names])
+    built_anywhere = set()
+    for name, (built, failed) in zip(names, results):
+        built_anywhere.update(built)
+        for image in failed:
+            hosts.mark_missing(name, image)
+        if len(built) == 0 and len(failed) > 0 and not await orchestrator.call(hosts.is_alive, name):
+            await orchestrator.drop_host(name)
+
+    built_images = [image for image, _ in images if image in built_anywhere]
+    return built_images, [image for image, _ in images if image not in built_anywhere]
+
+
+async def __get_timed_image(orchestrator: Orchestrator, hosts: HostPool, image: str,
+                            bench_images: Dict[str, str]) -> str:
+    names = [name for name in hosts.names() if name in bench_images]
+    timed_images = await asyncio.gather(*[orchestrator.call(get_timed_image, hosts.client(name), image,
+                                                            bench_images[name]) for name in names])
+    timed_image = next((timed for timed in timed_images if timed != image), image)
+    for name, timed in zip(names, timed_images):
+        if timed != timed_image:
+            hosts.mark_missing(name, timed_image)
+    return timed_image
+
+
+async def __measure_tests(orchestrator: Orchestrator,
+                          hosts: Optional[HostPool],
+                          root_dir: str,
+                          plans: List[TestPlan],
+                          build_cache: BuildCache,
+                          size_of_sample: int,
+                          change_threshold: float,
+                          results_dir: str,
+                          baseline: BaselineSettings,
+                          adaptive: Optional[AdaptiveSettings],
+                          execution: Optional[ExecutionSettings],
+                          sampler: Optional[SamplerSettings],
+                          store: Optional[ResultsStore] = None,
+                          export_csv: bool = True,
+                          runner: Optional[NativeRunner] = None,
+                          retry: Optional[RetrySettings] = None,
+                          resume: bool = False) -> List[TestOutcome]:
+    execution = execution if execution is not None else DEFAULT_EXECUTION
+    retry = retry if retry is not None else DEFAULT_RETRY
+    run_context = get_run_context(root_dir)
+    if hosts is None:
+        assert runner is not None, "Need docker hosts or a native runner."
+        bench_images: Dict[str, str] = {}
+        calibrators = {NATIVE_BACKEND: await orchestrator.call(get_native_calibrator, runner,
+                                                               change_threshold = change_threshold,
+                                                               baseline = baseline,
+                                                               retry = retry)}
+    else:
+        bench_images = await __get_bench_images(orchestrator, hosts, root_dir)
+        # Each host normalizes its samples with a reference measured on that host.
+        calibrators = {name: get_baseline_calibrator(client = hosts.client(name),
+                                                     root_dir = root_dir,
+                                                     bench_image = bench_image,
+                                                     change_threshold = change_threshold,
+                                                     baseline = baseline,
+                                                     in_container_timing = execution.timing == "container",
+                                                     retry = retry)
+                       for name, bench_image in bench_images.items()}
+
+    if hosts is not None and execution.timing == "container":
+        # Images that weren't generated here don't have the timer yet, so it's layered on top.
+        plans = [plan._replace(image = await __get_timed_image(orchestrator, hosts, plan.image, bench_images))
+                 if plan.dockerfile is None else plan for plan in plans]
+
+    # As many tests in flight as there are slots, so each one's samples can fill the slots between rounds.
+    running = asyncio.Semaphore(len(orchestrator.slots))
+
+    async def run_test_on(plan: TestPlan, on_host: Optional[str]) -> None:
+        await __run_test_with_name(orchestrator = orchestrator,
+                                   hosts = hosts,
+                                   root_dir = root_dir,
+                                   docker_image_name = plan.image,
+                                   test_command = plan.run_command,
+                                   size_of_sample = size_of_sample,
+                                   change_threshold = change_threshold,
+                                   results_dir = results_dir,
+                                   test_name = plan.test_name,
+                                   first_run_plot_base_name = plan.first_run_name,
+                                   overall_run_plot_base_name = plan.overall_run_name,
+                                   calibrators = calibrators,
+                                   build_cache = build_cache,
+                                   cache_key = plan.cache_key,
+                                   adaptive = adaptive,
+                                   execution = execution,
+                                   sampler = sampler,
+                                   store = store,
+                                   run_context = run_context,
+                                   runtime = plan.runtime,
+                                   run_parameters = __run_parameters(plan, size_of_sample, change_threshold,
+                                                                     baseline, adaptive, execution, sampler),
+                                   export_csv = export_csv,
+                                   on_host = on_host,
+                                   runner = runner,
+                                   workdir = plan.workdir,
+                                   profile = plan.profile,
+                                   retry = retry,
+                                   resume = resume)
+
+    async def run_test(plan: TestPlan) -> TestOutcome:
+        async with running:
+            attempt = 0
+            while True:
+                # Pinned to one host, every sample of the test sees the same machine.
+                on_host = orchestrator.pick_host(plan.image) \
+                    if hosts is not None and execution is not None and execution.host_affinity else None
+                try:
+                    await run_test_on(plan, on_host)
+                    return __outcome(plan, MEASURED)
+                except SampleTimeout as e:
+                    # Nothing is stored for it, the rest of the run goes on.
+                    logging.error("Gave up on {0}: {1}".format(plan.test_name, e))
+                    return __outcome(plan, TIMED_OUT, str(e))
+                except RetriesExhausted as e:
+                    logging.error("Gave up on {0}: {1}".format(plan.test_name, e))
+                    return __outcome(plan, ABORTED, str(e))
+                except HostUnavailable:
+                    attempt += 1
+                    if on_host is None or attempt > orchestrator.host_retries:
+                        raise
+                    logging.warning("Lost {0} while running {1}, starting it over on another host".format(
+                            on_host, plan.test_name))
+
+    # Let every test finish before reporting the first failure.
+    outcomes: List[TestOutcome] = []
+    for result in await asyncio.gather(*[run_test(plan) for plan in plans], return_exceptions = True):
+        if isinstance(result, BaseException):
+            raise result
+        outcomes.append(result)
+    return outcomes
+
+
+def __outcome(plan: TestPlan, status: str, detail: str = "") -> TestOutcome:
+    return TestOutcome(test_name = plan.test_name,
+                       runtime = plan.runtime,
+                       label = plan.overall_run_name,
+                       status = status,
+                       detail = detail)
+
+
+async def __write_scaling(orchestrator: Orchestrator, store: ResultsStore, results_dir: str,
+                          plans: List[TestPlan], core_counts: Optional[List[int]]) -> None:
+    if core_counts is None or len(core_counts) < 2:
+        return
+    points = await orchestrator.call(scaling_curves, store, plans, core_counts)
+    if len(points) > 0:
+        os.makedirs(os.path.join(results_dir, "tables"), exist_ok = True)
+        write_scaling(points, os.path.join(results_dir, "tables", "scaling.csv"))
+
+
+async def run_tests_with_docker_image_async(orchestrator: Orchestrator,
+                                            root_dir: str,
+                                            images: List[TestContainer],
+                                            auto_skip: bool,
+                                            size_of_sample: int,
+                                            change_threshold: float,
+                                            results_dir: str,
+                                            should_plot: bool = False,
+                                            baseline: Optional[BaselineSettings] = None,
+                                            adaptive: Optional[AdaptiveSettings] = None,
+                                            execution: Optional[ExecutionSettings] = None,
+                                            sampler: Optional[SamplerSettings] = None,
+                                            results_db: Optional[str] = None,
+                                            export_csv: bool = True,
+                                            profile: Optional[ResourceProfile] = None,
+                                            test_profiles: Optional[Dict[str, ResourceProfile]] = None,
+                                            core_counts: Optional[List[int]] = None,
+                                            retry: Optional[RetrySettings] = None,
+                                            resume: bool = False) -> List[TestOutcome]:
+    hosts = orchestrator.hosts if orchestrator.hosts is not None else HostPool()
+    baseline = baseline if baseline is not None else DEFAULT_BASELINE
 
     if not os.path.exists(root_dir):
         os.makedirs(root_dir, exist_ok = True)
 
-    for test in images:
+    plans: List[TestPlan] = []
+    # Sweeps are run as one test per value, and related again once they're all measured.
+    for test, _ in [point for image in images for point in expand_sweep(image)]:
         assert test.image is not None, "Must provide image name"
         first_run_plot_base_name = "first_" + test.test_name if test.test_name is not None else test.image
         overall_run_plot_base_name = "overall_" + test.test_name if test.test_name is not None else test.image
-        __run_test_with_name(client = client,
-                             root_dir = root_dir,
-                             docker_image_name = test.image,
-                             test_command = test.run_command,
-                             auto_skip = auto_skip,
-                             size_of_sample = size_of_sample,
-                             change_threshold = change_threshold,
-                             results_dir = results_dir,
-                             test_name = test.test_name,
-                             should_plot = should_plot,
-                             first_run_plot_base_name = first_run_plot_base_name,
-                             overall_run_plot_base_name = overall_run_plot_base_name)
+        plans.append(TestPlan(image = test.image,
+                              run_command = test.run_command,
+                              test_name = test.test_name,
+                              dockerfile = None,
+                              first_run_name = first_run_plot_base_name,
+                              overall_run_name = overall_run_plot_base_name,
+                              cache_key = None,
+                              # The run command is only arguments here, the image says what it runs.
+                              runtime = test.image.split(":")[0],
+                              workdir = None,
+                              profile = None))
 
+    # Scaling runs are one test per core count, and related again once they're all measured.
+    base_plans = assign_profiles(plans, profile if profile is not None else LEGACY_PROFILE, test_profiles or {})
+    all_plans = expand_scaling(base_plans, core_counts or [])
 
-def run_tests(root_dir: str, auto_skip: bool, docker_image_prefix: str,
-              size_of_sample: int, change_threshold: float, results_dir: str, should_plot: bool = False) -> None:
-    logging.info("Getting docker client")
-    client = docker.client.from_env()
+    build_cache = BuildCache(__get_cache_file(results_dir))
+    store = ResultsStore(results_db if results_db is not None else get_results_db(results_dir))
+    for image in dict.fromkeys(plan.image for plan in all_plans):
+        await orchestrator.call(pull_missing_image, hosts.client(), image)
+    plans = await orchestrator.call(__skip_cached,
+                                    client = hosts.client(),
+                                    root_dir = root_dir,
+                                    plans = all_plans,
+                                    build_cache = build_cache,
+                                    auto_skip = auto_skip,
+                                    size_of_sample = size_of_sample,
+                                    change_threshold = change_threshold,
+                                    baseline = baseline,
+                                    adaptive = adaptive,
+                                    execution = execution,
+                                    sampler = sampler,
+                                    resume = resume)
+
+    outcomes = __skipped(all_plans, plans)
+    outcomes += await __measure_tests(orchestrator = orchestrator,
+                                      hosts = hosts,
+                                      root_dir = root_dir,
+                                      plans = plans,
+                                      build_cache = build_cache,
+                                      size_of_sample = size_of_sample,
+                                      change_threshold = change_threshold,
+                                      results_dir = results_dir,
+                                      baseline = baseline,
+                                      adaptive = adaptive,
+                                      execution = execution,
+                                      sampler = sampler,
+                                      store = store,
+                                      export_csv = export_csv,
+                                      retry = retry,
+                                      resume = resume)
 
+    fits = await orchestrator.call(fit_sweeps, store, images)
+    if len(fits) > 0:
+        os.makedirs(os.path.join(results_dir, "tables"), exist_ok = True)
+        write_fits(fits, os.path.join(results_dir, "tables", "complexity.csv"))
+    await __write_scaling(orchestrator, store, results_dir, base_plans, core_counts)
+
+    if should_plot:
+        # Every test is in the report, including the ones skipped as unchanged.
+        await orchestrator.call(render_report, results_dir, store, [plan.overall_run_name for plan in all_plans])
+    summarize(outcomes, results_dir)
+    return outcomes
+
+
+def __skipped(all_plans: List[TestPlan], pending: List[TestPlan]) -> List[TestOutcome]:
+    measuring = set(plan.overall_run_name for plan in pending)
+    return [__outcome(plan, SKIPPED, "unchanged since its last run") for plan in all_plans
+            if plan.overall_run_name not in measuring]
+
+
+def run_tests_with_docker_image(root_dir: str,
+                                images: List[TestContainer],
+                                auto_skip: bool,
+                                size_of_sample: int,
+                                change_threshold: float,
+                                results_dir: str,
+                                should_plot: bool = False,
+                                cpu_slots: Optional[List[CpuSlot]] = None,
+                                baseline: Optional[BaselineSettings] = None,
+                                adaptive: Optional[AdaptiveSettings] = None,
+                                execution: Optional[ExecutionSettings] = None,
+                                sampler: Optional[SamplerSettings] = None,
+                                results_db: Optional[str] = None,
+                                export_csv: bool = True,
+                                hosts: Optional[HostPool] = None,
+                                profile: Optional[ResourceProfile] = None,
+                                test_profiles: Optional[Dict[str, ResourceProfile]] = None,
+                                core_counts: Optional[List[int]] = None,
+                                retry: Optional[RetrySettings] = None,
+                                resume: bool = False) -> List[TestOutcome]:
+    orchestrator = __get_orchestrator(cpu_slots, hosts)
+    return orchestrator.run(run_tests_with_docker_image_async(orchestrator,
+                                                              root_dir = root_dir,
+                                                              images = images,
+                                                              auto_skip = auto_skip,
+                                                              size_of_sample = size_of_sample,
+                                                              change_threshold = change_threshold,
+                                                              results_dir = results_dir,
+                                                              should_plot = should_plot,
+                                                              baseline = baseline,
+                                                              adaptive = adaptive,
+                                                              execution = execution,
+                                                              sampler = sampler,
+                                                              results_db = results_db,
+                                                              export_csv = export_csv,
+                                                              profile = profile,
+                                                              test_profiles = test_profiles,
+                                                              core_counts = core_counts,
+                                                              retry = retry,
+                                                              resume = resume))
+
+
+def get_test_plans(root_dir: str, docker_image_prefix: str,
+                   timer_image: Optional[str] = None,
+                   only_tests: Optional[List[str]] = None) -> Iterator[TestPlan]:
     logging.info("Finding tests.")
-    for test, files in get_tests(root_dir):
+    for test, files in get_tests(root_dir, only_tests = only_tests):
         logging.info("Found test: {0}".format(test.replace(root_dir, "")))
-        for dockerfile, entry_command, file in generate_docker_file(test, files, root_dir):
+        for dockerfile, entry_command, file, runtime in generate_docker_file(test, files, root_dir,
+                                                                             timer_image = timer_image):
             if entry_command.startswith("./"):
                 test_file = (file.split(" ")[-1]).split(".")[0]  # Get the filename
             else:
                 test_file = (entry_command.split(" ")[-1]).split(".")[0]
 
             # Format the output name based on the test file and command
-            base_plot_name = test.replace(root_dir, "")[1:] + "_{0}_" + entry_command.split(" ")[0] + "_" + test_file
-            first_run_plot_base_name = base_plot_name.format("first")
-            overall_run_base_plot_name = base_plot_name.format("overall")
-
-            # Build the docker image (if necessary)
+            base_plot_name = test.replace(root_dir, "")[1:] + "_{0}_" + runtime + "_" + test_file
 
             docker_image_name = "{0}_{1}_{2}:latest".format(
                     docker_image_prefix,
                     dockerfile[len("images/Dockerfile_"):].lower(),
-                    test_file
+                    test_file.lower()  # Java classes are capitalized, image names can't be.
             )
-            built_image_name, success = build_docker_image(docker_image_name = docker_image_name, # typing: ignore
-                                                            client = client,
-                                                            dockerfile = dockerfile,
-                                                            root_dir = root_dir)
 
-            if built_image_name is None:
-                built_image_name = ""
+            yield TestPlan(image = docker_image_name,
+                           run_command = entry_command,
+                           test_name = test_file,
+                           dockerfile = dockerfile,
+                           first_run_name = base_plot_name.format("first"),
+                           overall_run_name = base_plot_name.format("overall"),
+                           cache_key = None,
+                           runtime = runtime,
+                           workdir = test,
+                           profile = None)
 
-            if not success:
-                logging.warning("Building image failed.")
-            else:
-                __run_test_with_name(client = client,
-                                     root_dir = root_dir,
-                                     docker_image_name = built_image_name,
-                                     test_command = entry_command,
-                                     auto_skip = auto_skip,
-                                     size_of_sample = size_of_sample,
-                                     change_threshold = change_threshold,
-                                     results_dir = results_dir,
-                                     test_name = test_file,
-                                     first_run_plot_base_name = first_run_plot_base_name,
-                                     overall_run_plot_base_name = overall_run_base_plot_name,
-                                     should_plot = should_plot)
\ No newline at end of file
+
+async def run_tests_async(orchestrator: Orchestrator, root_dir: str, auto_skip: bool, docker_image_prefix: str,
+                          size_of_sample: int, change_threshold: float, results_dir: str, should_plot: bool = False,
+                          build_workers: int = 4,
+                          baseline: Optional[BaselineSettings] = None,
+                          adaptive: Optional[AdaptiveSettings] = None,
+                          execution: Optional[ExecutionSettings] = None,
+                          sampler: Optional[SamplerSettings] = None,
+                          results_db: Optional[str] = None,
+                          export_csv: bool = True,
+                          only_tests: Optional[List[str]] = None,
+                          profile: Optional[ResourceProfile] = None,
+                          test_profiles: Optional[Dict[str, ResourceProfile]] = None,
+                          core_counts: Optional[List[int]] = None,
+                          retry: Optional[RetrySettings] = None,
+                          resume: bool = False) -> List[TestOutcome]:
+    baseline = baseline if baseline is not None else DEFAULT_BASELINE
+    execution = execution if execution is not None else DEFAULT_EXECUTION
+    native = execution.backend == NATIVE_BACKEND
+    hosts = None if native else orchestrator.hosts if orchestrator.hosts is not None else HostPool()
+
+    # The test images copy the timer out of the benchmark image, so it has to exist first (on every host).
+    timer_image = next(iter((await __get_bench_images(orchestrator, hosts, root_dir)).values()), None) \
+        if hosts is not None and execution.timing == "container" else None
+
+    build_cache = BuildCache(__get_cache_file(results_dir))
+    store = ResultsStore(results_db if results_db is not None else get_results_db(results_dir))
+    base_plans = assign_profiles(list(get_test_plans(root_dir = root_dir,
+                                                     docker_image_prefix = docker_image_prefix,
+                                                     timer_image = timer_image,
+                                                     only_tests = only_tests)),
+                                 profile if profile is not None else LEGACY_PROFILE, test_profiles or {})
+    all_plans = expand_scaling(base_plans, core_counts or [])
+    plans = await orchestrator.call(__skip_cached,
+                                    client = hosts.client() if hosts is not None else None,
+                                    root_dir = root_dir,
+                                    plans = all_plans,
+                                    build_cache = build_cache,
+                                    auto_skip = auto_skip,
+                                    size_of_sample = size_of_sample,
+                                    change_threshold = change_threshold,
+                                    baseline = baseline,
+                                    adaptive = adaptive,
+                                    execution = execution,
+                                    sampler = sampler,
+                                    resume = resume)
+
+    outcomes = __skipped(all_plans, plans)
+    if hosts is None:
+        # Nothing to build, only what can't run on this machine as it is gets left out.
+        built = []
+        for plan in plans:
+            if find_native_command(plan.run_command, plan.workdir) is None:
+                logging.warning("Can't run {0} ({1}) natively, `{2}` isn't available here. Skipping.".format(
+                        plan.test_name, plan.runtime, plan.run_command.split(" ")[0]))
+                outcomes.append(__outcome(plan, UNAVAILABLE, "`{0}` isn't available here".format(
+                        plan.run_command.split(" ")[0])))
+                continue
+            built.append(plan.image)
+    else:
+        # Build everything up front, so no build runs next to a measurement.
+        # Scaling points share their image, it's built once.
+        images = list(dict.fromkeys((plan.image, plan.dockerfile) for plan in plans))
+        logging.info("Building {0} test images on {1} host(s)".format(len(images), len(hosts.names())))
+        built, failed = await __build_on_hosts(orchestrator, hosts, root_dir, images, build_workers)
+        for image in failed:
+            logging.warning("Building image failed: {0}".format(image))
+        outcomes.extend(__outcome(plan, UNAVAILABLE, "its image didn't build") for plan in plans
+                        if plan.image in failed)
+        # Every base image is here now, so the key is the one the next run will compute before its build.
+        plans = await orchestrator.call(__key_plans, hosts.client(), root_dir, plans, size_of_sample,
+                                        change_threshold, baseline, adaptive, execution, sampler)
+
+    outcomes += await __measure_tests(orchestrator = orchestrator,
+                                      hosts = hosts,
+                                      root_dir = root_dir,
+                                      plans = [plan for plan in plans if plan.image in built],
+                                      build_cache = build_cache,
+                                      size_of_sample = size_of_sample,
+                                      change_threshold = change_threshold,
+                                      results_dir = results_dir,
+                                      baseline = baseline,
+                                      adaptive = adaptive,
+                                      execution = execution,
+                                      sampler = sampler,
+                                      store = store,
+                                      export_csv = export_csv,
+                                      runner = NativeRunner(cgroup_root = sampler.cgroup_root if sampler is not None
+                                                            else DEFAULT_SAMPLER.cgroup_root) if native else None,
+                                      retry = retry,
+                                      resume = resume)
+    await __write_scaling(orchestrator, store, results_dir, base_plans, core_counts)
+
+    if should_plot:
+        # Rendered once nothing is being measured anymore, so the worker processes can use every core.
+        await orchestrator.call(render_report, results_dir, store, [plan.overall_run_name for plan in all_plans])
+    summarize(outcomes, results_dir)
+    return outcomes
+
+
+def run_tests(root_dir: str, auto_skip: bool, docker_image_prefix: str,
+              size_of_sample: int, change_threshold: float, results_dir: str, should_plot: bool = False,
+              cpu_slots: Optional[List[CpuSlot]] = None, build_workers: int = 4,
+              baseline: Optional[BaselineSettings] = None,
+              adaptive: Optional[AdaptiveSettings] = None,
+              execution: Optional[ExecutionSettings] = None,
+              sampler: Optional[SamplerSettings] = None,
+              results_db: Optional[str] = None,
+              export_csv: bool = True,
+              only_tests: Optional[List[str]] = None,
+              hosts: Optional[HostPool] = None,
+              profile: Optional[ResourceProfile] = None,
+              test_profiles: Optional[Dict[str, ResourceProfile]] = None,
+              core_counts: Optional[List[int]] = None,
+              retry: Optional[RetrySettings] = None,
+              resume: bool = False) -> List[TestOutcome]:
+    if execution is not None and execution.backend == NATIVE_BACKEND:
+        # No docker at all, the slots are this machine's.
+        orchestrator = Orchestrator(cpu_slots if cpu_slots is not None else __default_cpu_slots())
+    else:
+        orchestrator = __get_orchestrator(cpu_slots, hosts)
+    return orchestrator.run(run_tests_async(orchestrator,
+                                            root_dir = root_dir,
+                                            auto_skip = auto_skip,
+                                            docker_image_prefix = docker_image_prefix,
+                                            size_of_sample = size_of_sample,
+                                            change_threshold = change_threshold,
+                                            results_dir = results_dir,
+                                            should_plot = should_plot,
+                                            build_workers = build_workers,
+                                            baseline = baseline,
+                                            adaptive = adaptive,
+                                            execution = execution,
+                                            sampler = sampler,
+                                            results_db = results_db,
+                                            export_csv = export_csv,
+                                            only_tests = only_tests,
+                                            profile = profile,
+                                            test_profiles = test_profiles,
+                                            core_counts = core_counts,
+                                            retry = retry,
+                                            resume = resume))
+
+
+async def build_tests_async(orchestrator: Orchestrator, root_dir: str, docker_image_prefix: str,
+                            build_workers: int = 4,
+                            execution: Optional[ExecutionSettings] = None,
+                            only_tests: Optional[List[str]] = None) -> Tuple[List[str], List[str]]:
+    # Only the images `run_tests` would measure, e.g. to build them in a separate CI step.
+    hosts = orchestrator.hosts if orchestrator.hosts is not None else HostPool()
+    execution = execution if execution is not None else DEFAULT_EXECUTION
+    timer_image = next(iter((await __get_bench_images(orchestrator, hosts, root_dir)).values()), None) \
+        if execution.timing == "container" else None
+
+    plans = list(get_test_plans(root_dir = root_dir,
+                                docker_image_prefix = docker_image_prefix,
+                                timer_image = timer_image,
+                                only_tests = only_tests))
+    logging.info("Building {0} test images on {1} host(s)".format(len(plans), len(hosts.names())))
+    built, failed = await __build_on_hosts(orchestrator, hosts, root_dir,
+                                           [(plan.image, plan.dockerfile) for plan in plans], build_workers)
+    for image in failed:
+        logging.warning("Building image failed: {0}".format(image))
+    return built, failed
+
+
+def build_tests(root_dir: str, docker_image_prefix: str, build_workers: int = 4,
+                execution: Optional[ExecutionSettings] = None,
+                only_tests: Optional[List[str]] = None,
+                hosts: Optional[HostPool] = None) -> Tuple[List[str], List[str]]:
+    orchestrator = __get_orchestrator(None, hosts)
+    return orchestrator.run(build_tests_async(orchestrator,
+                                              root_dir = root_dir,
+                                              docker_image_prefix = docker_image_prefix,
+                                              build_workers = build_workers,
+                                              execution = execution,
+                                              only_tests = only_tests))
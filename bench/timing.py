@@ -0,0 +1,29 @@
+import json
+import logging
+from typing import Optional, Union
+
+from bench.types import TimingInfo
+
+# Written by resources/timer.cpp as the last line of the container's output.
+TIMING_PREFIX = "BENCH_TIMING "
+TIMER_COMMAND = "/bench_timer"
+
+
+def parse_timing(output: Union[bytes, str]) -> Optional[TimingInfo]:
+    text = output.decode("utf-8", errors = "replace") if isinstance(output, bytes) else output
+    for line in reversed(text.splitlines()):
+        line = line.strip()
+        if not line.startswith(TIMING_PREFIX):
+            continue
+        try:
+            timing = json.loads(line[len(TIMING_PREFIX):])
+            return TimingInfo(elapsed = (timing["end_ns"] - timing["start_ns"]) / 1e9,
+                              user_time = timing["user_us"] / 1e6,
+                              sys_time = timing["sys_us"] / 1e6,
+                              max_rss_kb = timing["max_rss_kb"],
+                              voluntary_switches = timing["voluntary_switches"],
+                              involuntary_switches = timing["involuntary_switches"])
+        except (ValueError, KeyError) as e:
+            logging.warning("Could not parse timing line: {0} ({1})".format(line, e))
+            return None
+    return None
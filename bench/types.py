@@ -1,7 +1,68 @@
 import collections
 
 TestResult = collections.namedtuple("TestResult", ["time_taken", "status", "iteration",
-                                                   "test_time", "system_info"],
+                                                   "test_time", "stats_file", "orchestration_time",
+                                                   "timing", "host"],
                                     rename = False)
-TestContainer = collections.namedtuple("TestContainer", ["image", "run_command", "test_name"],
+# The docker host a sample ran on, None is the local one.
+TestResult.__new__.__defaults__ = (None,)  # type: ignore
+TestContainer = collections.namedtuple("TestContainer", ["image", "run_command", "test_name", "sweep"],
                                        rename = False)
+# Containers without a sweep can still be made with the original three fields.
+TestContainer.__new__.__defaults__ = (None,)  # type: ignore
+Sweep = collections.namedtuple("Sweep", ["parameter", "values", "expected"],
+                               rename = False)
+Sweep.__new__.__defaults__ = (None,)  # type: ignore
+CpuSlot = collections.namedtuple("CpuSlot", ["index", "cpus", "node", "host"],
+                                 rename = False)
+CpuSlot.__new__.__defaults__ = (None,)  # type: ignore
+TestPlan = collections.namedtuple("TestPlan", ["image", "run_command", "test_name", "dockerfile",
+                                             "first_run_name", "overall_run_name", "cache_key", "runtime",
+                                             "workdir", "profile"],
+                                  rename = False)
+# The test's directory on this machine, what a native run starts in. Prebuilt images don't have one.
+# Without a resource profile a test runs with the legacy one.
+TestPlan.__new__.__defaults__ = (None, None)  # type: ignore
+BaselineSettings = collections.namedtuple("BaselineSettings", ["mode", "target_duration", "window_size",
+                                                             "refresh_every", "max_age"],
+                                          rename = False)
+AdaptiveSettings = collections.namedtuple("AdaptiveSettings", ["min_samples", "max_samples", "target_ci_width",
+                                                             "confidence"],
+                                          rename = False)
+ExecutionSettings = collections.namedtuple("ExecutionSettings", ["mode", "warmup_iterations", "timing",
+                                                                 "host_affinity", "backend"],
+                                           rename = False)
+ExecutionSettings.__new__.__defaults__ = (False, "docker")  # type: ignore
+TimingInfo = collections.namedtuple("TimingInfo", ["elapsed", "user_time", "sys_time", "max_rss_kb",
+                                                   "voluntary_switches", "involuntary_switches"],
+                                    rename = False)
+SamplerSettings = collections.namedtuple("SamplerSettings", ["source", "rate", "cgroup_root"],
+                                         rename = False)
+RunContext = collections.namedtuple("RunContext", ["git_commit", "host", "started_at"],
+                                    rename = False)
+Comparison = collections.namedtuple("Comparison", ["test_name", "runtime", "label", "reference_runs",
+                                                   "reference_samples", "candidate_samples", "median_ratio",
+                                                   "ci_low", "ci_high", "p_value", "verdict"],
+                                    rename = False)
+ComplexityFit = collections.namedtuple("ComplexityFit", ["test_name", "runtime", "metric", "points", "exponent",
+                                                         "constant", "r_squared", "best_fit", "expected",
+                                                         "exceeds_expected"],
+                                       rename = False)
+PlotJob = collections.namedtuple("PlotJob", ["output", "title", "xlabel", "ylabel", "x", "y", "data_hash"],
+                                 rename = False)
+BuildContext = collections.namedtuple("BuildContext", ["digest", "data", "files", "size"],
+                                      rename = False)
+# `cores` of the sample's CPU slot (all of it when None), a CFS quota per period in microseconds (none when None),
+# and docker's memory limits, e.g. "2g".
+ResourceProfile = collections.namedtuple("ResourceProfile", ["name", "cores", "cpu_quota", "cpu_period",
+                                                             "mem_limit", "memswap_limit"],
+                                         rename = False)
+ScalingPoint = collections.namedtuple("ScalingPoint", ["test_name", "runtime", "label", "cores", "median_time",
+                                                       "speedup", "efficiency"],
+                                      rename = False)
+# Timeouts in seconds, None is no limit.
+RetrySettings = collections.namedtuple("RetrySettings", ["max_attempts", "base_delay", "max_delay", "test_timeout",
+                                                         "benchmark_timeout"],
+                                       rename = False)
+TestOutcome = collections.namedtuple("TestOutcome", ["test_name", "runtime", "label", "status", "detail"],
+                                     rename = False)
@@ -0,0 +1,130 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union, Any
+
+from docker import DockerClient
+from docker.models.containers import Container
+
+from bench.bdocker import get_exec_command
+from bench.stats import StatsWriter
+from bench.timing import TIMER_COMMAND
+
+# Keeps the container alive between samples, without using any CPU.
+IDLE_ENTRYPOINT = ["tail", "-f", "/dev/null"]
+
+
+def exec_in_container(client: DockerClient, container: Container, cmd: List[str]) -> Tuple[float, int, bytes]:
+    exec_id = client.api.exec_create(container.id, cmd, tty = True)["Id"]
+    start = time.time()
+    output = client.api.exec_start(exec_id, tty = True)
+    end = time.time()
+    exit_code = client.api.exec_inspect(exec_id)["ExitCode"]
+    return end - start, int(exit_code if exit_code is not None else -1), output
+
+
+def stream_stats(container: Container, stats_writer: StatsWriter, stop: threading.Event) -> None:
+    # The container outlives the command, so this returns the moment the command is done rather than
+    # after docker's next stats about a second later. The stream is read on a thread of its own,
+    # which closes it when that next stats arrives, and nothing is written once this returns.
+    lock = threading.Lock()
+
+    def read() -> None:
+        stats = container.stats(stream = True, decode = True)
+        try:
+            for s in stats:
+                with lock:
+                    if stop.is_set():
+                        break
+                    stats_writer.append_stats(s)
+        except Exception as e:
+            logging.debug("Stats stream of {0} ended: {1}".format(container.id, e))
+        finally:
+            stats.close()
+
+    threading.Thread(target = read, daemon = True).start()
+    stop.wait()
+    with lock:
+        pass
+
+
+class WarmContainerPool(object):
+    # One long-lived container per image and CPU slot, samples are run in it with `exec`.
+    def __init__(self, client: DockerClient, image: str, command: str, warmup_iterations: int = 1,
+                 timed: bool = False) -> None:
+        self.client = client
+        self.image = image
+        self.command = command
+        self.warmup_iterations = max(0, warmup_iterations)
+        self.timed = timed
+        self.cold_start_times: List[float] = []
+        self._cmd: Optional[List[str]] = None
+        self._containers: Dict[str, Container] = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "WarmContainerPool":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def cmd(self) -> List[str]:
+        with self._lock:
+            if self._cmd is None:
+                self._cmd = get_exec_command(self.client, self.image, self.command)
+                if self.timed:
+                    self._cmd = [TIMER_COMMAND] + self._cmd
+            return self._cmd
+
+    def get(self, container_settings: Dict[str, Union[str, int, bool]]) -> Container:
+        slot = str(container_settings.get("cpuset_cpus", ""))
+        with self._lock:
+            container = self._containers.get(slot)
+        if container is not None:
+            return container
+
+        settings = {key: value for key, value in container_settings.items() if key not in ["tty", "stdout", "stderr"]}
+        start = time.time()
+        container = self.client.containers.run(image = self.image,
+                                               entrypoint = IDLE_ENTRYPOINT,
+                                               **settings)
+
+        # The first run pays for the container, the interpreter and any caches, the warm-up ones are thrown away.
+        for i in range(self.warmup_iterations):
+            _, exit_code, output = exec_in_container(self.client, container, self.cmd())
+            if i == 0:
+                self.cold_start_times.append(time.time() - start)
+            if exit_code != 0:
+                logging.warning("Warm-up run of {0} failed: {1}".format(self.image,
+                                                                       output.decode("utf-8", errors = "replace")))
+
+        if self.warmup_iterations == 0:
+            self.cold_start_times.append(time.time() - start)
+
+        logging.info("Started warm container for {0} on cpus {1}".format(self.image, slot))
+        with self._lock:
+            self._containers[slot] = container
+        return container
+
+    def discard(self, container_settings: Dict[str, Union[str, int, bool]]) -> None:
+        # Kills the slot's container, e.g. with a hung command in it, the next sample starts a fresh one.
+        slot = str(container_settings.get("cpuset_cpus", ""))
+        with self._lock:
+            container = self._containers.pop(slot, None)
+        if container is not None:
+            container.remove(force = True)
+
+    def cold_start_time(self) -> Optional[float]:
+        if len(self.cold_start_times) == 0:
+            return None
+        return sum(self.cold_start_times) / len(self.cold_start_times)
+
+    def close(self) -> None:
+        with self._lock:
+            containers = list(self._containers.values())
+            self._containers.clear()
+        for container in containers:
+            try:
+                container.remove(force = True)
+            except Exception as e:
+                logging.warning("Failed to remove warm container {0}: {1}".format(container.id, e))
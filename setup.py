@@ -52,5 +52,6 @@ setup(
             ]
         },
         package_data={'bench': ['resources/argparse.yml',
-                                'resources/benchmark.cpp']},
+                                'resources/benchmark.cpp',
+                                'resources/timer.cpp']},
 )
\ No newline at end of file
@@ -0,0 +1,83 @@
+import pathlib
+from typing import Any, Dict, Optional
+
+import docker
+
+from bench.cache import compute_cache_key, get_dockerfile_base_images
+
+DOCKERFILE = """FROM gcc:13 AS builder
+COPY test/main.cpp ./main.cpp
+RUN g++ -O2 -static main.cpp -o /out/main
+
+FROM builder AS tested
+FROM debian:bookworm-slim
+COPY --from=builder /out/main ./main
+"""
+
+
+class FakeImages(object):
+    # What a docker host has, image reference to id.
+    def __init__(self, ids: Dict[str, str]) -> None:
+        self.ids = ids
+
+    def get(self, image: str) -> Any:
+        if image not in self.ids:
+            raise docker.errors.ImageNotFound(image)
+        return type("Image", (object,), {"id": self.ids[image]})()
+
+
+class FakeClient(object):
+    def __init__(self, ids: Dict[str, str]) -> None:
+        self.images = FakeImages(ids)
+
+
+def __key(root_dir: pathlib.Path, client: Optional[FakeClient], dockerfile: Optional[str] = "Dockerfile",
+          image: str = "overall_test") -> Optional[str]:
+    return compute_cache_key(root_dir = str(root_dir), dockerfile = dockerfile, image = image,
+                             run_params = {"size_of_sample": 5}, client = client)
+
+
+def __test_dir(tmp_path: pathlib.Path) -> pathlib.Path:
+    (tmp_path / "test").mkdir()
+    (tmp_path / "test" / "main.cpp").write_text("int main() {}\n")
+    (tmp_path / "Dockerfile").write_text(DOCKERFILE)
+    return tmp_path
+
+
+def test_base_images_leave_out_stages() -> None:
+    assert get_dockerfile_base_images(DOCKERFILE) == ["gcc:13", "debian:bookworm-slim"]
+
+
+def test_key_waits_for_base_images(tmp_path: pathlib.Path) -> None:
+    # Not pulled yet, so it can't be compared, and the key after the pull is the one every later run gets.
+    root_dir = __test_dir(tmp_path)
+    assert __key(root_dir, FakeClient({"gcc:13": "sha256:1"})) is None
+
+    pulled = FakeClient({"gcc:13": "sha256:1", "debian:bookworm-slim": "sha256:2"})
+    assert __key(root_dir, pulled) is not None
+    assert __key(root_dir, pulled) == __key(root_dir, FakeClient(dict(pulled.images.ids)))
+
+
+def test_key_changes_with_base_image_and_sources(tmp_path: pathlib.Path) -> None:
+    root_dir = __test_dir(tmp_path)
+    key = __key(root_dir, FakeClient({"gcc:13": "sha256:1", "debian:bookworm-slim": "sha256:2"}))
+    # Re-pulled under the same tag.
+    assert __key(root_dir, FakeClient({"gcc:13": "sha256:3", "debian:bookworm-slim": "sha256:2"})) != key
+
+    (root_dir / "test" / "main.cpp").write_text("int main() { return 0; }\n")
+    assert __key(root_dir, FakeClient({"gcc:13": "sha256:1", "debian:bookworm-slim": "sha256:2"})) != key
+
+
+def test_prebuilt_image_key(tmp_path: pathlib.Path) -> None:
+    assert __key(tmp_path, FakeClient({}), dockerfile = None, image = "myimage:latest") is None
+    key = __key(tmp_path, FakeClient({"myimage:latest": "sha256:1"}), dockerfile = None, image = "myimage:latest")
+    assert key is not None
+    # Rebuilt under the same tag.
+    assert __key(tmp_path, FakeClient({"myimage:latest": "sha256:2"}), dockerfile = None,
+                 image = "myimage:latest") != key
+
+
+def test_native_key_uses_references(tmp_path: pathlib.Path) -> None:
+    root_dir = __test_dir(tmp_path)
+    assert __key(root_dir, None) is not None
+    assert __key(root_dir, None) == __key(root_dir, None)
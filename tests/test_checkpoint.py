@@ -0,0 +1,79 @@
+import os
+import pathlib
+from typing import Any, Dict
+
+import bench.types
+from bench.checkpoint import CHECKPOINT_FILE, SampleCheckpoint, find_checkpoints, read_checkpoint
+
+HEADER = {"label": "overall_test", "first_run": "first_test", "cache_key": "abc"}
+
+
+def __result(iteration: int) -> bench.types.TestResult:
+    # Through the module, so pytest doesn't take TestResult for a test class.
+    timing = bench.types.TimingInfo(elapsed = 1.0, user_time = 0.75, sys_time = 0.125, max_rss_kb = 2048,
+                                    voluntary_switches = 3, involuntary_switches = 1)
+    return bench.types.TestResult(time_taken = 1.5 + iteration,
+                                  status = 0,
+                                  iteration = iteration,
+                                  test_time = 1.0,
+                                  stats_file = "stats_{0}.bin".format(iteration),
+                                  orchestration_time = 0.25,
+                                  timing = timing if iteration % 2 == 0 else None,
+                                  host = "remote" if iteration == 1 else None)
+
+
+def __interrupted(samples_dir: str, header: Dict[str, Any], samples: int) -> None:
+    # A run that stopped after `samples` samples, without completing the test.
+    checkpoint = SampleCheckpoint(samples_dir, header)
+    checkpoint.start(resume = False)
+    for iteration in range(samples):
+        checkpoint.append(__result(iteration))
+    checkpoint.close()
+
+
+def test_resume_keeps_samples(tmp_path: pathlib.Path) -> None:
+    samples_dir = str(tmp_path / "samples" / "overall_test")
+    __interrupted(samples_dir, HEADER, 3)
+
+    checkpoint = SampleCheckpoint(samples_dir, dict(HEADER))
+    assert checkpoint.start(resume = True) == [__result(0), __result(1), __result(2)]
+    checkpoint.append(__result(3))
+    checkpoint.close()
+    assert read_checkpoint(os.path.join(samples_dir, CHECKPOINT_FILE)) == (HEADER, [__result(i) for i in range(4)])
+
+
+def test_without_resume_starts_over(tmp_path: pathlib.Path) -> None:
+    samples_dir = str(tmp_path / "overall_test")
+    __interrupted(samples_dir, HEADER, 3)
+    assert SampleCheckpoint(samples_dir, HEADER).start(resume = False) == []
+    assert read_checkpoint(os.path.join(samples_dir, CHECKPOINT_FILE)) == (HEADER, [])
+
+
+def test_changed_test_starts_over(tmp_path: pathlib.Path) -> None:
+    # Samples of another build of the test aren't kept.
+    samples_dir = str(tmp_path / "overall_test")
+    __interrupted(samples_dir, HEADER, 3)
+    assert SampleCheckpoint(samples_dir, dict(HEADER, cache_key = "def")).start(resume = True) == []
+
+
+def test_partly_written_sample_is_ignored(tmp_path: pathlib.Path) -> None:
+    samples_dir = str(tmp_path / "overall_test")
+    __interrupted(samples_dir, HEADER, 2)
+    with open(os.path.join(samples_dir, CHECKPOINT_FILE), "a") as f:
+        f.write('{"time_taken": 1.')
+
+    assert SampleCheckpoint(samples_dir, HEADER).start(resume = True) == [__result(0), __result(1)]
+
+
+def test_complete_removes_checkpoint(tmp_path: pathlib.Path) -> None:
+    results_dir = str(tmp_path)
+    __interrupted(os.path.join(results_dir, "samples", "overall_test"), HEADER, 2)
+    __interrupted(os.path.join(results_dir, "samples", "overall_other"), dict(HEADER, label = "overall_other"), 1)
+    assert [(header["label"], len(results)) for header, results in find_checkpoints(results_dir)] == \
+        [("overall_other", 1), ("overall_test", 2)]
+
+    checkpoint = SampleCheckpoint(os.path.join(results_dir, "samples", "overall_test"), HEADER)
+    checkpoint.start(resume = True)
+    checkpoint.complete()
+    assert [header["label"] for header, _ in find_checkpoints(results_dir)] == ["overall_other"]
+    assert list(find_checkpoints(str(tmp_path / "missing"))) == []
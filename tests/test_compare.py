@@ -0,0 +1,73 @@
+import math
+import pathlib
+
+import numpy as np
+import pytest
+
+from bench.compare import bootstrap_median_ratio, compare_samples, mann_whitney_u, report
+from bench.types import Comparison
+
+
+def __compare(reference: np.ndarray, candidate: np.ndarray) -> Comparison:
+    verdict, ratio, low, high, p_value = compare_samples(reference, candidate)
+    return Comparison(test_name = "test", runtime = "python", label = "overall_test", reference_runs = 1,
+                      reference_samples = len(reference), candidate_samples = len(candidate),
+                      median_ratio = ratio, ci_low = low, ci_high = high, p_value = p_value, verdict = verdict)
+
+
+def __samples(seed: int = 1) -> np.ndarray:
+    return np.random.RandomState(seed).normal(1.0, 0.01, 30)
+
+
+def test_mann_whitney_u_separated_samples() -> None:
+    # Every candidate value is above every reference value, U is n1 * n2.
+    u, p_value = mann_whitney_u(np.arange(1.0, 11.0), np.arange(11.0, 21.0))
+    assert u == 100.0
+    assert p_value == pytest.approx(0.000182672, rel = 1e-4)
+
+
+def test_mann_whitney_u_with_ties() -> None:
+    u, p_value = mann_whitney_u(np.array([1.0, 2.0, 2.0, 3.0, 4.0]), np.array([2.0, 3.0, 5.0, 6.0, 6.0, 7.0]))
+    assert u == 25.5
+    assert p_value == pytest.approx(0.0641466, rel = 1e-4)
+
+
+def test_mann_whitney_u_identical_samples() -> None:
+    assert mann_whitney_u(np.ones(5), np.ones(5)) == (12.5, 1.0)
+    u, p_value = mann_whitney_u(np.empty(0), np.ones(5))
+    assert math.isnan(u) and p_value == 1.0
+
+
+def test_bootstrap_median_ratio() -> None:
+    assert bootstrap_median_ratio(np.array([1.0, 1.0, 1.0]), np.array([2.0, 2.0, 2.0])) == (2.0, 2.0, 2.0)
+
+    reference = __samples()
+    ratio, low, high = bootstrap_median_ratio(reference, reference * 1.2)
+    assert ratio == pytest.approx(1.2)
+    assert low < ratio < high
+    # Seeded, the same samples give the same interval.
+    assert bootstrap_median_ratio(reference, reference * 1.2) == (ratio, low, high)
+
+
+def test_compare_samples_verdicts() -> None:
+    reference = __samples()
+    assert compare_samples(reference, reference.copy())[0] == "unchanged"
+    assert compare_samples(reference, reference * 1.2)[0] == "regression"
+    assert compare_samples(reference, reference * 0.8)[0] == "improvement"
+    # Significant, but smaller than the effect size.
+    assert compare_samples(reference, reference * 1.01)[0] == "unchanged"
+    assert compare_samples(reference[:1], reference)[0] == "insufficient"
+
+
+def test_report_identical_samples_pass(tmp_path: pathlib.Path) -> None:
+    reference = __samples()
+    output_csv = str(tmp_path / "compare.csv")
+    assert report([__compare(reference, reference.copy())], output_csv) == 0
+    with open(output_csv, "r") as f:
+        assert "unchanged" in f.read()
+
+
+def test_report_shifted_sample_fails() -> None:
+    reference = __samples()
+    assert report([__compare(reference, reference * 0.8), __compare(reference, reference * 1.2)]) == 1
+    assert report([__compare(reference, reference * 0.8)]) == 0
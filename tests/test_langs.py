@@ -0,0 +1,34 @@
+from typing import List
+
+import pytest
+
+from bench.langs import LANGUAGES, Language, get_languages
+
+
+def test_incomplete_language_fails_early() -> None:
+    class NoDockerfile(Language):
+        name = "incomplete"
+        extensions = ["x"]
+
+        def entry_command(self, file: str) -> str:
+            return "./{0}".format(file)
+
+    with pytest.raises(TypeError):
+        NoDockerfile()  # type: ignore
+
+
+def test_languages_by_extension() -> None:
+    assert sorted(language.name for language in get_languages("main.py")) == ["pypy", "python"]
+    assert [language.name for language in get_languages("main.go")] == ["go"]
+    assert get_languages("Makefile") == []
+
+
+@pytest.mark.parametrize("name", sorted(LANGUAGES))
+def test_manifests_are_installed_before_the_source(name: str) -> None:
+    # Editing a test mustn't invalidate the layers its dependencies are installed in.
+    language = LANGUAGES[name]
+    file = "main.{0}".format(language.extensions[0])
+    lines: List[str] = language.dockerfile("tests/main", file, language.manifests)
+    source = next(i for i, line in enumerate(lines) if line.startswith("COPY tests/main/{0}".format(file)))
+    for manifest in language.manifests:
+        assert any(line.startswith("COPY tests/main/{0}".format(manifest)) for line in lines[:source]), manifest
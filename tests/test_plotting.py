@@ -0,0 +1,47 @@
+import os
+import pathlib
+import subprocess
+import sys
+from typing import List
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Each time the script's top level runs, it notes it in imports.log.
+RENDER_SCRIPT = """
+import os
+from bench.plotting import render_plots
+from bench.types import PlotJob
+
+with open("imports.log", "a") as f:
+    f.write("{{0}}\\n".format(os.getpid()))
+
+
+def main():
+    jobs = [PlotJob(output = os.path.abspath("plot_{{0}}.png".format(i)), title = "plot", xlabel = "x",
+                    ylabel = "y", x = [1, 2, 3], y = [i, 2, 1], data_hash = str(i)) for i in range(4)]
+    print(len(render_plots(jobs, os.path.abspath(os.path.join("plots", "manifest.json")), max_workers = 2)))
+
+{0}
+"""
+
+
+def __render(tmp_path: pathlib.Path, main: str) -> List[str]:
+    # Runs the script as a user of bench would, and returns the pids that ran its top level.
+    script = tmp_path / "render.py"
+    script.write_text(RENDER_SCRIPT.format(main))
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join([ROOT_DIR, os.environ.get("PYTHONPATH", "")]))
+    output = subprocess.check_output([sys.executable, str(script)], env = env, cwd = str(tmp_path), timeout = 120)
+    assert output.decode("utf-8").split() == ["4"]
+    assert all((tmp_path / "plot_{0}.png".format(i)).exists() for i in range(4))
+    return (tmp_path / "imports.log").read_text().split()
+
+
+def test_guarded_script_renders_in_workers(tmp_path: pathlib.Path) -> None:
+    pids = __render(tmp_path, 'if __name__ == "__main__":\n    main()')
+    # The script itself, and the workers that imported it again without running main().
+    assert len(set(pids)) > 1
+
+
+def test_unguarded_script_renders_in_process(tmp_path: pathlib.Path) -> None:
+    # Workers would run the whole script again.
+    assert len(__render(tmp_path, "main()")) == 1
@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+# `bench --help` and every command's start pay for what bench.bench imports, the heavy modules
+# are only imported by the commands that need them.
+IMPORT_BUDGET = 0.3
+HEAVY_MODULES = ["docker", "numpy", "pandas", "matplotlib"]
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE_IMPORT = """
+import sys, time
+start = time.time()
+import bench.bench
+took = time.time() - start
+print(took)
+print(" ".join(name for name in {0!r} if name in sys.modules))
+""".format(HEAVY_MODULES)
+
+
+def __import_bench() -> Tuple[float, List[str]]:
+    # A fresh interpreter, so nothing an earlier test imported counts.
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join([ROOT_DIR, os.environ.get("PYTHONPATH", "")]))
+    output = subprocess.check_output([sys.executable, "-c", MEASURE_IMPORT], env = env, cwd = ROOT_DIR)
+    took, heavy = output.decode("utf-8").splitlines()[-2:]
+    return float(took), heavy.split()
+
+
+def test_import_leaves_out_heavy_modules() -> None:
+    _, heavy = __import_bench()
+    assert heavy == [], "bench.bench imports {0}".format(", ".join(heavy))
+
+
+def test_import_fits_budget() -> None:
+    # The best of a few, so a busy machine doesn't fail the test.
+    took = min(__import_bench()[0] for _ in range(3))
+    assert took < IMPORT_BUDGET, "bench.bench took {0:.2f}s to import".format(took)
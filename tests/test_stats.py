@@ -0,0 +1,93 @@
+import math
+import pathlib
+from typing import List
+
+import numpy as np
+import pytest
+
+from bench.stats import FLUSH_EVERY, STATS_COLUMN_NAMES, StatsTable, StatsWriter, flatten_stats, load_stats
+
+COLUMNS = ["a", "b", "c"]
+
+
+def __rows(count: int) -> List[List[float]]:
+    return [[float(i), i * 2.0, -float(i)] for i in range(count)]
+
+
+def test_round_trip(tmp_path: pathlib.Path) -> None:
+    # More rows than are buffered, so some are flushed before the file is closed.
+    path = str(tmp_path / "samples" / "stats.bin")
+    with StatsWriter(path, metadata = {"source": "cgroup"}, columns = COLUMNS) as writer:
+        for row in __rows(FLUSH_EVERY * 2 + 3):
+            writer.append(row)
+
+    table = load_stats(path)
+    assert len(table) == FLUSH_EVERY * 2 + 3
+    assert table.columns == COLUMNS
+    assert table.metadata == {"source": "cgroup"}
+    np.testing.assert_array_equal(table["a"], np.arange(FLUSH_EVERY * 2 + 3, dtype = float))
+    np.testing.assert_array_equal(table["b"], table["a"] * 2)
+    np.testing.assert_array_equal(table["c"], -table["a"])
+
+
+def test_unclosed_file_is_read_by_rows(tmp_path: pathlib.Path) -> None:
+    # A sample that was cut off still has every flushed row.
+    path = str(tmp_path / "stats.bin")
+    writer = StatsWriter(path, columns = COLUMNS)
+    for row in __rows(5):
+        writer.append(row)
+    writer.flush()
+
+    table = StatsTable(path)
+    assert len(table) == 5
+    np.testing.assert_array_equal(table["b"], [0.0, 2.0, 4.0, 6.0, 8.0])
+    writer.close()
+    np.testing.assert_array_equal(StatsTable(path)["b"], [0.0, 2.0, 4.0, 6.0, 8.0])
+
+
+def test_empty_and_missing_columns(tmp_path: pathlib.Path) -> None:
+    path = str(tmp_path / "stats.bin")
+    StatsWriter(path, columns = COLUMNS).close()
+
+    table = load_stats(path)
+    assert len(table) == 0
+    assert "a" in table and "d" not in table
+    assert len(table["a"]) == 0
+    assert len(table["d"]) == 0
+
+
+def test_not_a_stats_file(tmp_path: pathlib.Path) -> None:
+    path = str(tmp_path / "stats.bin")
+    with open(path, "wb") as f:
+        f.write(b"not stats\n" * 8)
+    with pytest.raises(ValueError):
+        StatsTable(path)
+
+
+def test_docker_stats_round_trip(tmp_path: pathlib.Path) -> None:
+    stats = {
+        "read"        : "2020-05-01T12:00:01.5Z",
+        "preread"     : "2020-05-01T12:00:00.5Z",
+        "cpu_stats"   : {"cpu_usage": {"total_usage": 2000, "percpu_usage": [500, 1500]},
+                         "system_cpu_usage": 10000, "online_cpus": 2},
+        "memory_stats": {"usage": 1024, "limit": 4096, "stats": {"rss": 512}},
+        "networks"    : {"eth0": {"rx_bytes": 10, "tx_bytes": 20}, "eth1": {"rx_bytes": 1, "tx_bytes": 2}},
+    }
+    row = flatten_stats(stats)
+    assert len(row) == len(STATS_COLUMN_NAMES)
+
+    path = str(tmp_path / "stats.bin")
+    with StatsWriter(path) as writer:
+        writer.append_stats(stats)
+        writer.append_stats({})
+
+    table = load_stats(path)
+    assert table["read"][0] - table["preread"][0] == pytest.approx(1.0)
+    assert table["cpu_total"][0] == 2000
+    assert table["cpu_percpu_avg"][0] == 1000
+    assert table["memory_rss"][0] == 512
+    assert table["net_rx_bytes"][0] == 11
+    assert table["net_tx_bytes"][0] == 22
+    # Whatever docker didn't report is NaN, not 0.
+    assert math.isnan(table["cpu_throttled"][0])
+    assert all(math.isnan(value) for value in table["cpu_total"][1:])